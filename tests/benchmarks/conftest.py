@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""Local stand-ins for everything the build/start pipeline talks to: a fake GitHub serving Moodle tarballs, bare repositories of Boost Union and moodle-docker, and a moodle-docker-compose script that never touches docker."""
+# pylint: disable=redefined-outer-name
+
+import io
+import shutil
+import tarfile
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import yaml
+from dependency_injector import providers
+from git import Repo
+
+from theme_boost_union_test_envs.app import Application, application
+from theme_boost_union_test_envs.cross_cutting import (
+    ApplicationConfigManager,
+    yaml_parser,
+)
+from theme_boost_union_test_envs.domain import (
+    DatabaseSnapshotStore,
+    GitReference,
+    GitReferenceType,
+    MoodleCache,
+    MoodleDownloader,
+    Testbed,
+    TestInfrastructure,
+    invalidate_inventory,
+)
+
+REPO_ROOT = Path(__file__).parents[2]
+# roughly the shape of a Moodle tarball, just a lot smaller: many small files in nested directories
+SOURCE_FILES = 600
+
+# answers like docker compose would, for the commands the pipeline sends to the containers
+COMPOSE_STUB = """#!/bin/sh
+case "$*" in
+  *psql*) echo 0 ;;
+  *"sh -s"*) PATH="$PWD/bin:$PATH" exec sh -s ;;
+  *) cat > /dev/null 2>&1 < /dev/null ;;
+esac
+"""
+PHP_STUB = """#!/bin/sh
+echo "php $*"
+"""
+
+
+def moodle_tarball(version):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for i in range(SOURCE_FILES):
+            content = f"<?php // {version} file {i}\n".encode() * 20
+            info = tarfile.TarInfo(f"moodle-{version}/lib/dir{i % 30}/file{i}.php")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    """Serves a fake Moodle tarball for every requested tag archive, e.g. /v4.3.tar.gz"""
+
+    tarballs: dict[str, bytes] = {}
+
+    def do_GET(self):
+        version = self.path.rpartition("/v")[2].removesuffix(".tar.gz")
+        if version not in self.tarballs:
+            self.tarballs[version] = moodle_tarball(version)
+        body = self.tarballs[version]
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def commit_files(directory, files, executable=()):
+    repo = Repo.init(directory, initial_branch="master")
+    for name, content in files.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        if name in executable:
+            path.chmod(0o755)
+    repo.index.add(list(files))
+    repo.index.commit("initial commit")
+    return repo
+
+
+def pytest_collection_modifyitems(config, items):
+    # the benchmarks take a while, so they are only run if asked for, see "tox -e benchmark"
+    if config.getoption("--benchmark-only", default=False):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmark-only")
+    for item in items:
+        if item.path.is_relative_to(Path(__file__).parent):
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def fake_github():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(scope="session", params=["sqlite", "yaml"])
+def state_backend(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def testbed(tmp_path_factory, fake_github, state_backend):
+    """An initialized testbed in a temporary working directory, wired to the local stand-ins instead of GitHub and docker."""
+    root = tmp_path_factory.mktemp(f"testbed-{state_backend}")
+    boost_union = commit_files(
+        root / "boost_union", {"version.php": "<?php $plugin->version = 1;"}
+    )
+    moodle_docker = commit_files(
+        root / "moodle_docker",
+        {
+            "bin/moodle-docker-compose": COMPOSE_STUB,
+            "bin/moodle-docker-wait-for-db": "#!/bin/sh\n",
+            "bin/php": PHP_STUB,
+            "config.docker-template.php": "<?php // config",
+        },
+        executable=(
+            "bin/moodle-docker-compose",
+            "bin/moodle-docker-wait-for-db",
+            "bin/php",
+        ),
+    )
+    settings = yaml.safe_load((REPO_ROOT / "config.yml").read_text())
+    settings["repos"]["boost_union"]["url"] = boost_union.working_dir
+    settings["repos"]["moodle_docker"]["url"] = moodle_docker.working_dir
+    environment = yaml.safe_load((REPO_ROOT / "env.local.yml").read_text())
+    environment["working_dir"] = str(root / "working_dir")
+    environment["state_backend"] = state_backend
+    environment_file = root / "env.benchmark.yml"
+    environment_file.write_text(yaml.dump(environment))
+    config = ApplicationConfigManager(
+        config=settings,
+        moodle_versions_to_php_versions=yaml.safe_load(
+            (REPO_ROOT / "moodle-versions-to-supported-php-versions.yaml").read_text()
+        ),
+        environment_file=environment_file,
+    )
+    Application.cross_cutting_concerns.config_manager.override(providers.Object(config))
+    downloader = MoodleDownloader(fake_github, retries=1, retry_timeout=0)
+    Application.domain.moodle_cache.override(providers.Object(MoodleCache(downloader)))
+    # a stubbed database cannot be dumped, so every benchmark measures the actual installation
+    Application.domain.database_snapshots.override(
+        providers.Object(DatabaseSnapshotStore(enabled=False))
+    )
+    # the application is only built once per invocation, so it needs to be rebuilt to pick up the overrides
+    application.cache_clear()
+    invalidate_inventory()
+    # the data generator would be downloaded from GitHub otherwise
+    config.moodle_cache_dir.mkdir(parents=True)
+    (config.moodle_cache_dir / "smartdata.php").write_text("<?php // generator")
+    Testbed().init()
+    yield config
+    Application.cross_cutting_concerns.config_manager.reset_override()
+    Application.domain.moodle_cache.reset_override()
+    Application.domain.database_snapshots.reset_override()
+    application.cache_clear()
+    invalidate_inventory()
+
+
+@pytest.fixture(scope="session")
+def infrastructure(testbed):
+    infrastructure = TestInfrastructure(testbed.working_dir / "benchmark")
+    infrastructure.setup(GitReference("master", GitReferenceType.BRANCH))
+    # just like the core does after setting up an infrastructure
+    yaml_parser().new_infrastructure("benchmark", "master", "BRANCH")
+    return infrastructure
+
+
+@pytest.fixture
+def fresh_environment(infrastructure):
+    """Removes an environment of the benchmark infrastructure, so it can be built again."""
+
+    def remove(version):
+        shutil.rmtree(
+            infrastructure.directory / "moodles" / version, ignore_errors=True
+        )
+        yaml_parser().release_ports(infrastructure.directory.name, version)
+        invalidate_inventory()
+
+    return remove
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Benchmarks of the Moodle cache, downloading from the fake GitHub."""
+# pylint: disable=redefined-outer-name
+
+import itertools
+
+import pytest
+
+from theme_boost_union_test_envs.domain import moodle_cache
+from theme_boost_union_test_envs.domain.cache_index import CacheIndex
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture
+def empty_cache(testbed, tmp_path):
+    cache = moodle_cache()
+    directories = itertools.count()
+
+    def empty():
+        # a new directory for every round, so every round misses
+        cache.directory = tmp_path / str(next(directories))
+        cache.blob_dir = cache.directory / "blobs"
+        cache.tree_dir = cache.directory / "trees"
+        cache.download_dir = cache.directory / "downloads"
+        cache.index = CacheIndex(cache.directory / "index.yaml")
+
+    original = (
+        cache.directory,
+        cache.blob_dir,
+        cache.tree_dir,
+        cache.download_dir,
+        cache.index,
+    )
+    yield cache, empty
+    (
+        cache.directory,
+        cache.blob_dir,
+        cache.tree_dir,
+        cache.download_dir,
+        cache.index,
+    ) = original
+
+
+def test_get_hit(benchmark, testbed):
+    moodle_cache().get("4.3")
+    benchmark(moodle_cache().get, "4.3")
+
+
+def test_get_miss(benchmark, empty_cache):
+    cache, empty = empty_cache
+    benchmark.pedantic(cache.get, args=("4.3",), setup=empty, rounds=5)
+
+
+def test_get_source_trees_miss(benchmark, empty_cache):
+    cache, empty = empty_cache
+    benchmark.pedantic(
+        cache.get_source_trees, args=("4.1", "4.2"), setup=empty, rounds=5
+    )
+
+
+def test_clone_source_tree(benchmark, testbed, tmp_path):
+    cache = moodle_cache()
+    tree = cache.get_source_trees("4.3")["4.3"]
+    destinations = (tmp_path / str(i) / "moodle" for i in itertools.count())
+    benchmark(lambda: cache.clone_source_tree(tree, next(destinations)))
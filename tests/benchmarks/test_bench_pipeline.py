@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmarks of building and starting Moodle test environments against the local stand-ins."""
+# pylint: disable=redefined-outer-name
+
+import pytest
+
+from theme_boost_union_test_envs import domain
+from theme_boost_union_test_envs.domain import LifecycleCheckpoint, LifecycleStep
+
+pytest.importorskip("pytest_benchmark")
+
+
+def test_build(benchmark, infrastructure, fresh_environment):
+    # the first round downloads and extracts the tarball, all further rounds are served by the cache
+    benchmark.pedantic(
+        infrastructure.build,
+        args=("4.3",),
+        setup=lambda: fresh_environment("4.3"),
+        rounds=5,
+        warmup_rounds=1,
+    )
+
+
+def test_build_parallel(benchmark, infrastructure, fresh_environment):
+    versions = ("4.0", "4.1", "4.2")
+
+    def setup():
+        for version in versions:
+            fresh_environment(version)
+
+    benchmark.pedantic(
+        infrastructure.build,
+        args=versions,
+        kwargs={"jobs": len(versions)},
+        setup=setup,
+        rounds=3,
+        warmup_rounds=1,
+    )
+
+
+@pytest.fixture
+def built_container(infrastructure, fresh_environment):
+    fresh_environment("4.1.5")
+    infrastructure.build("4.1.5")
+    return domain.TestContainer(infrastructure.directory / "moodles" / "4.1.5")
+
+
+def test_first_start(benchmark, built_container):
+    def setup():
+        # forget the installation of the last round
+        built_container.lifecycle().path.unlink(missing_ok=True)
+        LifecycleCheckpoint(built_container.lifecycle().path).mark(
+            LifecycleStep.CREATED
+        )
+
+    benchmark.pedantic(built_container.start, setup=setup, rounds=5)
+
+
+def test_start_of_configured_environment(benchmark, built_container):
+    built_container.start()
+    benchmark(built_container.start)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Benchmarks of how long the CLI takes to answer, each run in a fresh interpreter just like a user invoking it."""
+# pylint: disable=redefined-outer-name
+
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+from .conftest import REPO_ROOT
+
+pytest.importorskip("pytest_benchmark")
+
+# commands that only look at the state of the testbed should feel instant
+MAX_RESPONSE_TIME = 1.0
+
+
+@pytest.fixture(scope="module")
+def cli(infrastructure, tmp_path_factory):
+    """Runs boost-union-envs with the configuration of the benchmark testbed."""
+    cwd = tmp_path_factory.mktemp("cli")
+    settings = yaml.safe_load((REPO_ROOT / "config.yml").read_text())
+    # an absolute path stays absolute, even though the CLI resolves it relative to it's script
+    settings["environment"] = str(
+        infrastructure.directory.parents[1] / "env.benchmark.yml"
+    )
+    (cwd / "config.yml").write_text(yaml.dump(settings))
+    (cwd / "moodle-versions-to-supported-php-versions.yaml").write_text(
+        (REPO_ROOT / "moodle-versions-to-supported-php-versions.yaml").read_text()
+    )
+
+    def run(*args):
+        subprocess.run(
+            [sys.executable, str(REPO_ROOT / "boost-union-envs"), *args],
+            cwd=cwd,
+            check=True,
+            capture_output=True,
+        )
+
+    return run
+
+
+def test_import(benchmark):
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-c", "import theme_boost_union_test_envs.app"],),
+        kwargs={"check": True},
+        rounds=5,
+        warmup_rounds=1,
+    )
+
+
+@pytest.mark.parametrize("command", [("list",), ("stop", "benchmark")])
+def test_command(benchmark, cli, command):
+    benchmark.pedantic(cli, args=command, rounds=5, warmup_rounds=1)
+    assert benchmark.stats.stats.mean < MAX_RESPONSE_TIME
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Benchmarks of the mutations of the persisted state, for each state backend."""
+
+import pytest
+
+from theme_boost_union_test_envs.cross_cutting import yaml_parser
+
+pytest.importorskip("pytest_benchmark")
+
+VERSIONS = [f"4.{minor}.{patch}" for minor in range(4) for patch in range(10)]
+
+
+def moodle(port):
+    return {
+        "status": "CREATED",
+        "url": f"http://localhost:{port}",
+        "admin_pw": "secret",
+        "www_port": port,
+        "db_port": port + 1,
+    }
+
+
+def test_lifecycle_of_an_infrastructure(benchmark, testbed):
+    state = yaml_parser()
+
+    def lifecycle():
+        state.new_infrastructure("state", "master", "BRANCH")
+        state.add_moodles_to_infrastructure(
+            "state",
+            {version: moodle(30000 + 2 * i) for i, version in enumerate(VERSIONS)},
+        )
+        state.change_moodle_test_container_status("state", "STARTED", *VERSIONS)
+        state.change_moodle_test_container_status("state", "STOPPED", *VERSIONS[:10])
+        for version in VERSIONS[:10]:
+            state.remove_moodle("state", version)
+        state.remove_infrastructure("state")
+
+    benchmark(lifecycle)
+
+
+def test_change_status_of_a_single_moodle(benchmark, testbed):
+    state = yaml_parser()
+    state.new_infrastructure("status", "master", "BRANCH")
+    state.add_moodles_to_infrastructure(
+        "status",
+        {version: moodle(31000 + 2 * i) for i, version in enumerate(VERSIONS)},
+    )
+    statuses = iter(["STARTED", "STOPPED"] * 1_000_000)
+    benchmark(
+        lambda: state.change_moodle_test_container_status(
+            "status", next(statuses), VERSIONS[0]
+        )
+    )
+    state.remove_infrastructure("status")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Benchmarks of rendering the templates of a test environment and the overview page."""
+# pylint: disable=redefined-outer-name
+
+import itertools
+import shutil
+
+import pytest
+
+from theme_boost_union_test_envs.cross_cutting import template_engine, yaml_parser
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture
+def environment(testbed, tmp_path):
+    yaml_parser().new_infrastructure("templates", "master", "BRANCH")
+    path = tmp_path / "templates" / "benchmark" / "moodles" / "4.3"
+    path.mkdir(parents=True)
+    yield path
+    yaml_parser().remove_infrastructure("templates")
+
+
+def test_environment_file(benchmark, testbed, environment):
+    def setup():
+        shutil.copy(testbed.moodle_docker_dir / ".env", environment / ".env")
+        yaml_parser().release_ports("templates", "4.3")
+
+    benchmark.pedantic(
+        template_engine().environment_file,
+        args=(environment, "templates", "4.3"),
+        setup=setup,
+        rounds=20,
+    )
+
+
+def test_docker_customisation(benchmark, testbed, environment):
+    def setup():
+        shutil.copy(testbed.moodle_docker_dir / "local.yml", environment / "local.yml")
+
+    benchmark.pedantic(
+        template_engine().docker_customisation,
+        args=(environment, testbed.working_dir / "benchmark" / "theme/boost_union"),
+        setup=setup,
+        rounds=20,
+    )
+
+
+def test_moodle_nginx_config(benchmark, testbed):
+    benchmark(template_engine().moodle_nginx_config, "templates", "4.3", "20000")
+
+
+def infrastructures(count):
+    return {
+        "infrastructures": {
+            f"infra{i}": {
+                "git_ref": "master",
+                "git_ref_type": "BRANCH",
+                "moodles": {
+                    f"4.{minor}": {
+                        "status": "STARTED",
+                        "url": f"http://localhost:{20000 + 10 * i + minor}",
+                        "admin_pw": "secret",
+                    }
+                    for minor in range(4)
+                },
+            }
+            for i in range(count)
+        }
+    }
+
+
+def test_overview_page_changed(benchmark, testbed):
+    # every round renders different infrastructures, so the page is rendered every time
+    variables = (infrastructures(20 + i % 2) for i in itertools.count())
+    benchmark(lambda: template_engine().test_environment_overview_html(next(variables)))
+
+
+def test_overview_page_unchanged(benchmark, testbed):
+    variables = infrastructures(20)
+    template_engine().test_environment_overview_html(variables)
+    benchmark(template_engine().test_environment_overview_html, variables)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Tests for issuing an action to several test containers at once."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from theme_boost_union_test_envs import domain
+from theme_boost_union_test_envs.core import BoostUnionTestEnvCore
+from theme_boost_union_test_envs.exceptions import ContainerCommandFailedError
+
+core_module = importlib.import_module("theme_boost_union_test_envs.core")
+
+VERSIONS = ["4.1", "4.2", "4.3", "4.4"]
+
+
+def _containers(tmp_path, versions=VERSIONS):
+    return [
+        domain.TestContainer(tmp_path / "main" / "moodles" / version)
+        for version in versions
+    ]
+
+
+def _failing_for(*versions):
+    """An action that takes a moment and fails like docker compose for the given versions."""
+
+    def action(container):
+        time.sleep(0.01)
+        if container.version in versions:
+            raise ContainerCommandFailedError("docker compose stop", 3)
+
+    return action
+
+
+def test_parallelism_is_bounded(tmp_path):
+    running, max_running = [0], [0]
+    lock = threading.Lock()
+
+    def action(container):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    batch = domain.ContainerActionExecutor(2).run(
+        "main", action, _containers(tmp_path), "stop"
+    )
+    assert max_running[0] == 2
+    assert batch.succeeded == VERSIONS
+
+
+def test_a_failing_container_does_not_stop_the_others(tmp_path):
+    def action(container):
+        _failing_for("4.2")(container)
+        if container.version == "4.4":
+            raise RuntimeError("docker is gone")
+
+    batch = domain.ContainerActionExecutor(4).run(
+        "main", action, _containers(tmp_path), "stop"
+    )
+    assert (batch.infrastructure, batch.action) == ("main", "stop")
+    # the results keep the order of the containers
+    assert [r.version for r in batch.results] == VERSIONS
+    assert batch.succeeded == ["4.1", "4.3"]
+    assert batch.failed == ["4.2", "4.4"]
+    assert [r.returncode for r in batch.results] == [0, 3, 0, -1]
+    assert batch.results[1].error == "docker compose exited with 3"
+    assert batch.results[3].error == "docker is gone"
+    assert all(r.duration > 0 for r in batch.results)
+    assert batch.duration >= max(r.duration for r in batch.results)
+
+
+def test_non_zero_compose_exits_are_recorded(tmp_path):
+    (container,) = _containers(tmp_path, ["4.3"])
+    (container.path / "bin").mkdir(parents=True)
+    (container.path / ".env").write_text("")
+    compose = container.path / "bin" / "moodle-docker-compose"
+    compose.write_text("#!/bin/sh\necho 'no such service' >&2\nexit 2\n")
+    compose.chmod(0o755)
+    with pytest.raises(ContainerCommandFailedError) as e:
+        container._run_docker_command("stop")
+    assert e.value.returncode == 2
+    batch = domain.ContainerActionExecutor(1).run(
+        "main", lambda c: c._run_docker_command("stop"), [container], "stop"
+    )
+    assert batch.results[0].returncode == 2
+    assert batch.failed == ["4.3"]
+
+
+class StubStateBackend:
+    def __init__(self):
+        self.status_changes = []
+
+    def change_moodle_test_container_status(self, infrastructure, status, *versions):
+        self.status_changes.append((infrastructure, status, versions))
+
+
+@pytest.fixture
+def core(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        core_module,
+        "config",
+        lambda: SimpleNamespace(working_dir=tmp_path, parallel_container_actions=4),
+    )
+    monkeypatch.setattr(
+        core_module,
+        "inventory",
+        lambda: SimpleNamespace(
+            testbed_exists=True,
+            has_infrastructure=lambda name: name == "main",
+            has_environment=lambda name, version: version in VERSIONS,
+            versions=lambda name: VERSIONS,
+            state={},
+        ),
+    )
+    monkeypatch.setattr(core_module, "invalidate_inventory", lambda: None)
+    monkeypatch.setattr(
+        core_module,
+        "template_engine",
+        lambda: SimpleNamespace(test_environment_overview_html=lambda variables: None),
+    )
+    return BoostUnionTestEnvCore(StubStateBackend(), None)
+
+
+@pytest.mark.parametrize(
+    "command, action, status",
+    [
+        ("start_environment", "start", "STARTED"),
+        ("stop_environment", "stop", "STOPPED"),
+    ],
+)
+def test_only_succeeded_containers_change_their_status(
+    core, monkeypatch, command, action, status
+):
+    monkeypatch.setattr(domain.TestContainer, action, _failing_for("4.2"))
+    result = getattr(core, command)("main", jobs=2)
+    assert result.failed == ["4.2"]
+    assert core.yaml_parser.status_changes == [("main", status, ("4.1", "4.3", "4.4"))]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Tests for the daemon running the commands of other invocations and the client sending them."""
+# pylint: disable=redefined-outer-name
+
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from theme_boost_union_test_envs.cross_cutting import log
+from theme_boost_union_test_envs.domain import (
+    ContainerActionResult,
+    ContainerBatchResult,
+    GitReference,
+    GitReferenceType,
+)
+from theme_boost_union_test_envs.exceptions import (
+    DaemonRequestFailedError,
+    MoodleTestEnvironmentDoesNotExistYetError,
+)
+from theme_boost_union_test_envs.ui.daemon import Daemon, RemoteCore
+
+
+class StubCore:
+    def __init__(self):
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def setup_infrastructure(self, infrastructure_name, git_ref):
+        self.calls.append((infrastructure_name, git_ref))
+
+    def build_infrastructure(self, infrastructure_name, *versions, jobs=1):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.1)
+        with self._lock:
+            self.running -= 1
+
+    def stop_environment(self, infrastructure_name, *versions, jobs=None):
+        results = []
+        for version in versions:
+            with log().contextualize(env=f"{infrastructure_name}/{version}"):
+                log().info(f"stopping with {jobs} jobs")
+            results.append(ContainerActionResult(version, "stop", 0.5))
+        return ContainerBatchResult(infrastructure_name, "stop", 1.0, results)
+
+    def destroy_environment(self, infrastructure_name, *versions, jobs=None):
+        raise MoodleTestEnvironmentDoesNotExistYetError(versions[0])
+
+    def export_state(self, path=None):
+        return path
+
+    def import_state(self, path=None):
+        raise FileNotFoundError(2, "No such file or directory", str(path))
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    core = StubCore()
+    daemon = Daemon(core, tmp_path / "daemon.sock")
+    server = daemon.serve()
+    yield core, RemoteCore(daemon.socket_path)
+    server.shutdown()
+    server.server_close()
+
+
+def test_results_and_log_messages_are_forwarded(daemon):
+    _, remote = daemon
+    forwarded = []
+    # messages logged by the daemon itself carry the request, the ones logged again by the client do not
+    sink = log().add(
+        forwarded.append,
+        format="{extra[env]} {message}",
+        filter=lambda record: "request" not in record["extra"]
+        and "env" in record["extra"],
+    )
+    try:
+        result = remote.stop_environment("main", "4.3", "4.4", jobs=2)
+    finally:
+        log().remove(sink)
+    assert result == ContainerBatchResult(
+        "main",
+        "stop",
+        1.0,
+        [
+            ContainerActionResult("4.3", "stop", 0.5),
+            ContainerActionResult("4.4", "stop", 0.5),
+        ],
+    )
+    assert forwarded == [
+        "main/4.3 stopping with 2 jobs\n",
+        "main/4.4 stopping with 2 jobs\n",
+    ]
+
+
+def test_arguments_keep_their_types(daemon, tmp_path):
+    core, remote = daemon
+    remote.setup_infrastructure("main", GitReference(42, GitReferenceType.PULL_REQUEST))
+    assert core.calls == [("main", GitReference(42, GitReferenceType.PULL_REQUEST))]
+    assert remote.export_state(tmp_path / "state.yaml") == tmp_path / "state.yaml"
+    assert remote.export_state() is None
+
+
+def test_exceptions_are_raised_again(daemon):
+    _, remote = daemon
+    with pytest.raises(MoodleTestEnvironmentDoesNotExistYetError) as error:
+        remote.destroy_environment("main", "4.5")
+    assert error.value.version == "4.5"
+    with pytest.raises(FileNotFoundError):
+        remote.import_state(Path("missing.yaml"))
+
+
+def test_commands_changing_the_testbed_run_one_after_another(daemon):
+    core, remote = daemon
+    threads = [
+        threading.Thread(target=remote.build_infrastructure, args=("main", version))
+        for version in ("4.2", "4.3", "4.4")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert core.max_running == 1
+
+
+def test_only_one_daemon_serves_a_socket(daemon):
+    _, remote = daemon
+    assert remote.is_available()
+    with pytest.raises(OSError):
+        Daemon(StubCore(), remote.socket_path).serve()
+
+
+def test_left_behind_sockets_are_ignored(tmp_path):
+    socket_path = tmp_path / "daemon.sock"
+    # bound, but nobody listens anymore
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(socket_path))
+    remote = RemoteCore(socket_path)
+    assert not remote.is_available()
+    with pytest.raises(DaemonRequestFailedError):
+        remote.export_state()
+    server = Daemon(StubCore(), socket_path).serve()
+    try:
+        assert remote.is_available()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Tests for the parser of moodle-docker's environment files."""
+
+import os
+
+import pytest
+
+from theme_boost_union_test_envs.cross_cutting import load_env_file, parse_env_file
+from theme_boost_union_test_envs.exceptions import BoostUnionTestEnvValueError
+
+
+def test_moodle_docker_format_is_parsed():
+    text = """
+# generated by theme_boost_union_test_envs
+export COMPOSE_PROJECT_NAME=main-4_3
+export MOODLE_ADMIN_PASSWORD="s3cret with spaces"
+MOODLE_DOCKER_WEB_PORT=4711  # trailing comment
+export MOODLE_DOCKER_WWWROOT=${HOME}/moodle
+export MOODLE_DOCKER_WEB_HOST=$COMPOSE_PROJECT_NAME.localhost
+export EMPTY=
+"""
+    assert parse_env_file(text) == {
+        "COMPOSE_PROJECT_NAME": "main-4_3",
+        "MOODLE_ADMIN_PASSWORD": "s3cret with spaces",
+        "MOODLE_DOCKER_WEB_PORT": "4711",
+        "MOODLE_DOCKER_WWWROOT": f"{os.environ.get('HOME', '')}/moodle",
+        "MOODLE_DOCKER_WEB_HOST": "main-4_3.localhost",
+        "EMPTY": "",
+    }
+
+
+def test_commands_are_rejected():
+    with pytest.raises(BoostUnionTestEnvValueError):
+        parse_env_file("rm -rf /")
+
+
+def test_parsed_file_is_cached_until_modified(tmp_path):
+    env = tmp_path / ".env"
+    env.write_text("export MOODLE_DOCKER_WEB_PORT=4711\n")
+    first = load_env_file(env)
+    assert first.get_int("MOODLE_DOCKER_WEB_PORT") == 4711
+    assert load_env_file(env) is first
+    env.write_text("export MOODLE_DOCKER_WEB_PORT=47110\n")
+    assert load_env_file(env).get_int("MOODLE_DOCKER_WEB_PORT") == 47110
+    with pytest.raises(BoostUnionTestEnvValueError):
+        load_env_file(env).get_int("MOODLE_DOCKER_DB_PORT")
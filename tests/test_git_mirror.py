@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Tests for the local mirror the Boost Union repository is cloned from."""
+# pylint: disable=redefined-outer-name
+
+import pytest
+from git import Repo
+
+from theme_boost_union_test_envs.domain import (
+    GitMirror,
+    GitReference,
+    GitReferenceType,
+)
+from theme_boost_union_test_envs.exceptions import InvalidGitReferenceError
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """A stand-in for GitHub: a repository with a branch, a tag and a pull request."""
+    repo = Repo.init(tmp_path / "remote", initial_branch="main")
+    for change in ("first", "second"):
+        (tmp_path / "remote" / "version.php").write_text(change)
+        repo.index.add(["version.php"])
+        repo.index.commit(change)
+    repo.create_tag("v1.0", ref="HEAD~1")
+    (tmp_path / "remote" / "version.php").write_text("pull request")
+    repo.index.add(["version.php"])
+    pr_commit = repo.index.commit(
+        "pull request", parent_commits=[repo.head.commit], head=False
+    )
+    repo.git.update_ref("refs/pull/42/head", pr_commit.hexsha)
+    repo.head.reset("main", index=True, working_tree=True)
+    return repo
+
+
+@pytest.fixture
+def mirror(tmp_path, remote):
+    return GitMirror(remote.working_dir, tmp_path / ".boost-union.git")
+
+
+@pytest.mark.parametrize(
+    "git_ref, expected",
+    [
+        (GitReference("main", GitReferenceType.BRANCH), "second"),
+        (GitReference("v1.0", GitReferenceType.TAG), "first"),
+        (GitReference(42, GitReferenceType.PULL_REQUEST), "pull request"),
+    ],
+)
+def test_working_copies_borrow_objects_from_the_mirror(
+    tmp_path, remote, mirror, git_ref, expected
+):
+    clone = mirror.clone(tmp_path / "infra" / "boost_union", git_ref)
+    assert (tmp_path / "infra" / "boost_union" / "version.php").read_text() == expected
+    assert clone.remote("origin").url == remote.working_dir
+    # nothing but the checked out files has been copied
+    assert "count: 0" in clone.git.count_objects("-v")
+    assert "packs: 0" in clone.git.count_objects("-v")
+
+
+def test_commits_and_only_requested_refs_are_fetched(tmp_path, remote, mirror):
+    commit = remote.commit("main~1").hexsha
+    mirror.clone(tmp_path / "a", GitReference(commit, GitReferenceType.COMMIT))
+    assert (tmp_path / "a" / "version.php").read_text() == "first"
+    mirrored = Repo(mirror.directory)
+    assert not any(ref.path.startswith("refs/pull/") for ref in mirrored.refs)
+    mirror.clone(tmp_path / "b", GitReference(42, GitReferenceType.PULL_REQUEST))
+    assert [ref.path for ref in mirrored.refs if ref.path.startswith("refs/pull/")] == [
+        "refs/pull/42/head"
+    ]
+
+
+def test_unknown_refs_are_rejected(tmp_path, mirror):
+    with pytest.raises(InvalidGitReferenceError):
+        mirror.clone(tmp_path / "a", GitReference("nope", GitReferenceType.BRANCH))
+
+
+def test_prefetched_refs_are_not_fetched_again(tmp_path, remote, mirror):
+    main = GitReference("main", GitReferenceType.BRANCH)
+    with mirror.prefetched(main, main, GitReference("nope", GitReferenceType.BRANCH)):
+        # a new commit on the remote is only picked up by fetching again
+        (tmp_path / "remote" / "version.php").write_text("third")
+        remote.index.add(["version.php"])
+        remote.index.commit("third")
+        for infrastructure in ("a", "b"):
+            mirror.clone(tmp_path / infrastructure, main)
+            assert (tmp_path / infrastructure / "version.php").read_text() == "second"
+        # unknown refs are still rejected once they are cloned
+        with pytest.raises(InvalidGitReferenceError):
+            mirror.clone(tmp_path / "c", GitReference("nope", GitReferenceType.BRANCH))
+    mirror.clone(tmp_path / "d", main)
+    assert (tmp_path / "d" / "version.php").read_text() == "third"
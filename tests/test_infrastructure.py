@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Tests for building several Moodle test environments of an infrastructure in parallel."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from theme_boost_union_test_envs import domain
+from theme_boost_union_test_envs.exceptions import BoostUnionTestEnvValueError
+
+infrastructure_module = importlib.import_module(
+    "theme_boost_union_test_envs.domain.test_infrastructure"
+)
+
+VERSIONS = ("4.1", "4.2", "4.3")
+
+
+@pytest.fixture
+def infrastructure(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        infrastructure_module,
+        "config",
+        lambda: SimpleNamespace(
+            moodle_docker_dir=tmp_path / ".moodle-docker",
+            moodle_docker_trees_dir=tmp_path / ".moodle-docker-trees",
+        ),
+    )
+    monkeypatch.setattr(infrastructure_module, "template_engine", lambda: None)
+    infrastructure = domain.TestInfrastructure(tmp_path / "main")
+    # the sources would be downloaded into the Moodle cache otherwise
+    monkeypatch.setattr(
+        infrastructure,
+        "_find_sources_for_versions",
+        lambda *versions: {v: tmp_path / ".moodles" / v for v in versions},
+    )
+    return infrastructure
+
+
+def _pipeline(infrastructure, monkeypatch, fail=(), wait_for=1):
+    """Replaces the pipeline of each environment by one that waits until the given number of pipelines run at the same time."""
+    started = threading.Barrier(wait_for, timeout=5)
+    finished = []
+
+    def build_test_env(version_nr, source_tree):
+        started.wait()
+        if version_nr in fail:
+            raise RuntimeError(f"building {version_nr} failed")
+        finished.append(version_nr)
+        return {"url": f"http://localhost/{version_nr}"}
+
+    monkeypatch.setattr(infrastructure, "_build_test_env", build_test_env)
+    return finished
+
+
+def test_environments_are_built_concurrently(infrastructure, monkeypatch):
+    # every pipeline waits for all others, so this only finishes if all of them run at once
+    finished = _pipeline(infrastructure, monkeypatch, wait_for=len(VERSIONS))
+    built = infrastructure.build(*VERSIONS, jobs=len(VERSIONS))
+    assert sorted(built) == sorted(finished) == list(VERSIONS)
+    assert built["4.2"] == {"url": "http://localhost/4.2"}
+
+
+def test_failures_are_isolated_across_versions(infrastructure, monkeypatch):
+    finished = _pipeline(
+        infrastructure, monkeypatch, fail=("4.2",), wait_for=len(VERSIONS)
+    )
+    with pytest.raises(RuntimeError, match="4.2"):
+        infrastructure.build(*VERSIONS, jobs=len(VERSIONS))
+    # the environments already being built are not torn down by the failing one
+    assert sorted(finished) == ["4.1", "4.3"]
+
+
+@pytest.mark.parametrize("jobs", [0, -1])
+def test_jobs_need_to_be_positive(infrastructure, monkeypatch, jobs):
+    finished = _pipeline(infrastructure, monkeypatch)
+    with pytest.raises(BoostUnionTestEnvValueError):
+        infrastructure.build(*VERSIONS, jobs=jobs)
+    assert finished == []
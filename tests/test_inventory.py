@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Tests for the inventory of the testbed."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+
+import pytest
+
+from theme_boost_union_test_envs.domain import EnvironmentInventory
+
+# the module is shadowed by the inventory() accessor of the same name
+inventory_module = importlib.import_module(
+    "theme_boost_union_test_envs.domain.inventory"
+)
+
+
+class FakeStateBackend:
+    def __init__(self, testbed):
+        self.testbed = testbed
+        self.loads = 0
+
+    def load_testbed_info(self):
+        self.loads += 1
+        return self.testbed
+
+
+@pytest.fixture
+def state(monkeypatch):
+    backend = FakeStateBackend({"main": {"moodles": {"4.1": {}, "4.3": {}}}})
+    monkeypatch.setattr(inventory_module, "yaml_parser", lambda: backend)
+    return backend
+
+
+def test_environments_are_scanned_once(tmp_path, state):
+    for version in ("4.3", "4.2"):
+        (tmp_path / "main" / "moodles" / version).mkdir(parents=True)
+    inventory = EnvironmentInventory(tmp_path)
+    assert inventory.testbed_exists
+    assert inventory.has_infrastructure("main")
+    assert not inventory.has_infrastructure("missing")
+    assert inventory.versions("main") == ["4.2", "4.3"]
+    assert inventory.versions("missing") == []
+    (tmp_path / "main" / "moodles" / "4.4").mkdir()
+    # the scan is reused, but environments created in the meantime are still found
+    assert inventory.versions("main") == ["4.2", "4.3"]
+    assert inventory.has_environment("main", "4.4")
+    assert not inventory.has_environment("main", "4.1")
+    assert inventory.state is inventory.state
+    assert state.loads == 1
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""Tests for the checkpoint tracking the lifecycle steps a test environment completed."""
+
+from theme_boost_union_test_envs.domain import LifecycleCheckpoint, LifecycleStep
+
+
+def test_completed_steps_are_remembered(tmp_path):
+    path = tmp_path / ".lifecycle.yml"
+    checkpoint = LifecycleCheckpoint(path)
+    assert not checkpoint.exists()
+    assert not checkpoint.is_done(LifecycleStep.CREATED)
+    checkpoint.mark(LifecycleStep.CREATED)
+    checkpoint.mark(LifecycleStep.DB_INSTALLED)
+    # a new checkpoint for the same file, as after an interrupted start
+    resumed = LifecycleCheckpoint(path)
+    assert resumed.is_done(LifecycleStep.CREATED)
+    assert resumed.is_done(LifecycleStep.DB_INSTALLED)
+    assert not resumed.is_done(LifecycleStep.THEME_SET)
+
+
+def test_marking_a_step_again_keeps_when_it_has_been_completed(tmp_path):
+    checkpoint = LifecycleCheckpoint(tmp_path / ".lifecycle.yml")
+    checkpoint.mark(LifecycleStep.DB_INSTALLED)
+    completed_at = checkpoint.completed()[LifecycleStep.DB_INSTALLED]
+    checkpoint.mark(*LifecycleStep)
+    completed = checkpoint.completed()
+    assert completed[LifecycleStep.DB_INSTALLED] == completed_at
+    # steps are kept in the order they are completed in
+    assert list(completed) == list(LifecycleStep)
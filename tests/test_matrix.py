@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Tests for planning and running a matrix of infrastructures and Moodle versions."""
+# pylint: disable=redefined-outer-name
+
+import contextlib
+import importlib
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from theme_boost_union_test_envs.core import BoostUnionTestEnvCore
+from theme_boost_union_test_envs.domain import (
+    GitReference,
+    GitReferenceType,
+    MatrixEntry,
+    MatrixSpec,
+    load_matrix_spec,
+)
+from theme_boost_union_test_envs.exceptions import InvalidMatrixSpecError
+
+core_module = importlib.import_module("theme_boost_union_test_envs.core")
+
+SPEC = """
+versions: ["4.1", "4.2"]
+infrastructures:
+  pr-512:
+    pr: 512
+  main:
+    branch: main
+    versions: ["4.2", 4.3]
+"""
+
+
+def test_spec_lists_infrastructures_with_their_versions(tmp_path):
+    spec_file = tmp_path / "matrix.yml"
+    spec_file.write_text(SPEC)
+    spec = load_matrix_spec(spec_file)
+    assert spec.entries == [
+        MatrixEntry(
+            "pr-512", GitReference(512, GitReferenceType.PULL_REQUEST), ["4.1", "4.2"]
+        ),
+        MatrixEntry(
+            "main", GitReference("main", GitReferenceType.BRANCH), ["4.2", "4.3"]
+        ),
+    ]
+    assert spec.versions == ["4.1", "4.2", "4.3"]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "versions: ['4.3']",
+        "infrastructures:\n  main:\n    branch: main",
+        "versions: ['4.3']\ninfrastructures:\n  main:\n    branch: main\n    tag: v1",
+    ],
+)
+def test_invalid_specs_are_rejected(tmp_path, content):
+    spec_file = tmp_path / "matrix.yml"
+    spec_file.write_text(content)
+    with pytest.raises(InvalidMatrixSpecError):
+        load_matrix_spec(spec_file)
+
+
+class StubCore(BoostUnionTestEnvCore):
+    def __init__(self, state):
+        self.state = state
+        self.prefetched = []
+        self.fetched_versions = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def setup_infrastructure(self, infrastructure_name, git_ref):
+        self.state[infrastructure_name] = {
+            "git_ref": {"type": git_ref.type.name, "reference": git_ref.ref}
+        }
+
+    def build_infrastructure(self, infrastructure_name, *versions, jobs=1):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+        if "4.0" in versions:
+            raise ValueError("moodle 4.0 is broken")
+
+
+@pytest.fixture
+def core(monkeypatch):
+    stub = StubCore({"existing": {"git_ref": {"type": "BRANCH", "reference": "main"}}})
+
+    @contextlib.contextmanager
+    def prefetched(*git_refs):
+        stub.prefetched.extend(git_refs)
+        yield
+
+    monkeypatch.setattr(
+        core_module,
+        "inventory",
+        lambda: SimpleNamespace(
+            testbed_exists=True,
+            state=stub.state,
+            has_infrastructure=lambda name: name in stub.state,
+        ),
+    )
+    monkeypatch.setattr(
+        core_module,
+        "moodle_cache",
+        lambda: SimpleNamespace(
+            get_source_trees=lambda *versions: stub.fetched_versions.extend(versions)
+        ),
+    )
+    monkeypatch.setattr(
+        core_module,
+        "boost_union_mirror",
+        lambda: SimpleNamespace(prefetched=prefetched),
+    )
+    return stub
+
+
+def test_matrix_fetches_everything_once_and_builds_in_parallel(core):
+    pr = GitReference(512, GitReferenceType.PULL_REQUEST)
+    spec = MatrixSpec(
+        [MatrixEntry(f"pr-{i}", pr, ["4.2", "4.3"]) for i in range(4)]
+        + [
+            MatrixEntry(
+                "existing", GitReference("main", GitReferenceType.BRANCH), ["4.3"]
+            ),
+            MatrixEntry(
+                "broken", GitReference("main", GitReferenceType.BRANCH), ["4.0"]
+            ),
+        ]
+    )
+    result = core.build_matrix(spec, jobs=2)
+    assert core.fetched_versions == ["4.2", "4.3", "4.0"]
+    # the existing infrastructure is only built, not set up again
+    assert "existing" not in [r.infrastructure for r in result.results if r.set_up]
+    assert len(core.prefetched) == 5
+    assert core.max_running == 2
+    assert result.failed == ["broken"]
+    assert "broken" in result.results[-1].error
+
+
+def test_existing_infrastructures_need_the_same_git_reference(core):
+    spec = MatrixSpec(
+        [MatrixEntry("existing", GitReference("dev", GitReferenceType.BRANCH), ["4.3"])]
+    )
+    result = core.build_matrix(spec)
+    assert result.failed == ["existing"]
+    assert core.max_running == 0
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Tests for the indexed `MoodleCache`."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+import io
+import tarfile
+import threading
+
+import pytest
+
+from theme_boost_union_test_envs.domain import MoodleCache
+from theme_boost_union_test_envs.domain.cache_index import CacheIndex
+
+moodle_module = importlib.import_module("theme_boost_union_test_envs.domain.moodle")
+
+
+class FakeDownloader:
+    """Writes a distinct archive of the given size for every requested file."""
+
+    parallel_downloads = 2
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.downloaded = []
+
+    def download(self, file_name, destination):
+        self.downloaded.append(file_name)
+        destination.write_bytes(file_name.encode().ljust(self.size, b"\0"))
+
+
+class FakeTarballDownloader(FakeDownloader):
+    """Writes a tarball laid out like the archives GitHub serves for Moodle tags."""
+
+    def download(self, file_name, destination):
+        self.downloaded.append(file_name)
+        version = file_name.removeprefix("v").removesuffix(".tar.gz")
+        content = f"<?php $release = '{version}';".encode()
+        with tarfile.open(destination, "w:gz") as tar:
+            info = tarfile.TarInfo(f"moodle-{version}/version.php")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    def create(**kwargs):
+        cache = MoodleCache(FakeDownloader(), **kwargs)
+        cache.directory = tmp_path
+        cache.blob_dir = tmp_path / "blobs"
+        cache.tree_dir = tmp_path / "trees"
+        cache.download_dir = tmp_path / "downloads"
+        cache.index = CacheIndex(tmp_path / "index.yaml")
+        return cache
+
+    return create
+
+
+def test_hits_are_served_from_disk(cache):
+    moodles = cache()
+    first = moodles.get("4.3")
+    second = moodles.get("4.3")
+    assert first == second
+    assert moodles.downloader.downloaded == ["v4.3.tar.gz"]
+    assert moodles.stats().entries[0].hits == 2
+
+
+@pytest.mark.parametrize("verification", ["full", "lazy"])
+def test_damaged_archives_are_downloaded_again(cache, verification):
+    moodles = cache(verification=verification)
+    archive = moodles.get("4.3")
+    intact = archive.read_bytes()
+    archive.write_bytes(b"truncated")
+    assert moodles.get("4.3").read_bytes() == intact
+    # ... and served from disk again afterwards
+    assert moodles.get("4.3").read_bytes() == intact
+    assert moodles.downloader.downloaded == ["v4.3.tar.gz", "v4.3.tar.gz"]
+
+
+def test_damaged_archives_are_replaced_when_stored(cache, tmp_path):
+    moodles = cache()
+    archive = moodles.get("4.3")
+    intact = archive.read_bytes()
+    archive.write_bytes(b"truncated")
+    # e.g. downloaded by a concurrent invocation, while the damaged archive is still in place
+    download = tmp_path / "v4.3.tar.gz"
+    download.write_bytes(intact)
+    entry = moodles._store("4.3", download)
+    assert archive.read_bytes() == intact
+    assert entry.size == len(intact)
+
+
+def test_legacy_archives_are_adopted(cache, tmp_path):
+    (tmp_path / "v4.1.tar.gz").write_bytes(b"legacy")
+    moodles = cache()
+    archive = moodles.get("4.1")
+    assert archive.read_bytes() == b"legacy"
+    assert not moodles.downloader.downloaded
+    assert not (tmp_path / "v4.1.tar.gz").exists()
+
+
+def test_least_recently_used_archives_are_evicted(cache):
+    # budget of 1MB fits two of the 512KB archives
+    moodles = cache(max_size_mb=1)
+    moodles.downloader.size = 512 * 1024
+    moodles.get("4.1")
+    moodles.get("4.2")
+    moodles.get("4.1")
+    moodles.get("4.3")
+    assert {e.version for e in moodles.stats().entries} == {"4.1", "4.3"}
+    assert len(list(moodles.blob_dir.iterdir())) == 2
+
+
+def test_prune_shrinks_cache_by_frequency(cache):
+    moodles = cache()
+    moodles.downloader.size = 512 * 1024
+    moodles.get("4.1")
+    moodles.get("4.1")
+    moodles.get("4.2")
+    moodles.get("4.3")
+    result = moodles.prune(max_size_mb=1, eviction_policy="lfu")
+    assert result.evicted == ["4.2"]
+    assert result.freed_bytes == 512 * 1024
+
+
+def test_source_trees_are_extracted_once_and_cloned(cache, tmp_path):
+    moodles = cache(clone_strategies=["hardlink", "copy"])
+    moodles.downloader = FakeTarballDownloader()
+    tree = moodles.get_source_trees("4.3")["4.3"]
+    assert moodles.get_source_trees("4.3")["4.3"] == tree
+    version_php = tree / "version.php"
+    assert not version_php.stat().st_mode & 0o222
+    clone = tmp_path / "env" / "moodle"
+    moodles.clone_source_tree(tree, clone)
+    assert (clone / "version.php").read_text() == version_php.read_text()
+    # hard links share the inode of the golden tree instead of copying it
+    assert (clone / "version.php").stat().st_ino == version_php.stat().st_ino
+
+
+def test_prune_waits_for_extractions_in_progress(cache, monkeypatch):
+    moodles = cache()
+    moodles.downloader = FakeTarballDownloader()
+    moodles.get("4.3")
+    extracting, resume = threading.Event(), threading.Event()
+    make_read_only = moodle_module.make_read_only
+
+    def paused(path):
+        extracting.set()
+        resume.wait(5)
+        make_read_only(path)
+
+    monkeypatch.setattr(moodle_module, "make_read_only", paused)
+    trees, errors = [], []
+
+    def extract():
+        try:
+            trees.append(moodles.get_source_trees("4.3")["4.3"])
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    extraction = threading.Thread(target=extract)
+    extraction.start()
+    assert extracting.wait(5)
+    prune = threading.Thread(target=moodles.prune, kwargs={"max_size_mb": 0})
+    prune.start()
+    prune.join(0.2)
+    # the half-extracted tree is still locked by the extraction
+    assert prune.is_alive()
+    resume.set()
+    extraction.join(5)
+    prune.join(5)
+    assert errors == []
+    assert (trees[0] / "version.php").exists()
+
+
+def test_prune_removes_abandoned_extractions(cache):
+    moodles = cache()
+    abandoned = moodles.tree_dir / ".extracting-0123abcd-x1y2"
+    (abandoned / "moodle").mkdir(parents=True)
+    moodles.prune(max_size_mb=0)
+    assert not abandoned.exists()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Tests for the moodle-docker trees shared by all test environments."""
+# pylint: disable=redefined-outer-name
+
+import os
+
+import pytest
+
+from theme_boost_union_test_envs.domain import MoodleDockerTrees
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    checkout = tmp_path / ".moodle-docker"
+    for name, content in {
+        ".git/HEAD": "ref: refs/heads/master",
+        "bin/moodle-docker-compose": "#!/bin/sh",
+        "base.yml": "services: {}",
+        "assets/web/apache2.conf": "# apache",
+        ".env": "export COMPOSE_PROJECT_NAME=$REPLACE_COMPOSE_NAME",
+        "local.yml": "services: {}",
+    }.items():
+        (checkout / name).parent.mkdir(parents=True, exist_ok=True)
+        (checkout / name).write_text(content)
+    return checkout
+
+
+@pytest.fixture
+def trees(tmp_path, checkout):
+    return MoodleDockerTrees(checkout, tmp_path / ".moodle-docker-trees")
+
+
+def test_environments_share_one_tree(tmp_path, trees):
+    first = tmp_path / "infra" / "moodles" / "4.1"
+    second = tmp_path / "infra" / "moodles" / "4.2"
+    assert trees.overlay(first) == trees.overlay(second)
+    for env in (first, second):
+        assert (env / "base.yml").is_symlink()
+        assert (env / "assets").is_symlink()
+        assert (env / "assets" / "web" / "apache2.conf").read_text() == "# apache"
+        assert not (env / ".git").exists()
+        # rendered per environment, so it must not write through into the shared tree
+        for materialized in (".env", "local.yml", "bin/moodle-docker-compose"):
+            assert not (env / materialized).is_symlink()
+            assert os.access(env / materialized, os.W_OK)
+    (first / ".env").write_text("rendered")
+    assert (second / ".env").read_text() != "rendered"
+    assert len([tree for tree in trees.directory.iterdir() if tree.is_dir()]) == 1
+
+
+def test_changed_checkout_gets_a_new_tree(tmp_path, checkout, trees):
+    old = trees.overlay(tmp_path / "old")
+    (checkout / "base.yml").write_text("services: {webserver: {}}")
+    new = trees.overlay(tmp_path / "new")
+    assert old != new
+    # environments built before keep the tree they have been built with
+    assert (tmp_path / "old" / "base.yml").read_text() == "services: {}"
+    assert (tmp_path / "new" / "base.yml").read_text() == "services: {webserver: {}}"
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Tests for the streaming `MoodleDownloader` against a local HTTP server."""
+# pylint: disable=redefined-outer-name
+
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.exceptions import HTTPError
+
+from theme_boost_union_test_envs.domain import MoodleDownloader
+
+ARCHIVE = bytes(range(256)) * 4096
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves ARCHIVE for every path except '/missing', honours range requests and drops the first connection halfway through."""
+
+    requests_seen: list[str] = []
+    drop_first = True
+
+    def do_GET(self):
+        type(self).requests_seen.append(self.headers.get("Range", ""))
+        if self.path.endswith("missing"):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        offset = 0
+        if self.headers.get("Range"):
+            offset = int(self.headers["Range"].removeprefix("bytes=").rstrip("-"))
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header(
+                "Content-Range", f"bytes {offset}-{len(ARCHIVE) - 1}/{len(ARCHIVE)}"
+            )
+        else:
+            self.send_response(HTTPStatus.OK)
+        body = ARCHIVE[offset:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if type(self).drop_first:
+            type(self).drop_first = False
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandInHandler.requests_seen = []
+    StandInHandler.drop_first = True
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+
+
+def test_download_resumes_after_dropped_connection(server, tmp_path):
+    downloader = MoodleDownloader(server, retries=3, retry_timeout=0, chunk_size=4096)
+    destination = tmp_path / "v4.3.tar.gz"
+    downloader.download("v4.3.tar.gz", destination)
+    assert destination.read_bytes() == ARCHIVE
+    assert not (tmp_path / "v4.3.tar.gz.part").exists()
+    assert StandInHandler.requests_seen[0] == ""
+    assert StandInHandler.requests_seen[1] == f"bytes={len(ARCHIVE) // 2}-"
+
+
+def test_download_does_not_retry_missing_files(server, tmp_path):
+    downloader = MoodleDownloader(server, retries=3, retry_timeout=0)
+    destination = tmp_path / "missing"
+    with pytest.raises(HTTPError):
+        downloader.download("missing", destination)
+    assert not destination.exists()
+    assert len(StandInHandler.requests_seen) == 1
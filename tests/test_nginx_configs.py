@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Tests for staging, checking and reloading the nginx configs of the test environments and rendering the map routing to them."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from theme_boost_union_test_envs.cross_cutting import (
+    NginxConfigs,
+    NginxRouting,
+    TemplateEngine,
+)
+from theme_boost_union_test_envs.exceptions import NginxConfigTestFailedError
+
+# records how it has been called and rejects configs containing "broken", like nginx rejects invalid configs
+NGINX_STUB = """#!/bin/sh
+echo "$*" >> "{calls}"
+if [ "$1" = "-t" ] && grep -rq broken "{config_dir}"; then
+    echo "nginx: [emerg] unknown directive broken" >&2
+    exit 1
+fi
+"""
+
+# the module is shadowed by the template_engine() accessor of the same name
+template_engine_module = importlib.import_module(
+    "theme_boost_union_test_envs.cross_cutting.template_engine"
+)
+
+
+@pytest.fixture
+def nginx(tmp_path):
+    config_dir = tmp_path / ".nginx"
+    (config_dir / "testenvs").mkdir(parents=True)
+    calls = tmp_path / "calls.log"
+    stub = tmp_path / "nginx"
+    stub.write_text(NGINX_STUB.format(calls=calls, config_dir=config_dir))
+    stub.chmod(0o755)
+
+    def create(reload_delay=0.0):
+        return NginxConfigs(config_dir, f"{stub} -t", f"{stub} -s reload", reload_delay)
+
+    def read_calls():
+        return calls.read_text().splitlines() if calls.exists() else []
+
+    return create, read_calls, config_dir
+
+
+def test_staged_configs_are_applied_together(nginx):
+    create, calls, config_dir = nginx
+    configs = create()
+    for version in ("4.2", "4.3"):
+        configs.stage(config_dir / "testenvs" / f"main-{version}.conf", version)
+    # nginx must not see anything before it's applied
+    assert not list((config_dir / "testenvs").iterdir())
+    applied = configs.apply()
+    assert [p.name for p in applied] == ["main-4.2.conf", "main-4.3.conf"]
+    assert (config_dir / "testenvs" / "main-4.3.conf").read_text() == "4.3"
+    assert calls() == ["-t", "-s reload"]
+    # nothing staged, nothing to check or reload
+    assert configs.apply() == []
+    assert calls() == ["-t", "-s reload"]
+
+
+def test_rejected_configs_are_rolled_back(nginx):
+    create, calls, config_dir = nginx
+    configs = create()
+    existing = config_dir / "testenvs" / "main-4.2.conf"
+    existing.write_text("location /main/4.2")
+    configs.stage(existing, "broken")
+    configs.stage(config_dir / "testenvs" / "main-4.3.conf", "location /main/4.3")
+    with pytest.raises(NginxConfigTestFailedError) as error:
+        configs.apply()
+    assert "unknown directive" in error.value.output
+    assert existing.read_text() == "location /main/4.2"
+    assert not (config_dir / "testenvs" / "main-4.3.conf").exists()
+    assert calls() == ["-t"]
+
+
+def test_reloads_within_the_delay_are_shared(nginx):
+    create, calls, config_dir = nginx
+    configs = create(reload_delay=0.3)
+    for version in ("4.2", "4.3", "4.4"):
+        configs.stage(config_dir / "testenvs" / f"main-{version}.conf", version)
+        configs.apply()
+    assert calls() == ["-t", "-t", "-t"]
+    time.sleep(0.6)
+    assert calls() == ["-t", "-t", "-t", "-s reload"]
+
+
+def test_pending_reloads_are_flushed(nginx):
+    create, calls, config_dir = nginx
+    configs = create(reload_delay=60)
+    configs.stage(config_dir / "testenvs" / "main-4.3.conf", "4.3")
+    configs.apply()
+    configs.flush()
+    assert calls() == ["-t", "-s reload"]
+    configs.flush()
+    assert calls() == ["-t", "-s reload"]
+
+
+def test_map_is_rendered_from_the_state(nginx, monkeypatch):
+    create, calls, config_dir = nginx
+    configs = create()
+    monkeypatch.setattr(
+        template_engine_module,
+        "config",
+        lambda: SimpleNamespace(
+            nginx_routing=NginxRouting.MAP,
+            nginx_dir=config_dir,
+            softlinked_nginx_path=Path("/etc/nginx/testenvs"),
+            wake_port=8081,
+        ),
+    )
+    monkeypatch.setattr(template_engine_module, "nginx_configs", lambda: configs)
+    engine = TemplateEngine()
+    infrastructures = {
+        "main": {
+            "moodles": {
+                "4.2": {"www_port": 20001},
+                "4.3": {"www_port": 20003},
+            }
+        },
+        "develop": {"moodles": {}},
+    }
+    assert engine.moodle_nginx_map(infrastructures)
+    configs.apply()
+    nginx_map = engine.create_moodle_nginx_map_path().read_text()
+    assert '"main/4.2" 20001;' in nginx_map
+    assert '"main/4.3" "/etc/nginx/testenvs/logs/main-4.3.access.log";' in nginx_map
+    assert "8081" in engine.create_moodle_nginx_map_routing_conf_path().read_text()
+    # nothing changed, nothing to check or reload
+    assert not engine.moodle_nginx_map(infrastructures)
+    assert calls() == ["-t", "-s reload"]
+    # destroyed environments are gone from the map, no matter how they have been destroyed
+    del infrastructures["main"]["moodles"]["4.2"]
+    assert engine.moodle_nginx_map(infrastructures)
+    configs.apply()
+    assert "main/4.2" not in engine.create_moodle_nginx_map_path().read_text()
+
+
+def test_map_skips_environments_without_a_known_port(nginx, monkeypatch, tmp_path):
+    create, _, config_dir = nginx
+    configs = create()
+    monkeypatch.setattr(
+        template_engine_module,
+        "config",
+        lambda: SimpleNamespace(
+            nginx_routing=NginxRouting.MAP,
+            nginx_dir=config_dir,
+            softlinked_nginx_path=Path("/etc/nginx/testenvs"),
+            wake_port=8081,
+            working_dir=tmp_path,
+        ),
+    )
+    monkeypatch.setattr(template_engine_module, "nginx_configs", lambda: configs)
+    # built before the ports have been kept in the state: the yaml lacks them, an import into SQLite leaves them empty
+    legacy = {"status": "STARTED", "url": "http://localhost:20005", "admin_pw": "pw"}
+    env_file = tmp_path / "main" / "moodles" / "4.1" / ".env"
+    env_file.parent.mkdir(parents=True)
+    env_file.write_text("export MOODLE_DOCKER_WEB_PORT=20005\n")
+    infrastructures = {
+        "main": {
+            "moodles": {
+                "4.1": legacy,
+                "4.2": {**legacy, "www_port": None},
+                "4.3": {"www_port": 20003},
+            }
+        }
+    }
+    engine = TemplateEngine()
+    assert engine.moodle_nginx_map(infrastructures)
+    configs.apply()
+    nginx_map = engine.create_moodle_nginx_map_path().read_text()
+    assert '"main/4.1" 20005;' in nginx_map
+    assert "main/4.2" not in nginx_map
+    assert "None" not in nginx_map
+    assert '"main/4.3" 20003;' in nginx_map
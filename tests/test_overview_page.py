@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Tests for the rendering of the overview page."""
+
+import importlib
+from types import SimpleNamespace
+
+from theme_boost_union_test_envs.cross_cutting import TemplateEngine
+
+# the module is shadowed by the template_engine() accessor of the same name
+template_engine_module = importlib.import_module(
+    "theme_boost_union_test_envs.cross_cutting.template_engine"
+)
+
+
+def test_unchanged_overview_is_not_rendered_again(tmp_path, monkeypatch):
+    served = tmp_path / "html"
+    served.mkdir()
+    index_page = served / "index.html"
+    monkeypatch.setattr(
+        template_engine_module,
+        "config",
+        lambda: SimpleNamespace(
+            overview_page_index=index_page,
+            overview_page_fingerprint=tmp_path / ".overview.sha256",
+        ),
+    )
+    engine = TemplateEngine()
+    infrastructures = {
+        "main": {"git_ref": {"type": "BRANCH", "reference": "main"}, "moodles": {}}
+    }
+    engine.test_environment_overview_html({"infrastructures": infrastructures})
+    assert "main" in index_page.read_text()
+    # nginx serves everything next to the page
+    assert [p.name for p in served.iterdir()] == ["index.html"]
+    # a modified page is left alone as long as nothing changed ...
+    index_page.write_text("untouched")
+    engine.test_environment_overview_html({"infrastructures": infrastructures})
+    assert index_page.read_text() == "untouched"
+    # ... but rendered again as soon as the infrastructures change
+    infrastructures["main"]["git_ref"]["reference"] = "develop"
+    engine.test_environment_overview_html({"infrastructures": infrastructures})
+    assert "develop" in index_page.read_text()
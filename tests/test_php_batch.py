@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Tests for the commands a test container sends to it's containers, e.g. several PHP scripts in a single exec session."""
+
+import importlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from theme_boost_union_test_envs import domain, exceptions
+
+
+def _make_container(tmp_path, monkeypatch):
+    path = tmp_path / "infra" / "moodles" / "4.3"
+    (path / "bin").mkdir(parents=True)
+    (path / ".env").write_text("")
+    # runs the command meant for the webserver container locally
+    compose = path / "bin" / "moodle-docker-compose"
+    compose.write_text('#!/bin/sh\nshift 3\nexec "$@"\n')
+    compose.chmod(0o755)
+    fake_bin = tmp_path / "fake_bin"
+    fake_bin.mkdir()
+    php = fake_bin / "php"
+    php.write_text('#!/bin/sh\necho "running $1"\n[ "$1" != "broken.php" ]\n')
+    php.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fake_bin}{os.pathsep}{os.environ['PATH']}")
+    return domain.TestContainer(path)
+
+
+def test_each_script_reports_its_own_result(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    results = container._run_local_php_scripts([("a.php", ""), ("b.php", "--x")])
+    assert [r.returncode for r in results] == [0, 0]
+    assert [r.output for r in results] == ["running a.php", "running b.php"]
+
+
+def test_scripts_after_a_failed_one_are_not_run(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    results = container._run_local_php_scripts(
+        [("a.php", ""), ("broken.php", ""), ("c.php", "")]
+    )
+    assert [r.succeeded for r in results] == [True, False, False]
+    assert results[1].returncode == 1
+    assert results[1].output == "running broken.php"
+    assert results[2].returncode is None
+
+
+def _restore(container, tmp_path, monkeypatch):
+    # the dumps themselves can only be restored into real containers
+    monkeypatch.setattr(container, "_stream_docker_command", lambda *a, **kw: None)
+    chown = tmp_path / "fake_bin" / "chown"
+    chown.write_text("#!/bin/sh\n")
+    chown.chmod(0o755)
+    php_code = []
+    monkeypatch.setattr(container, "_run_local_php_code", php_code.append)
+    container._restore_snapshot(domain.DatabaseSnapshot(tmp_path / "snapshot"))
+    return php_code
+
+
+def test_restored_snapshots_are_upgraded(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    scripts = []
+    run_scripts = container._run_local_php_scripts
+
+    def record(batch):
+        scripts.extend(batch)
+        return run_scripts(batch)
+
+    monkeypatch.setattr(container, "_run_local_php_scripts", record)
+    php_code = _restore(container, tmp_path, monkeypatch)
+    assert scripts == [("admin/cli/upgrade.php", "--non-interactive")]
+    # the site is only renamed once it runs the code of this container
+    assert len(php_code) == 1
+
+
+def test_failed_upgrades_of_restored_snapshots(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    php = tmp_path / "fake_bin" / "php"
+    php.write_text('#!/bin/sh\necho "upgrade failed"\nexit 1\n')
+    with pytest.raises(exceptions.ContainerCommandFailedError):
+        _restore(container, tmp_path, monkeypatch)
+
+
+def test_scripts_reading_stdin_do_not_swallow_the_session(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    php = tmp_path / "fake_bin" / "php"
+    php.write_text('#!/bin/sh\ncat > /dev/null\necho "running $1"\n')
+    # unlike dash, bash reads the session line by line, so the script would see the rest of it
+    compose = container.path / "bin" / "moodle-docker-compose"
+    compose.write_text('#!/bin/sh\nshift 4\nexec bash "$@"\n')
+    results = container._run_local_php_scripts([("a.php", ""), ("b.php", "")])
+    assert [r.output for r in results] == ["running a.php", "running b.php"]
+
+
+def test_aborted_sessions(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    # the session loses it's input after the first script, but still exits cleanly
+    compose = container.path / "bin" / "moodle-docker-compose"
+    compose.write_text('#!/bin/sh\nshift 3\nhead -n 1 | "$@"\n')
+    with pytest.raises(exceptions.PhpSessionAbortedError) as e:
+        container._run_local_php_scripts([("a.php", ""), ("b.php", ""), ("c.php", "")])
+    assert e.value.script == "b.php"
+
+
+def test_output_of_failed_commands_is_logged_as_error(tmp_path, monkeypatch):
+    container = _make_container(tmp_path, monkeypatch)
+    logged = []
+    logger = SimpleNamespace(
+        info=lambda message: logged.append(("info", message)),
+        error=lambda message: logged.append(("error", message)),
+    )
+    test_container = importlib.import_module(
+        "theme_boost_union_test_envs.domain.test_container"
+    )
+    monkeypatch.setattr(test_container, "log", lambda: logger)
+    container._run_docker_command("exec -T webserver echo pulling image")
+    assert ("info", "pulling image") in logged
+    logged.clear()
+    with pytest.raises(exceptions.ContainerCommandFailedError):
+        container._run_docker_command("exec -T webserver ls /does-not-exist")
+    assert [level for level, _ in logged] == ["info", "error"]
+    assert "/does-not-exist" in logged[-1][1]
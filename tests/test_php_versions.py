@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Tests for resolving the PHP image tag of a Moodle version."""
+# pylint: disable=redefined-outer-name
+
+import random
+from pathlib import Path
+
+import pytest
+import yaml
+from packaging import version
+
+from theme_boost_union_test_envs.cross_cutting import PhpImageTags
+from theme_boost_union_test_envs.exceptions import UnsupportedMoodleVersionError
+
+MAPPING = (
+    Path(__file__).parent.parent / "moodle-versions-to-supported-php-versions.yaml"
+)
+
+
+@pytest.fixture
+def breakpoints():
+    return {
+        version.parse(str(moodle_ver)): [version.parse(str(v)) for v in php_vers]
+        for moodle_ver, php_vers in yaml.safe_load(MAPPING.read_text()).items()
+    }
+
+
+@pytest.mark.parametrize(
+    "moodle_version, image_tag",
+    [
+        ("3.0.1", "7.0"),
+        ("3.9.20", "7.4"),
+        ("3.11", "8.0"),
+        ("4.2", "8.1"),
+        # a breakpoint applies to it's own version already
+        ("4.2.3", "8.2"),
+        ("4.3.0-beta", "8.2"),
+        ("4.3.4", "8.2"),
+        ("4.4", "dev"),
+        ("5.0.1", "dev"),
+    ],
+)
+def test_newest_supported_php_version_is_selected(
+    breakpoints, moodle_version, image_tag
+):
+    assert PhpImageTags(breakpoints).resolve(moodle_version) == image_tag
+
+
+def test_ancient_versions_are_unsupported(breakpoints):
+    with pytest.raises(UnsupportedMoodleVersionError):
+        PhpImageTags(breakpoints).resolve("2.9")
+
+
+def test_breakpoints_do_not_need_to_be_ordered(breakpoints):
+    shuffled = list(breakpoints.items())
+    random.Random(4).shuffle(shuffled)
+    assert PhpImageTags(dict(shuffled)).resolve("4.1.5") == "8.1"
+
+
+def test_batches_resolve_like_single_versions(breakpoints):
+    php_image_tags = PhpImageTags(breakpoints)
+    moodle_versions = ["4.4", "2.9", "3.10.11", "4.2.3", "3.8.3", "4.2.3", "4.0"]
+    resolved = php_image_tags.resolve_many(moodle_versions)
+    assert list(resolved) == ["2.9", "3.8.3", "3.10.11", "4.0", "4.2.3", "4.4"]
+    assert resolved["2.9"] is None
+    for moodle_version, image_tag in resolved.items():
+        if image_tag is not None:
+            assert php_image_tags.resolve(moodle_version) == image_tag
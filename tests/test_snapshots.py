@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Tests for the store of database snapshots new test environments are seeded from."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+from theme_boost_union_test_envs.domain import DatabaseSnapshotStore
+
+snapshot_module = importlib.import_module("theme_boost_union_test_envs.domain.snapshot")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        snapshot_module, "config", lambda: SimpleNamespace(working_dir=tmp_path)
+    )
+    return DatabaseSnapshotStore()
+
+
+@pytest.fixture
+def generator(tmp_path):
+    script = tmp_path / "smartdata.php"
+    script.write_text("<?php // generate courses")
+    return script
+
+
+def test_snapshots_are_published_once_captured(store, generator):
+    assert store.find("4.3", generator) is None
+    with store.capture("4.3", generator) as snapshot:
+        snapshot.database.write_bytes(b"dump")
+        snapshot.moodledata.write_bytes(b"tar")
+    found = store.find("4.3", generator)
+    assert found.database.read_bytes() == b"dump"
+    # nothing left to capture for the next environment of this version
+    with store.capture("4.3", generator) as snapshot:
+        assert snapshot is None
+    # ... unless the data generator changed
+    generator.write_text("<?php // generate more courses")
+    assert store.find("4.3", generator) is None
+
+
+def test_failed_captures_are_discarded(store, generator):
+    with pytest.raises(RuntimeError):
+        with store.capture("4.3", generator) as snapshot:
+            snapshot.database.write_bytes(b"half a dump")
+            raise RuntimeError
+    assert store.find("4.3", generator) is None
+    assert [
+        p.name for p in store.directory.iterdir() if not p.name.endswith(".lock")
+    ] == []
+
+
+def test_disabled_snapshots(tmp_path, monkeypatch, generator):
+    monkeypatch.setattr(
+        snapshot_module, "config", lambda: SimpleNamespace(working_dir=tmp_path)
+    )
+    store = DatabaseSnapshotStore(enabled=False)
+    with store.capture("4.3", generator) as snapshot:
+        assert snapshot is None
+    assert store.find("4.3", generator) is None
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Tests for the SQLite state backend and the port leases persisted in it."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import yaml
+from dependency_injector import providers
+
+from theme_boost_union_test_envs import exceptions
+from theme_boost_union_test_envs.app import Application, application
+from theme_boost_union_test_envs.cross_cutting import (
+    ApplicationConfigManager,
+    PortAllocator,
+    SQLiteStateBackend,
+)
+from theme_boost_union_test_envs.domain import invalidate_inventory
+from theme_boost_union_test_envs.exceptions import (
+    InfrastructureDoesNotExistYetError,
+    PortRangeExhaustedError,
+)
+
+REPO_ROOT = Path(__file__).parents[1]
+
+MOODLE = {
+    "status": "CREATED",
+    "url": "http://localhost:4711",
+    "admin_pw": "secret",
+    "www_port": 4711,
+    "db_port": 4712,
+}
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteStateBackend(tmp_path / "state.sqlite3")
+
+
+@pytest.fixture
+def fresh_host(tmp_path, monkeypatch):
+    """An application whose working directory does not exist yet, like on a host the testbed has never been initialized on."""
+    environment = yaml.safe_load((REPO_ROOT / "env.local.yml").read_text())
+    environment["working_dir"] = str(tmp_path / "working_dir")
+    environment["state_backend"] = "sqlite"
+    environment_file = tmp_path / "env.test.yml"
+    environment_file.write_text(yaml.dump(environment))
+    config = ApplicationConfigManager(
+        config=yaml.safe_load((REPO_ROOT / "config.yml").read_text()),
+        moodle_versions_to_php_versions=yaml.safe_load(
+            (REPO_ROOT / "moodle-versions-to-supported-php-versions.yaml").read_text()
+        ),
+        environment_file=environment_file,
+    )
+    Application.cross_cutting_concerns.config_manager.override(providers.Object(config))
+    application.cache_clear()
+    invalidate_inventory()
+    # neither the data generator nor moodle-docker are fetched from GitHub here
+    monkeypatch.setattr(
+        "requests.get", lambda *args, **kwargs: SimpleNamespace(content=b"<?php")
+    )
+
+    def clone_moodle_docker_repo():
+        config.moodle_docker_dir.mkdir()
+        return SimpleNamespace(
+            repo=SimpleNamespace(working_dir=str(config.moodle_docker_dir))
+        )
+
+    testbed = importlib.import_module("theme_boost_union_test_envs.domain.testbed")
+    monkeypatch.setattr(testbed, "clone_moodle_docker_repo", clone_moodle_docker_repo)
+    yield config
+    Application.cross_cutting_concerns.config_manager.reset_override()
+    application.cache_clear()
+    invalidate_inventory()
+
+
+def test_mutations_keep_the_yaml_shape(backend):
+    backend.new_infrastructure("pr-1", 1, "PULL_REQUEST")
+    backend.add_moodles_to_infrastructure("pr-1", {"4.3": MOODLE})
+    backend.change_moodle_test_container_status("pr-1", "STARTED", "4.3", "4.4")
+    assert backend.load_testbed_info() == {
+        "pr-1": {
+            "git_ref": {"type": "PULL_REQUEST", "reference": 1},
+            "moodles": {"4.3": {**MOODLE, "status": "STARTED"}},
+        }
+    }
+    backend.remove_moodle("pr-1", "4.3")
+    assert backend.get_infrastructure("pr-1")["moodles"] == {}
+    backend.remove_infrastructure("pr-1")
+    assert backend.load_testbed_info() == {}
+
+
+def test_indexed_lookups(backend):
+    backend.new_infrastructure("main", "main", "BRANCH")
+    backend.new_infrastructure("pr-1", 1, "PULL_REQUEST")
+    backend.add_moodles_to_infrastructure("main", {"4.3": MOODLE})
+    backend.add_moodles_to_infrastructure(
+        "pr-1", {"4.3": {**MOODLE, "www_port": 5000, "db_port": 5001}}
+    )
+    assert set(backend.find_moodles_by_version("4.3")) == {"main", "pr-1"}
+    assert set(backend.find_moodles_by_version("4.4")) == set()
+
+
+def test_moodles_need_an_infrastructure(backend):
+    with pytest.raises(InfrastructureDoesNotExistYetError):
+        backend.add_moodles_to_infrastructure("missing", {"4.3": MOODLE})
+
+
+def test_failed_transactions_are_rolled_back(backend):
+    with pytest.raises(RuntimeError):
+        with backend.transaction():
+            backend.new_infrastructure("main", "main", "BRANCH")
+            raise RuntimeError
+    assert backend.load_testbed_info() == {}
+
+
+def test_concurrent_mutations_are_not_lost(backend):
+    backend.new_infrastructure("main", "main", "BRANCH")
+
+    def add(version):
+        backend.add_moodles_to_infrastructure("main", {version: MOODLE})
+
+    threads = [threading.Thread(target=add, args=(f"4.{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(backend.get_infrastructure("main")["moodles"]) == 8
+
+
+def test_legacy_yaml_is_imported_and_exported(tmp_path):
+    legacy = tmp_path / "infrastructure.yaml"
+    testbed = {
+        "main": {
+            "git_ref": {"type": "BRANCH", "reference": "main"},
+            "moodles": {"4.3": MOODLE},
+        }
+    }
+    legacy.write_text(yaml.dump(testbed))
+    backend = SQLiteStateBackend(tmp_path / "state.sqlite3", legacy_yaml=legacy)
+    assert backend.load_testbed_info() == testbed
+    exported = tmp_path / "export.yaml"
+    backend.export_yaml(exported)
+    assert yaml.safe_load(exported.read_text()) == testbed
+
+
+def test_port_leases_are_released_with_their_environment(backend):
+    backend.new_infrastructure("main", "main", "BRANCH")
+    backend.add_moodles_to_infrastructure("main", {"4.3": MOODLE})
+    backend.lease_ports("main", "4.4", [5000, 5001])
+    assert backend.used_ports() == {4711, 4712, 5000, 5001}
+    # leasing again replaces the previous leases of the environment
+    backend.lease_ports("main", "4.4", [5002, 5003])
+    assert backend.used_ports() == {4711, 4712, 5002, 5003}
+    backend.remove_moodle("main", "4.4")
+    assert backend.used_ports() == {4711, 4712}
+    backend.lease_ports("main", "4.4", [5000, 5001])
+    backend.remove_infrastructure("main")
+    assert backend.used_ports() == set()
+
+
+def test_parallel_port_allocations_do_not_collide(backend):
+    backend.new_infrastructure("main", "main", "BRANCH")
+    allocator = PortAllocator(backend, 40000, 40100)
+    allocated = []
+
+    def allocate(version):
+        allocated.extend(allocator.allocate("main", version))
+
+    threads = [threading.Thread(target=allocate, args=(f"4.{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(allocated) == len(set(allocated)) == 16
+    assert backend.used_ports() == set(allocated)
+
+
+def test_exhausted_port_range(backend):
+    backend.new_infrastructure("main", "main", "BRANCH")
+    allocator = PortAllocator(backend, 40000, 40002)
+    allocator.allocate("main", "4.3")
+    with pytest.raises(PortRangeExhaustedError):
+        allocator.allocate("main", "4.4")
+
+
+def test_database_is_only_opened_on_first_access(tmp_path):
+    database = tmp_path / "working_dir" / "state.sqlite3"
+    backend = SQLiteStateBackend(database)
+    assert not database.parent.exists()
+    database.parent.mkdir()
+    assert backend.load_testbed_info() == {}
+    assert database.exists()
+
+
+def test_init_on_a_fresh_host(fresh_host):
+    core = application().core()
+    with pytest.raises(exceptions.TestbedDoesNotExistYetError):
+        core.list_infrastructures()
+    core.init_testbed()
+    assert fresh_host.working_dir.is_dir()
+    assert fresh_host.state_db.exists()
+    core.list_infrastructures()
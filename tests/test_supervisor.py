@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Tests for the supervisor stopping idle and waking requested test environments."""
+# pylint: disable=redefined-outer-name
+
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from theme_boost_union_test_envs.domain import Supervisor
+
+
+@pytest.fixture
+def environments(tmp_path):
+    started = {("main", "4.3"), ("main", "4.4")}
+    calls = {"stop": [], "wake": threading.Event()}
+
+    def stop(infrastructure_name, version):
+        calls["stop"].append((infrastructure_name, version))
+        started.discard((infrastructure_name, version))
+
+    def wake(infrastructure_name, version):
+        started.add((infrastructure_name, version))
+        calls["wake"].set()
+
+    supervisor = Supervisor(
+        started_environments=lambda: set(started),
+        access_log=lambda infra, version: tmp_path / f"{infra}-{version}.access.log",
+        stop=stop,
+        wake=wake,
+        idle_timeout=60,
+    )
+    return supervisor, calls, tmp_path
+
+
+def test_only_idle_environments_are_stopped(environments):
+    supervisor, calls, logs = environments
+    now = time.time()
+    # noticed now, so both get the whole idle timeout
+    assert supervisor.stop_idle_environments(now) == []
+    (logs / "main-4.4.access.log").write_text("GET /main/4.4/ 200\n")
+    os.utime(logs / "main-4.4.access.log", (now + 30, now + 30))
+    assert supervisor.stop_idle_environments(now + 61) == [("main", "4.3")]
+    assert calls["stop"] == [("main", "4.3")]
+    os.utime(logs / "main-4.4.access.log", (now + 100, now + 100))
+    assert supervisor.stop_idle_environments(now + 120) == []
+    assert supervisor.stop_idle_environments(now + 161) == [("main", "4.4")]
+
+
+def test_requests_for_stopped_environments_wake_them(environments):
+    supervisor, calls, _ = environments
+    server = supervisor.serve(0)
+    try:
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{server.server_address[1]}/main/4.5/login/",
+            headers={"X-Test-Environment": "main/4.5"},
+        )
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 503
+        assert e.value.headers["Retry-After"] == "10"
+        assert calls["wake"].wait(5)
+        # the woken environment is not stopped right away
+        assert supervisor.stop_idle_environments() == []
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Tests for the spans recording how long the phases of a command take."""
+# pylint: disable=redefined-outer-name
+
+import importlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from theme_boost_union_test_envs.cross_cutting import (
+    TraceFormat,
+    Tracer,
+    propagate_context,
+    traced,
+)
+
+tracing_module = importlib.import_module(
+    "theme_boost_union_test_envs.cross_cutting.tracing"
+)
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer()
+    tracer.enabled = True
+    monkeypatch.setattr(tracing_module, "_tracer", tracer)
+    return tracer
+
+
+@traced("build")
+def build(infrastructure, *versions, jobs=1):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(propagate_context(build_version), versions))
+
+
+@traced(attributes=lambda version: {"version": version})
+def build_version(version):
+    if version == "broken":
+        raise ValueError(version)
+
+
+def test_spans_are_nested_across_worker_threads(tracer):
+    build("infra", "4.1", "4.2")
+    spans = {s.name: s for s in tracer.spans}
+    root = spans["build"]
+    assert root.parent_id is None
+    assert root.attributes == {
+        "infrastructure": "infra",
+        "versions": "4.1,4.2",
+        "jobs": 1,
+    }
+    children = [s for s in tracer.spans if s.name == "build_version"]
+    assert sorted(s.attributes["version"] for s in children) == ["4.1", "4.2"]
+    assert all(s.parent_id == root.span_id for s in children)
+    assert all(s.trace_id == root.trace_id for s in children)
+
+
+def test_disabled_tracer_records_nothing(tracer):
+    tracer.enabled = False
+    build("infra", "4.1")
+    assert tracer.spans == []
+
+
+def test_summary_counts_failed_spans(tracer):
+    with pytest.raises(ValueError):
+        build("infra", "4.1", "broken")
+    summary = {s.name: s for s in tracer.summary()}
+    assert summary["build_version"].count == 2
+    assert summary["build_version"].failed == 1
+    assert summary["build"].failed == 1
+
+
+def test_spans_are_exported_as_json_lines_or_otlp(tracer, tmp_path):
+    build("infra", "4.1")
+    jsonl = tmp_path / "traces.jsonl"
+    tracer.export(jsonl, TraceFormat.JSONL)
+    records = [json.loads(line) for line in jsonl.read_text().splitlines()]
+    assert {r["name"] for r in records} == {"build", "build_version"}
+    otlp = tmp_path / "traces.otlp.jsonl"
+    tracer.export(otlp, TraceFormat.OTLP)
+    (request,) = [json.loads(line) for line in otlp.read_text().splitlines()]
+    spans = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    version_span = next(s for s in spans if s["name"] == "build_version")
+    assert version_span["attributes"] == [
+        {"key": "version", "value": {"stringValue": "4.1"}}
+    ]
+    assert version_span["status"] == {"code": 1}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Tests for deleting torn down directories in the background."""
+
+import os
+
+from theme_boost_union_test_envs.cross_cutting import Trash
+
+
+def test_discarded_directories_are_deleted_in_the_background(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    (shared / "kept.txt").write_text("shared")
+    (shared / "cached.txt").write_bytes(b"x" * 8192)
+    infrastructure = tmp_path / "main"
+    (infrastructure / "moodles" / "4.3").mkdir(parents=True)
+    (infrastructure / "moodles" / "4.3" / "config.php").write_bytes(b"x" * 8192)
+    # hardlinked from the cache, so deleting it frees nothing
+    os.link(shared / "cached.txt", infrastructure / "moodles" / "4.3" / "cached.txt")
+    # like the links into the shared moodle-docker trees
+    (infrastructure / "moodles" / "4.3" / "docker").symlink_to(shared)
+    trash = Trash(tmp_path / ".trash")
+    trashed = trash.discard(infrastructure)
+    # the name is free right away
+    assert not infrastructure.exists()
+    assert trashed.parent.parent == tmp_path / ".trash"
+    freed = trash.wait()
+    assert not trashed.exists()
+    assert 8192 <= freed < 2 * 8192
+    assert (shared / "kept.txt").read_text() == "shared"
+    assert (shared / "cached.txt").exists()
+
+
+def _discard_unscheduled(trash, path, monkeypatch):
+    # like an invocation that has not come around to delete it yet
+    with monkeypatch.context() as m:
+        m.setattr(trash, "_schedule", lambda: None)
+        return trash.discard(path)
+
+
+def test_only_claimed_directories_are_deleted(tmp_path, monkeypatch):
+    (tmp_path / "main").mkdir()
+    (tmp_path / "pr-1").mkdir()
+    other = Trash(tmp_path / ".trash")
+    others = _discard_unscheduled(other, tmp_path / "main", monkeypatch)
+    trash = Trash(tmp_path / ".trash")
+    trash.discard(tmp_path / "pr-1")
+    trash.wait()
+    # the other invocation is still alive, so it's directories are left alone
+    assert others.exists()
+    other._schedule()
+    other.wait()
+    assert not others.exists()
+
+
+def test_leftovers_of_killed_invocations_are_deleted(tmp_path, monkeypatch):
+    (tmp_path / "main").mkdir()
+    (tmp_path / "pr-1").mkdir()
+    killed = Trash(tmp_path / ".trash")
+    leftover = _discard_unscheduled(killed, tmp_path / "main", monkeypatch)
+    # the OS releases the lock of a killed process
+    killed._claim_lock.close()
+    trash = Trash(tmp_path / ".trash")
+    trash.discard(tmp_path / "pr-1")
+    trash.wait()
+    assert not leftover.exists()
+    assert sorted(p.name for p in (tmp_path / ".trash").iterdir()) == [
+        trash._claimed.name,
+        f"{trash._claimed.name}.lock",
+    ]
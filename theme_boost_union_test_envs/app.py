@@ -1,4 +1,6 @@
+import functools
 import sys
+from collections.abc import Callable
 from enum import Enum
 from pathlib import Path
 
@@ -9,12 +11,15 @@ from .core import BoostUnionTestEnvCore
 from .cross_cutting import (
     ApplicationConfigManager,
     ApplicationLogger,
-    InfrastructureYAMLParser,
+    NginxConfigs,
+    PortAllocator,
     TemplateEngine,
+    Trash,
+    create_state_backend,
 )
-from .domain import GitRepository, MoodleCache, MoodleDownloader
+from .domain import DatabaseSnapshotStore, GitRepository, MoodleCache, MoodleDownloader
 from .exceptions import BoostUnionTestEnvValueError
-from .ui import cli_main, gui_main
+from .ui import RemoteCore, cli_main, gui_main
 
 # The classes "Adapters", "Domain", "CrossCuttingConcerns" and "Application" are simply containers that utilize dependency injection to make sure that all the correct classes are mapped to mandatory variables in the constructors.
 
@@ -27,17 +32,29 @@ class Adapters(containers.DeclarativeContainer):
         MoodleDownloader,
         url=config.moodle.downloader.url,
         retries=config.moodle.downloader.retries,
-        retry_timeout=config.moodle.downloader.retries,
+        retry_timeout=config.moodle.downloader.retry_timeout,
+        chunk_size=config.moodle.downloader.chunk_size,
+        parallel_downloads=config.moodle.downloader.parallel_downloads,
     )
 
 
 class Domain(containers.DeclarativeContainer):
 
+    config = providers.Configuration()
     adapters = providers.DependenciesContainer()
 
     moodle_cache = providers.Singleton(
         MoodleCache,
         downloader=adapters.moodle_downloader,
+        max_size_mb=config.moodle.cache.max_size_mb,
+        eviction_policy=config.moodle.cache.eviction_policy,
+        verification=config.moodle.cache.verification,
+        clone_strategies=config.moodle.cache.clone_strategies,
+    )
+
+    database_snapshots = providers.Singleton(
+        DatabaseSnapshotStore,
+        enabled=config.moodle.snapshots.enabled,
     )
 
 
@@ -58,9 +75,28 @@ class CrossCuttingConcerns(containers.DeclarativeContainer):
         moodle_versions_to_php_versions=moodle_versions_to_php_versions,
     )
 
-    infrastructure_yaml_parser = providers.Singleton(InfrastructureYAMLParser)
+    infrastructure_yaml_parser = providers.Singleton(
+        create_state_backend,
+        backend=config_manager.provided.state_backend,
+        database=config_manager.provided.state_db,
+        yaml_database=config_manager.provided.infra_yaml,
+    )
+    port_allocator = providers.Singleton(
+        PortAllocator,
+        state=infrastructure_yaml_parser,
+        first_port=config_manager.provided.first_port,
+        last_port=config_manager.provided.last_port,
+    )
     log = providers.Singleton(ApplicationLogger)
+    nginx_configs = providers.Singleton(
+        NginxConfigs,
+        config_dir=config_manager.provided.nginx_dir,
+        test_command=config_manager.provided.nginx_test_command,
+        reload_command=config_manager.provided.nginx_reload_command,
+        reload_delay=config_manager.provided.nginx_reload_delay,
+    )
     template_engine = providers.Singleton(TemplateEngine)
+    trash = providers.Singleton(Trash, directory=config_manager.provided.trash_dir)
 
 
 class Application(containers.DeclarativeContainer):
@@ -79,6 +115,7 @@ class Application(containers.DeclarativeContainer):
 
     domain = providers.Container(
         Domain,
+        config=config.domain,
         adapters=adapters,
     )
 
@@ -88,6 +125,17 @@ class Application(containers.DeclarativeContainer):
         template_engine=cross_cutting_concerns.template_engine,
     )
 
+    remote_core = providers.Singleton(
+        RemoteCore,
+        socket_path=cross_cutting_concerns.config_manager.provided.daemon_socket,
+    )
+
+
+@functools.cache
+def application() -> Application:
+    """Returns the application container of this invocation. It's built only once, so all accessors like config() or log() share the same singletons instead of reading the config files again on every call."""
+    return Application()
+
 
 class UserInterface(str, Enum):
     CLI = "cli"
@@ -97,9 +145,9 @@ class UserInterface(str, Enum):
 def main(
     interface_choice: UserInterface,
 ) -> int:
-    app = Application()
-    # This starts the wiring for our DI library by providing it the package from which the required classes should come from
-    app.wire(packages=["theme_boost_union_test_envs"])
+    app = application()
+    # only this module injects anything; wiring the whole package would import every module of it, even if the chosen command never needs them
+    app.wire(modules=[__name__])
     _spawn_interface(interface_choice)
     return 0
 
@@ -108,21 +156,23 @@ def main(
 @inject
 def _spawn_interface(
     interface_choice: UserInterface,
-    core: BoostUnionTestEnvCore = Provide[Application.core],
+    core: Callable[[], BoostUnionTestEnvCore] = Provide[Application.core.provider],
+    remote_core: RemoteCore = Provide[Application.remote_core],
 ) -> None:
     """Spawns the chosen interface and gives control to said interface.
 
     Args:
         interface_choice (UserInterface): A value from the UserInterface enum, that decides which interface will be spawned. Valid values: CLI or GUI.
-        core (BoostUnionTestEnvCore, optional): Injected core object. Defaults to Provide[Application.core].
+        core (Callable[[], BoostUnionTestEnvCore], optional): Injected provider of the core object; the core is only built if no daemon is running. Defaults to Provide[Application.core.provider].
+        remote_core (RemoteCore, optional): Injected client of the daemon. Defaults to Provide[Application.remote_core].
 
     Raises:
         BoostUnionTestEnvValueError: raised if an invalid interface choice has been made
     """
     if interface_choice == UserInterface.CLI:
-        cli_main(core)
+        cli_main(core, remote_core)
     elif interface_choice == UserInterface.GUI:
-        gui_main(core)
+        gui_main(remote_core if remote_core.is_available() else core())
     else:
         valid_interfaces = [f"UserInterface.{e.value.upper()}" for e in UserInterface]
         raise BoostUnionTestEnvValueError(
@@ -1,20 +1,47 @@
 import functools
-import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pprint import PrettyPrinter
 from typing import Any, Callable
 
 from .cross_cutting import (
-    InfrastructureYAMLParser,
+    StateBackend,
     TemplateEngine,
     config,
     log,
+    nginx_configs,
+    propagate_context,
     template_engine,
-    yaml_parser,
+    traced,
+    tracer,
+)
+from .domain import (
+    CachePruneResult,
+    CacheStats,
+    ContainerActionExecutor,
+    ContainerBatchResult,
+    GitReference,
+    MatrixEntry,
+    MatrixEntryResult,
+    MatrixResult,
+    MatrixSpec,
+    Supervisor,
+    TeardownResult,
+    Testbed,
+    TestContainer,
+    TestInfrastructure,
+    boost_union_mirror,
+    invalidate_inventory,
+    inventory,
+    list_released_moodle_versions,
+    moodle_cache,
 )
-from .domain import GitReference, Testbed, TestContainer, TestInfrastructure
 from .exceptions import (
+    BoostUnionTestEnvValueError,
     InfrastructureDoesNotExistYetError,
+    MoodleTestEnvironmentDoesNotExistYetError,
     NameAlreadyTakenError,
     TestbedDoesNotExistYetError,
 )
@@ -35,19 +62,61 @@ def recreate_overview_html(func: Callable[..., Any]) -> Callable[..., Any]:
         # call the wrapped function with all passed args
         value = func(*args, **kwargs)
         # make sure the html page is updated after each command
-        infrastructure_yaml = yaml_parser().load_testbed_info()
-        template_engine().test_environment_overview_html(
-            {"infrastructures": infrastructure_yaml}
-        )
+        # the inventory has been rebuilt after commands changing the testbed, otherwise the already loaded state is reused
+        with tracer().span("core.render_overview"):
+            template_engine().test_environment_overview_html(
+                {"infrastructures": inventory().state}
+            )
+        return value
+
+    return wrapper_decorator
+
+
+def regenerate_nginx_map(func: Callable[..., Any]) -> Callable[..., Any]:
+    """This decorator makes sure that after the wrapped function changed the testbed successfully, the nginx map routing requests to the test environments is rendered from our state store again and applied, if the environments are routed by a map.
+
+    Args:
+        func (Callable[..., Any]): a function that changes which test environments exist
+
+    Returns:
+        Callable[..., Any]: the wrapped function
+    """
+
+    @functools.wraps(func)
+    def wrapper_decorator(*args: tuple[Any, ...], **kwargs: dict[str, Any]) -> Any:
+        value = func(*args, **kwargs)
+        with tracer().span("core.render_nginx_map"):
+            if template_engine().moodle_nginx_map(inventory().state):
+                nginx_configs().apply()
         return value
 
     return wrapper_decorator
 
 
+def invalidates_inventory(func: Callable[..., Any]) -> Callable[..., Any]:
+    """This decorator makes sure that the inventory of our testbed is invalidated after the wrapped function changed the testbed, even if it failed halfway through.
+
+    Args:
+        func (Callable[..., Any]): a function that changes the testbed
+
+    Returns:
+        Callable[..., Any]: the wrapped function
+    """
+
+    @functools.wraps(func)
+    def wrapper_decorator(*args: tuple[Any, ...], **kwargs: dict[str, Any]) -> Any:
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invalidate_inventory()
+
+    return wrapper_decorator
+
+
 def check_testbed_existence(func: Callable[..., Any]) -> Callable[..., Any]:
     @functools.wraps(func)
     def wrapper_decorator(*args: tuple[Any, ...], **kwargs: dict[str, Any]) -> Any:
-        if not config().working_dir.exists():
+        if not inventory().testbed_exists:
             raise TestbedDoesNotExistYetError
         # call the wrapped function with all passed args
         value = func(*args, **kwargs)
@@ -59,22 +128,26 @@ def check_testbed_existence(func: Callable[..., Any]) -> Callable[..., Any]:
 class BoostUnionTestEnvCore:
     def __init__(
         self,
-        yaml_parser: InfrastructureYAMLParser,
+        yaml_parser: StateBackend,
         template_engine: TemplateEngine,
     ) -> None:
         self.yaml_parser = yaml_parser
         self.template_engine = template_engine
 
+    @traced("core.init_testbed")
     @recreate_overview_html
+    @regenerate_nginx_map
+    @invalidates_inventory
     def init_testbed(self) -> None:
         new_testbed = Testbed()
         new_testbed.init()
 
+    @traced("core.list_infrastructures")
     @recreate_overview_html
     @check_testbed_existence
     def list_infrastructures(self) -> None:
         # Reading infrastructure info from "yaml file database" and printing it
-        infrastructures = self.yaml_parser.load_testbed_info()
+        infrastructures = inventory().state
         if not infrastructures:
             log().info("No infrastructure exists yet")
         else:
@@ -82,13 +155,15 @@ class BoostUnionTestEnvCore:
             pretty_infras = PrettyPrinter(depth=4).pformat(infrastructures)
             log().info(f"Listing all infrastructures: \n{pretty_infras}")
 
+    @traced("core.setup_infrastructure")
     @recreate_overview_html
+    @invalidates_inventory
     @check_testbed_existence
     def setup_infrastructure(
         self, infrastructure_name: str, git_ref: GitReference
     ) -> None:
         path = config().working_dir / infrastructure_name
-        if path.exists():
+        if inventory().has_infrastructure(infrastructure_name):
             raise NameAlreadyTakenError("Infrastructure exists already")
         new_infra = TestInfrastructure(path)
         new_infra.setup(git_ref)
@@ -97,86 +172,297 @@ class BoostUnionTestEnvCore:
             infrastructure_name, git_ref.ref, git_ref.type.name
         )
 
+    @traced("core.build_infrastructure")
     @recreate_overview_html
+    @regenerate_nginx_map
+    @invalidates_inventory
     @check_testbed_existence
-    def build_infrastructure(self, infrastructure_name: str, *versions: str) -> None:
+    def build_infrastructure(
+        self, infrastructure_name: str, *versions: str, jobs: int = 1
+    ) -> None:
         path = config().working_dir / infrastructure_name
-        if not path.exists():
+        if not inventory().has_infrastructure(infrastructure_name):
             raise InfrastructureDoesNotExistYetError()
         existing_infra = TestInfrastructure(path)
-        built_moodles = existing_infra.build(*versions)
+        built_moodles = existing_infra.build(*versions, jobs=jobs)
         # Adding new moodle environments in selected infrastructure to file database
+        # only done once after all (possibly parallel) builds are done, so concurrent builds never race on the file
         self.yaml_parser.add_moodles_to_infrastructure(
             infrastructure_name, built_moodles
         )
-        if config().is_proxied:
-            log().info(
-                "restarting nginx, our proxy server; you will lose connection if you are logged in via web-browser"
-            )
-            # This looks dangerous, but isn't.
-            # I require of the administrator to provide the user which runs this script to allow an exception solely for the restart of nginx.
-            # This can be done by sudo visudo -f /etc/sudoers.d/allow-systemctl-for-boost-union-testing
-            # and entering: $user ALL=NOPASSWD: /usr/bin/systemctl restart nginx
-            # This "convoluted" idea came from a lazy perspective of not wanting to handle root privileges inside this programm.
-            # This way, only the spawned subshell gains sudo rights; and also only specifically for a Nginx restart
-            subprocess.run(["sudo systemctl restart nginx"], shell=True)
-            # We are only restarting Nginx after a new test env has been added, as we want to reduce the amount of restarts.
-            # Normally we should restart after removing a test environment too, but it shouldn't be harmful to leave Nginx running with a few flawed configs
+        # the nginx configs of all new environments are checked together and share a single graceful reload
+        # This looks dangerous, but isn't.
+        # I require of the administrator to provide the user which runs this script to allow an exception solely for checking and reloading nginx.
+        # This can be done by sudo visudo -f /etc/sudoers.d/allow-systemctl-for-boost-union-testing
+        # and entering: $user ALL=NOPASSWD: /usr/sbin/nginx -t, /usr/bin/systemctl reload nginx
+        # This "convoluted" idea came from a lazy perspective of not wanting to handle root privileges inside this programm.
+        # This way, only the spawned subprocesses gain sudo rights; and also only specifically for checking and reloading nginx
+        nginx_configs().apply()
+        # We are only reloading Nginx after a new test env has been added, as we want to reduce the amount of reloads.
+        # Normally we should reload after removing a test environment too, but it shouldn't be harmful to leave Nginx running with a few flawed configs
 
+    @traced("core.teardown_infrastructure")
     @recreate_overview_html
+    @regenerate_nginx_map
+    @invalidates_inventory
     @check_testbed_existence
-    def teardown_infrastructure(self, infrastructure_name: str) -> None:
+    def teardown_infrastructure(
+        self, infrastructure_name: str, jobs: int | None = None
+    ) -> TeardownResult:
         path = config().working_dir / infrastructure_name
-        if not path.exists():
+        if not inventory().has_infrastructure(infrastructure_name):
             raise InfrastructureDoesNotExistYetError()
         existing_infra = TestInfrastructure(path)
-        existing_infra.teardown()
-        # Removing infrastructure from file database
-        self.yaml_parser.remove_infrastructure(infrastructure_name)
+        result = existing_infra.teardown(jobs=jobs)
+        if result.succeeded:
+            # Removing infrastructure from file database
+            self.yaml_parser.remove_infrastructure(infrastructure_name)
+        return result
+
+    @traced("core.build_matrix")
+    @check_testbed_existence
+    def build_matrix(self, spec: MatrixSpec, jobs: int = 1) -> MatrixResult:
+        """Sets up and builds all infrastructures of the given spec. Each Moodle version and each git reference is only fetched once upfront, instead of once per infrastructure needing it; afterwards, at most 'jobs' infrastructures are set up and built at once.
+        Infrastructures existing already are only built, so a spec can be run again after some of it failed. A failing infrastructure does not stop the others; it's failure is recorded in the returned result instead.
+
+        Args:
+            spec (MatrixSpec): which infrastructures should be built with which Moodle versions
+            jobs (int, optional): how many infrastructures are set up and built in parallel. Defaults to 1.
+
+        Raises:
+            BoostUnionTestEnvValueError: raised if jobs is not a positive number
+
+        Returns:
+            MatrixResult: the outcome and duration of every infrastructure
+        """
+        if jobs < 1:
+            raise BoostUnionTestEnvValueError(
+                f"the number of parallel jobs needs to be atleast 1, got {jobs}"
+            )
+        start = time.monotonic()
+        new_refs = [
+            entry.git_ref
+            for entry in spec.entries
+            if not inventory().has_infrastructure(entry.infrastructure)
+        ]
+        log().info(
+            f"planning {len(spec.entries)} infrastructures, {len(new_refs)} to set up, with moodle {', '.join(spec.versions)}"
+        )
+        try:
+            # downloads all missing versions concurrently; the builds find them in the cache afterwards
+            moodle_cache().get_source_trees(*spec.versions)
+        except BoostUnionTestEnvValueError as e:
+            # each build fetches it's versions again, so only the infrastructures needing a broken version fail
+            log().warning(f"could not fetch all moodle versions upfront: {e}")
+        with boost_union_mirror().prefetched(*new_refs), ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="matrix"
+        ) as executor:
+            results = list(
+                executor.map(propagate_context(self._build_matrix_entry), spec.entries)
+            )
+        return MatrixResult(time.monotonic() - start, results)
 
+    def _build_matrix_entry(self, entry: MatrixEntry) -> MatrixEntryResult:
+        result = MatrixEntryResult(
+            entry.infrastructure,
+            f"{entry.git_ref.type.value}:{entry.git_ref.ref}",
+            entry.versions,
+        )
+        start = time.monotonic()
+        with log().contextualize(env=entry.infrastructure):
+            try:
+                existing = inventory().state.get(entry.infrastructure)
+                if existing is None:
+                    self.setup_infrastructure(entry.infrastructure, entry.git_ref)
+                    result.set_up = True
+                elif existing["git_ref"]["type"] != entry.git_ref.type.name or str(
+                    existing["git_ref"]["reference"]
+                ) != str(entry.git_ref.ref):
+                    raise NameAlreadyTakenError(
+                        f"{entry.infrastructure} exists already with another git reference"
+                    )
+                self.build_infrastructure(entry.infrastructure, *entry.versions)
+            except Exception as e:
+                result.error = str(e) or type(e).__name__
+                log().error(f"building {entry.infrastructure} failed: {result.error}")
+        result.duration = time.monotonic() - start
+        return result
+
+    @traced("core.start_environment")
     @recreate_overview_html
-    def start_environment(self, infrastructure_name: str, *versions: str) -> None:
-        self._container_call_helper(
+    @invalidates_inventory
+    def start_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        result: ContainerBatchResult = self._container_call_helper(
             infrastructure_name,
             TestContainer.start,
             *versions,
+            jobs=jobs,
         )
-        # make sure the selected moodle test containers are listed as "STARTED" in the yaml DB
+        # make sure the successfully started moodle test containers are listed as "STARTED" in the yaml DB
         self.yaml_parser.change_moodle_test_container_status(
-            infrastructure_name, "STARTED", *versions
+            infrastructure_name, "STARTED", *result.succeeded
         )
+        return result
 
+    @traced("core.stop_environment")
     @recreate_overview_html
-    def stop_environment(self, infrastructure_name: str, *versions: str) -> None:
-        self._container_call_helper(
+    @invalidates_inventory
+    def stop_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        result: ContainerBatchResult = self._container_call_helper(
             infrastructure_name,
             TestContainer.stop,
             *versions,
+            jobs=jobs,
         )
-        # make sure the selected moodle test containers are listed as "STOPPED in the yaml DB
+        # make sure the successfully stopped moodle test containers are listed as "STOPPED in the yaml DB
         self.yaml_parser.change_moodle_test_container_status(
-            infrastructure_name, "STOPPED", *versions
+            infrastructure_name, "STOPPED", *result.succeeded
         )
+        return result
 
+    @traced("core.restart_environment")
     @recreate_overview_html
-    def restart_environment(self, infrastructure_name: str, *versions: str) -> None:
-        self._container_call_helper(
+    @invalidates_inventory
+    def restart_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        result: ContainerBatchResult = self._container_call_helper(
             infrastructure_name,
             TestContainer.restart,
             *versions,
+            jobs=jobs,
         )
         # TODO: should update yaml DB to STARTED? Would involve waiting until restart happened to make sure the right status is listed
+        return result
 
+    @traced("core.wake_environment")
     @recreate_overview_html
-    def destroy_environment(self, infrastructure_name: str, *versions: str) -> None:
-        self._container_call_helper(
+    @invalidates_inventory
+    def wake_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        result: ContainerBatchResult = self._container_call_helper(
+            infrastructure_name,
+            TestContainer.wake,
+            *versions,
+            jobs=jobs,
+        )
+        self.yaml_parser.change_moodle_test_container_status(
+            infrastructure_name, "STARTED", *result.succeeded
+        )
+        return result
+
+    @traced("core.destroy_environment")
+    @recreate_overview_html
+    @regenerate_nginx_map
+    @invalidates_inventory
+    def destroy_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        result: ContainerBatchResult = self._container_call_helper(
             infrastructure_name,
             TestContainer.destroy,
             *versions,
+            jobs=jobs,
         )
-        # make sure the moodle environment is removed from our "yaml database"
-        for ver in versions:
+        # make sure the successfully destroyed moodle environments are removed from our "yaml database"
+        for ver in result.succeeded:
             self.yaml_parser.remove_moodle(infrastructure_name, ver)
+        return result
+
+    @check_testbed_existence
+    def supervise(
+        self,
+        idle_timeout_minutes: float | None = None,
+        stop_event: threading.Event | None = None,
+    ) -> None:
+        """Stops started Moodle test containers that have not been requested for a while and starts them again on their next request, until the process is interrupted.
+
+        Args:
+            idle_timeout_minutes (float | None, optional): minutes without any request after which a container is stopped. Defaults to the configured timeout.
+            stop_event (threading.Event | None, optional): stops supervising once set. Defaults to None.
+        """
+        if not config().is_proxied:
+            log().warning(
+                "not running behind nginx, so requests cannot be seen: started containers will be stopped after the idle timeout regardless of their use"
+            )
+
+        def started_environments() -> list[tuple[str, str]]:
+            # other invocations of this application change the testbed while we are running
+            invalidate_inventory()
+            return [
+                (infrastructure_name, version)
+                for infrastructure_name, data in inventory().state.items()
+                for version, moodle in (data.get("moodles") or {}).items()
+                if moodle.get("status") == "STARTED"
+            ]
+
+        def raise_on_failure(result: ContainerBatchResult) -> None:
+            # the supervisor logs failures itself, it only needs to know about them
+            for action_result in result.results:
+                if not action_result.succeeded:
+                    raise BoostUnionTestEnvValueError(action_result.error)
+
+        supervisor = Supervisor(
+            started_environments=started_environments,
+            access_log=self.template_engine.create_moodle_access_log_path,
+            stop=lambda infra, ver: raise_on_failure(
+                self.stop_environment(infra, ver, jobs=1)
+            ),
+            wake=lambda infra, ver: raise_on_failure(
+                self.wake_environment(infra, ver, jobs=1)
+            ),
+            idle_timeout=(idle_timeout_minutes or config().idle_timeout_minutes) * 60,
+        )
+        supervisor.run(config().wake_port, config().check_interval_seconds, stop_event)
+
+    @traced("core.export_state")
+    @check_testbed_existence
+    def export_state(self, path: Path | None = None) -> Path:
+        destination = path or config().infra_yaml
+        self.yaml_parser.export_yaml(destination)
+        log().info(f"exported all infrastructures to {destination}")
+        return destination
+
+    @traced("core.import_state")
+    @recreate_overview_html
+    @regenerate_nginx_map
+    @invalidates_inventory
+    @check_testbed_existence
+    def import_state(self, path: Path | None = None) -> None:
+        source = path or config().infra_yaml
+        self.yaml_parser.import_yaml(source)
+        log().info(f"imported all infrastructures from {source}")
+
+    @traced("core.php_matrix")
+    def php_matrix(self, *versions: str) -> dict[str, str | None]:
+        """Resolves which moodle-php-apache image each given Moodle version runs on, all in one pass.
+
+        Args:
+            versions (tuple[str, ...]): the Moodle versions; every released Moodle version if none are given
+
+        Returns:
+            dict[str, str | None]: the Moodle versions, sorted, mapped to their image tag; None if they are unsupported
+        """
+        return config().php_image_tags.resolve_many(
+            versions or list_released_moodle_versions()
+        )
+
+    @traced("core.cache_stats")
+    @check_testbed_existence
+    def cache_stats(self) -> CacheStats:
+        return moodle_cache().stats()
+
+    @traced("core.prune_cache")
+    @check_testbed_existence
+    def prune_cache(
+        self, max_size_mb: int | None = None, eviction_policy: str | None = None
+    ) -> CachePruneResult:
+        return moodle_cache().prune(max_size_mb, eviction_policy)
 
     @check_testbed_existence
     def _container_call_helper(
@@ -184,32 +470,46 @@ class BoostUnionTestEnvCore:
         infrastructure_name: str,
         function: Callable[[TestContainer], None],
         *versions: str,
-    ) -> None:
+        jobs: int | None = None,
+    ) -> ContainerBatchResult:
         """Helper function to streamline the way our container functions operate. The only difference between our container functions is the action (start/up, stop, restart, destroy/down) we are issuing towards the containers. The logging and the 'algorithm' is otherwise the same.
+        The action is issued to all selected containers concurrently, with at most 'jobs' containers at a time.
 
         Args:
             infrastructure_name (str): the infrastructure for which the containers should be started for
             function (Callable[[TestContainer], None]): the action that should be issued to the containers (start/up, stop, restart, destroy/down)
-            versions (tuple[str, ...]): moodle versions that decide which containers should be started
+            versions (tuple[str, ...]): moodle versions that decide which containers should be started; all existing containers if none are given
+            jobs (int | None, optional): how many containers should be handled in parallel. Defaults to the configured limit.
 
         Raises:
             InfrastructureDoesNotExistYetError: raised if the passed infrastructure doesn't exist, therefore no containers can exist
+            MoodleTestEnvironmentDoesNotExistYetError: raised if no container exists for one of the given versions; in this case, no action is issued at all
+
+        Returns:
+            ContainerBatchResult: exit code, duration and possible failure of the action for every container
         """
         infrastructure_path = config().working_dir / infrastructure_name
-        if not infrastructure_path.exists():
+        if not inventory().has_infrastructure(infrastructure_name):
             raise InfrastructureDoesNotExistYetError()
         # use function name for logging as it describes perfectly what is going to happen
         action = function.__name__
-        log().info(f"{action} envs for the following versions:")
         # if no version string has been passed, we want to issue the action to all available moodle test containers
         if not versions:
             log().info(f"{action}ing all existing envs")
-            # TODO: return all available versions to start these
+            versions = tuple(inventory().versions(infrastructure_name))
+        log().info(f"{action} envs for the following versions:")
         for ver in versions:
             log().info(f"* {ver}")
-        for ver in versions:
-            path = infrastructure_path / "moodles" / ver
-            log().info(f"{action}ing container for moodle {path.name}")
-            # pythonic way to call a passed, higher-order class instance function on an newly created object
-            function(TestContainer(path))
-            log().info(f"done {action}ing container")
+        containers = [
+            TestContainer(infrastructure_path / "moodles" / ver) for ver in versions
+        ]
+        # check all containers upfront, so a typo does not leave us with half of the containers started
+        for container in containers:
+            if not inventory().has_environment(infrastructure_name, container.version):
+                raise MoodleTestEnvironmentDoesNotExistYetError(container.version)
+        executor = ContainerActionExecutor(jobs or config().parallel_container_actions)
+        result = executor.run(infrastructure_name, function, containers)
+        log().info(
+            f"done {action}ing {len(result.succeeded)} of {len(result.results)} envs in {result.duration:.1f}s"
+        )
+        return result
@@ -1,4 +1,29 @@
 from .configuration import ApplicationConfigManager, config
+from .env_file import EnvironmentFile, load_env_file, parse_env_file
+from .filesystem import (
+    CloneStrategy,
+    atomic_write_text,
+    clone_tree,
+    file_lock,
+    make_read_only,
+    sha256_of_file,
+)
 from .infrastructure_parser import InfrastructureYAMLParser, yaml_parser
 from .logger import ApplicationLogger, log
+from .nginx import NginxConfigs, NginxRouting, nginx_configs
+from .php_versions import PhpImageTags, parse_version
+from .port_allocator import PortAllocator, port_allocator
+from .sqlite_state_backend import SQLiteStateBackend
+from .state_backend import StateBackend, create_state_backend
 from .template_engine import TemplateEngine, template_engine
+from .tracing import (
+    AttributeValue,
+    Span,
+    SpanSummary,
+    TraceFormat,
+    Tracer,
+    propagate_context,
+    traced,
+    tracer,
+)
+from .trash import Trash, trash
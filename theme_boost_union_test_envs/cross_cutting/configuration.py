@@ -6,14 +6,47 @@ import yaml
 from packaging import version
 
 from ..exceptions import BoostUnionTestEnvValueError
+from .nginx import NginxRouting
+from .php_versions import PhpImageTags
+from .tracing import TraceFormat
 
 # Core related keys in config
 PWD = "working_dir"
+STATE_BACKEND = "state_backend"
+PORTS = "ports"
+FIRST_PORT = "first"
+LAST_PORT = "last"
+
+# Container related keys in config
+CONTAINERS = "containers"
+PARALLEL_ACTIONS = "parallel_actions"
+
+# Supervisor related keys in config
+SUPERVISOR = "supervisor"
+IDLE_TIMEOUT = "idle_timeout_minutes"
+CHECK_INTERVAL = "check_interval_seconds"
+WAKE_PORT = "wake_port"
+
+# Nginx related keys in config
+NGINX_TEST_COMMAND = "test_command"
+NGINX_RELOAD_COMMAND = "reload_command"
+NGINX_RELOAD_DELAY = "reload_delay_seconds"
+NGINX_ROUTING = "routing"
+
+# Daemon related keys in config
+DAEMON = "daemon"
+SOCKET = "socket"
+
+# Tracing related keys in config
+TRACING = "tracing"
+TRACE_FILE = "file"
+TRACE_FORMAT = "format"
 
 # Repo related keys in config
 REPO = "repos"
 BU = "boost_union"
 MDL_DKR = "moodle_docker"
+MDL = "moodle"
 URL = "url"
 
 # Proxy related keys in env file
@@ -47,12 +80,25 @@ class ApplicationConfigManager:
             ]
             for moodle_ver, php_vers in moodle_versions_to_php_versions.items()
         }
+        # sorted once, so every lookup is a binary search instead of a scan over the breakpoints
+        self.php_image_tags = PhpImageTags(self.moodle_versions_to_php_versions)
 
         # just exposing the values that are actual of value for cross cutting
         # concerns
         # path related settings
         self.working_dir = self.get_path(environment[PWD])
         self.infra_yaml = self.working_dir / "infrastructure.yaml"
+        # either "sqlite" or "yaml"; older environment files do not know this setting yet
+        self.state_backend = environment.get(STATE_BACKEND, "sqlite")
+        self.state_db = self.working_dir / "infrastructure.sqlite3"
+        # range from which the web and database ports of new test environments are allocated
+        ports = environment.get(PORTS) or {}
+        self.first_port = int(ports.get(FIRST_PORT, 20000))
+        self.last_port = int(ports.get(LAST_PORT, 29999))
+        if not 0 < self.first_port <= self.last_port < 65536:
+            raise BoostUnionTestEnvValueError(
+                f"invalid port range {self.first_port}-{self.last_port}"
+            )
         # nginx related settings
         self.nginx_dir = self.working_dir / ".nginx/"
         self.softlinked_nginx_path = Path(environment[NGINX][SOFTLINKED_DIR])
@@ -78,13 +124,56 @@ class ApplicationConfigManager:
             else Path(environment[NGINX][HTML_PATH])
         )
         self.overview_page_index = self.overview_page_path / "index.html"
+        # what the overview page has been rendered from; kept out of the served directory, as it's nobody's business
+        self.overview_page_fingerprint = self.working_dir / ".overview.sha256"
+        # how our generated nginx configs are checked and nginx is reloaded; without a proxy, nobody needs to be reloaded
+        nginx = config.get(NGINX) or {}
+        self.nginx_test_command = (
+            nginx.get(NGINX_TEST_COMMAND, "sudo nginx -t") if self.is_proxied else ""
+        )
+        self.nginx_reload_command = (
+            nginx.get(NGINX_RELOAD_COMMAND, "sudo systemctl reload nginx")
+            if self.is_proxied
+            else ""
+        )
+        self.nginx_reload_delay = float(nginx.get(NGINX_RELOAD_DELAY, 5))
+        self.nginx_routing = NginxRouting(nginx.get(NGINX_ROUTING, "locations"))
         # moodle related settings
         self.moodle_cache_dir = self.working_dir / ".moodles/"
         self.moodle_docker_dir = self.working_dir / ".moodle-docker"
+        # immutable copies of the moodle-docker checkout, shared by all test environments
+        self.moodle_docker_trees_dir = self.working_dir / ".moodle-docker-trees"
+        # torn down infrastructures and destroyed test environments are deleted from here in the background
+        self.trash_dir = self.working_dir / ".trash"
         self.moodle_docker_repo_url = config[REPO][MDL_DKR][URL]
+        # only used to list all released Moodle versions
+        self.moodle_repo_url = (config[REPO].get(MDL) or {}).get(
+            URL, "https://github.com/moodle/moodle"
+        )
+        # how many containers are started/stopped/restarted/destroyed at once
+        self.parallel_container_actions = int(
+            config.get(CONTAINERS, {}).get(PARALLEL_ACTIONS, 4)
+        )
+        # idle detection and waking of test containers, see the 'supervise' command
+        supervisor = config.get(SUPERVISOR, {})
+        self.idle_timeout_minutes = float(supervisor.get(IDLE_TIMEOUT, 60))
+        self.check_interval_seconds = float(supervisor.get(CHECK_INTERVAL, 60))
+        self.wake_port = int(supervisor.get(WAKE_PORT, 8765))
+        # the daemon owns the core, the CLI only talks to it via this socket
+        self.daemon_socket = self.working_dir / (config.get(DAEMON) or {}).get(
+            SOCKET, ".daemon.sock"
+        )
+        # where the timings of each command are appended to, relative to the working directory; None if they are not exported at all
+        tracing = config.get(TRACING) or {}
+        self.trace_file = (
+            self.working_dir / tracing[TRACE_FILE] if tracing.get(TRACE_FILE) else None
+        )
+        self.trace_format = TraceFormat(tracing.get(TRACE_FORMAT, "jsonl"))
         # boost union related settings
         self.boost_union_base_directory_name = "theme/boost_union"
         self.boost_union_repo_url = config[REPO][BU][URL]
+        # bare mirror all infrastructures are cloned from
+        self.boost_union_mirror_dir = self.working_dir / ".boost-union.git"
 
     def get_path(self, path_name: str) -> Path:
         return Path(path_name).resolve()
@@ -94,9 +183,9 @@ def config() -> ApplicationConfigManager:
     # hacky, but hides implementation detail about the singleton and allows us
     # to avoid the circular dependency issues if each import is directly
     # embedded into the services
-    from ..app import Application
+    from ..app import application
 
     # sometimes mypy is just a funny thing.
     return cast(
-        ApplicationConfigManager, Application().cross_cutting_concerns.config_manager()
+        ApplicationConfigManager, application().cross_cutting_concerns.config_manager()
     )
@@ -0,0 +1,99 @@
+import os
+import re
+import shlex
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+
+from ..exceptions import BoostUnionTestEnvValueError
+
+# $NAME or ${NAME}, as expanded by the shell when sourcing the file
+_VARIABLE_REFERENCE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+
+
+class EnvironmentFile:
+    """The variables of an environment file as used by moodle-docker, i.e. a shell script consisting of "export NAME=value" lines.
+
+    Args:
+        variables (Mapping[str, str]): the parsed variables
+    """
+
+    def __init__(self, variables: Mapping[str, str]) -> None:
+        self.variables = dict(variables)
+
+    def get(self, name: str, default: str = "") -> str:
+        # unset variables are echoed as empty string by the shell, too
+        return self.variables.get(name, default)
+
+    def get_int(self, name: str) -> int:
+        value = self.variables.get(name)
+        if value is None or not value.isdigit():
+            raise BoostUnionTestEnvValueError(
+                f"{name} is not set to a number in the environment file, but to {value!r}"
+            )
+        return int(value)
+
+
+def parse_env_file(text: str) -> dict[str, str]:
+    """Parses the content of an environment file the same way sourcing it in a shell would, as long as it only contains variable assignments. Values can be quoted and may reference variables defined earlier in the file or in our own environment.
+
+    Args:
+        text (str): the content of the environment file
+
+    Raises:
+        BoostUnionTestEnvValueError: raised if a line is not a variable assignment
+
+    Returns:
+        dict[str, str]: the defined variables and their values
+    """
+    variables: dict[str, str] = {}
+
+    def expand(match: re.Match[str]) -> str:
+        name = match.group(1) or match.group(2)
+        return variables.get(name, os.environ.get(name, ""))
+
+    for line_nr, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export ") :].lstrip()
+        name, separator, raw_value = line.partition("=")
+        if not separator or not name.isidentifier():
+            raise BoostUnionTestEnvValueError(
+                f"line {line_nr} of the environment file is not a variable assignment: {line}"
+            )
+        lexer = shlex.shlex(raw_value, posix=True)
+        # keep everything up to the next unquoted whitespace, but drop trailing comments
+        lexer.whitespace_split = True
+        lexer.commenters = "#"
+        # shlex does not tell us how a token was quoted, so single-quoted parts are expanded as well; moodle-docker's files contain none
+        value = lexer.get_token() or ""
+        variables[name] = _VARIABLE_REFERENCE.sub(expand, value)
+    return variables
+
+
+_cache: dict[Path, tuple[tuple[int, int], EnvironmentFile]] = {}
+_cache_lock = threading.Lock()
+
+
+def load_env_file(path: Path) -> EnvironmentFile:
+    """Returns the parsed variables of the given environment file. The file is only parsed again if it has been modified since it has been parsed the last time.
+
+    Args:
+        path (Path): the environment file
+
+    Returns:
+        EnvironmentFile: the parsed variables
+    """
+    stat = path.stat()
+    # the size is taken into account as well, in case the file is rewritten faster than the resolution of the mtime
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    env_file = EnvironmentFile(parse_env_file(path.read_text()))
+    with _cache_lock:
+        _cache[path] = (version, env_file)
+    return env_file
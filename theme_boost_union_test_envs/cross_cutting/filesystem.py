@@ -0,0 +1,121 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+
+WRITE_PERMISSIONS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+@contextmanager
+def file_lock(lock_file: Path) -> Iterator[None]:
+    """Holds an exclusive lock on the given lock file for the duration of the with-block.
+    The lock is advisory and based on flock, so it serializes both concurrent invocations of this application and threads inside a single invocation, as every call opens it's own file description.
+
+    Args:
+        lock_file (Path): the file that is used as lock, will be created if it does not exist
+
+    Yields:
+        Iterator[None]: nothing, the lock is held while the with-block is executed
+    """
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with lock_file.open("a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Writes the given text to a temporary file next to the given path and renames it afterwards. Readers will therefore either see the old or the new content, but never a half-written file.
+
+    Args:
+        path (Path): the file that should be written
+        text (str): the new content of said file
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        # mkstemp creates files only readable by us, keep the permissions of the replaced file or use the usual default
+        os.chmod(tmp, path.stat().st_mode if path.exists() else 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def sha256_of_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CloneStrategy(str, Enum):
+    # copy-on-write copy, only supported by some filesystems (btrfs, xfs, ...)
+    REFLINK = "reflink"
+    # hard links to the same files, only possible on the same filesystem
+    HARDLINK = "hardlink"
+    # plain copy, always possible but the slowest option
+    COPY = "copy"
+
+
+def make_read_only(directory: Path) -> None:
+    """Removes the write permissions of all files inside the given directory. Directories themselves stay writable, so the tree can still be deleted by it's owner.
+
+    Args:
+        directory (Path): the root of the tree that should be made read-only
+    """
+    for root, _, files in os.walk(directory):
+        for file in files:
+            path = Path(root) / file
+            if not path.is_symlink():
+                path.chmod(path.stat().st_mode & ~WRITE_PERMISSIONS)
+
+
+def clone_tree(
+    source: Path, destination: Path, strategies: list[CloneStrategy]
+) -> CloneStrategy:
+    """Clones the directory tree at source to destination, trying each of the given strategies in order until one succeeds.
+
+    Args:
+        source (Path): the tree that should be cloned
+        destination (Path): where the clone should be created, must not exist yet
+        strategies (list[CloneStrategy]): the strategies that should be tried, in order
+
+    Raises:
+        OSError: raised if none of the strategies succeeded; the error of the last strategy
+
+    Returns:
+        CloneStrategy: the strategy that has been used to create the clone
+    """
+    last_error: OSError = OSError(f"no clone strategy given to clone {source}")
+    for strategy in strategies:
+        try:
+            if strategy == CloneStrategy.REFLINK:
+                subprocess.run(
+                    ["cp", "-a", "--reflink=always", str(source), str(destination)],
+                    check=True,
+                    capture_output=True,
+                )
+            elif strategy == CloneStrategy.HARDLINK:
+                shutil.copytree(
+                    source, destination, symlinks=True, copy_function=os.link
+                )
+            else:
+                shutil.copytree(source, destination, symlinks=True)
+            return strategy
+        except (OSError, subprocess.CalledProcessError) as e:
+            last_error = e if isinstance(e, OSError) else OSError(e.stderr)
+            # do not leave a partial clone behind for the next strategy
+            shutil.rmtree(destination, ignore_errors=True)
+    raise last_error
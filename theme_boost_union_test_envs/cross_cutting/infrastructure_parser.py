@@ -1,4 +1,6 @@
-from collections.abc import MutableMapping
+import threading
+from collections.abc import Iterator, MutableMapping
+from contextlib import contextmanager
 from typing import Any, cast
 
 import yaml
@@ -6,11 +8,36 @@ from mergedeep import merge  # type: ignore
 from yaml.loader import SafeLoader
 
 from . import config
+from .filesystem import atomic_write_text, file_lock
+from .state_backend import StateBackend
 
 
-class InfrastructureYAMLParser:
+class InfrastructureYAMLParser(StateBackend):
+    """The original "yaml file database": every call loads the whole file and every mutation rewrites it. Still useful for small testbeds or if the file should be edited by hand."""
+
     def __init__(self) -> None:
         self.yaml = config().infra_yaml
+        self.lock_file = self.yaml.with_name(f"{self.yaml.name}.lock")
+        # kept apart, so the infrastructure file keeps it's shape; guarded by the same lock
+        self.port_leases_yaml = self.yaml.with_name("port_leases.yaml")
+        # flock is not reentrant, so nested transactions of the same thread must not lock again
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        if getattr(self._local, "depth", 0):
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        with file_lock(self.lock_file):
+            self._local.depth = 1
+            try:
+                yield
+            finally:
+                self._local.depth = 0
 
     def load_testbed_info(self) -> MutableMapping[Any, Any]:
         with open(self.yaml, "r") as f:
@@ -23,8 +50,8 @@ class InfrastructureYAMLParser:
             return saved_yaml
 
     def serialize_testbed_info(self, new_yaml: MutableMapping[Any, Any]) -> None:
-        with open(self.yaml, "w") as f:
-            yaml.dump(new_yaml, f)
+        # written atomically, so a concurrent reader never sees a half-written file
+        atomic_write_text(self.yaml, yaml.dump(new_yaml))
 
     def new_infrastructure(
         self,
@@ -32,25 +59,21 @@ class InfrastructureYAMLParser:
         git_ref: str | int,
         git_ref_type: str,
     ) -> None:
-        saved_yaml = self.load_testbed_info()
         data = {
             infrastructure_name: {
                 "git_ref": {"type": git_ref_type, "reference": git_ref},
                 "moodles": {},
             }
         }
-        new_yaml = merge(saved_yaml, data)
-        self.serialize_testbed_info(new_yaml)
+        self._merge(data)
 
     def add_moodles_to_infrastructure(
         self,
         infrastructure_name: str,
         new_moodles: dict[Any, Any],
     ) -> None:
-        saved_yaml = self.load_testbed_info()
         data = {infrastructure_name: {"moodles": new_moodles}}
-        new_yaml = merge(saved_yaml, data)
-        self.serialize_testbed_info(new_yaml)
+        self._merge(data)
 
     def change_moodle_test_container_status(
         self,
@@ -58,7 +81,6 @@ class InfrastructureYAMLParser:
         state: str,
         *versions: str,
     ) -> None:
-        saved_yaml = self.load_testbed_info()
         data = {
             infrastructure_name: {
                 "moodles": {
@@ -69,29 +91,94 @@ class InfrastructureYAMLParser:
                 }
             }
         }
-        new_yaml = merge(saved_yaml, data)
-        self.serialize_testbed_info(new_yaml)
+        self._merge(data)
 
     def remove_infrastructure(self, infrastructure_name: str) -> None:
-        saved_yaml = self.load_testbed_info()
-        saved_yaml.pop(infrastructure_name, None)
-        self.serialize_testbed_info(saved_yaml)
+        with self.transaction():
+            saved_yaml = self.load_testbed_info()
+            saved_yaml.pop(infrastructure_name, None)
+            self.serialize_testbed_info(saved_yaml)
+            self.release_ports(infrastructure_name)
 
     def remove_moodle(self, infrastructure_name: str, version: str) -> None:
-        saved_yaml = self.load_testbed_info()
-        saved_yaml[infrastructure_name]["moodles"].pop(version)
-        self.serialize_testbed_info(saved_yaml)
+        with self.transaction():
+            saved_yaml = self.load_testbed_info()
+            saved_yaml[infrastructure_name]["moodles"].pop(version)
+            self.serialize_testbed_info(saved_yaml)
+            self.release_ports(infrastructure_name, version)
+
+    def get_infrastructure(self, infrastructure_name: str) -> dict[Any, Any] | None:
+        return cast(
+            dict[Any, Any] | None, self.load_testbed_info().get(infrastructure_name)
+        )
+
+    def find_moodles_by_version(self, version: str) -> dict[str, dict[Any, Any]]:
+        return {
+            infrastructure_name: data["moodles"][version]
+            for infrastructure_name, data in self.load_testbed_info().items()
+            if version in data["moodles"]
+        }
+
+    def used_ports(self) -> set[int]:
+        with self.transaction():
+            ports = {
+                port
+                for moodles in self._load_port_leases().values()
+                for leased in moodles.values()
+                for port in leased
+            }
+            for data in self.load_testbed_info().values():
+                for moodle in data["moodles"].values():
+                    ports.update(
+                        int(moodle[key])
+                        for key in ("www_port", "db_port")
+                        if key in moodle
+                    )
+            return ports
+
+    def lease_ports(
+        self, infrastructure_name: str, version: str, ports: list[int]
+    ) -> None:
+        with self.transaction():
+            leases = self._load_port_leases()
+            leases.setdefault(infrastructure_name, {})[version] = list(ports)
+            atomic_write_text(self.port_leases_yaml, yaml.dump(leases))
+
+    def release_ports(
+        self, infrastructure_name: str, version: str | None = None
+    ) -> None:
+        with self.transaction():
+            leases = self._load_port_leases()
+            if version is None:
+                leases.pop(infrastructure_name, None)
+            else:
+                leases.get(infrastructure_name, {}).pop(version, None)
+            atomic_write_text(self.port_leases_yaml, yaml.dump(leases))
+
+    def _load_port_leases(self) -> dict[str, dict[str, list[int]]]:
+        # $infrastructure_name: {$moodle_version: [ports]}
+        if not self.port_leases_yaml.exists():
+            return {}
+        leases = yaml.load(self.port_leases_yaml.read_text(), Loader=SafeLoader)
+        return cast(dict[str, dict[str, list[int]]], leases or {})
+
+    def _merge(self, data: dict[Any, Any]) -> None:
+        # the whole read-modify-write cycle needs to be locked, else concurrent invocations lose each others updates
+        with self.transaction():
+            saved_yaml = self.load_testbed_info()
+            new_yaml = merge(saved_yaml, data)
+            self.serialize_testbed_info(new_yaml)
 
 
-def yaml_parser() -> InfrastructureYAMLParser:
+def yaml_parser() -> StateBackend:
     # hacky, but hides implementation detail about the singleton and allows us
     # to avoid the circular dependency issues if each import is directly
     # embedded into the services
-    from ..app import Application
+    from ..app import application
 
     # sometimes mypy is just a funny thing.
     parser = cast(
-        InfrastructureYAMLParser,
-        Application().cross_cutting_concerns.infrastructure_yaml_parser(),
+        StateBackend,
+        application().cross_cutting_concerns.infrastructure_yaml_parser(),
     )
     return parser
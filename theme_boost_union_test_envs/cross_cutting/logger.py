@@ -18,8 +18,8 @@ def log() -> loguru.Logger:
     # hacky, but hides implementation detail about the singleton and allows us
     # to avoid the circular dependency issues if each import is directly
     # embedded into the services
-    from ..app import Application
+    from ..app import application
 
     # sometimes mypy is just a funny thing.
-    logger = cast(ApplicationLogger, Application().cross_cutting_concerns.log())
+    logger = cast(ApplicationLogger, application().cross_cutting_concerns.log())
     return logger.log
@@ -0,0 +1,173 @@
+import shlex
+import shutil
+import subprocess
+import threading
+from enum import Enum
+from pathlib import Path
+from typing import cast
+
+from ..exceptions import NginxConfigTestFailedError
+from .filesystem import atomic_write_text, file_lock
+from .logger import log
+from .tracing import propagate_context, tracer
+
+
+class NginxRouting(str, Enum):
+    # one location file per test environment
+    LOCATIONS = "locations"
+    # one map of all test environments, rendered from our state store, and a single location looking them up
+    MAP = "map"
+
+
+class NginxConfigs:
+    """Manages the configuration files we generate for nginx. New files are first written into a staging directory; applying them moves all staged files into place at once, checks the resulting configuration and reloads nginx gracefully, i.e. without dropping open connections like a restart would.
+    If the check fails, the previous files are restored, so nginx is never reloaded with a broken configuration. Reloads are debounced: everything applied within the reload delay shares a single reload, e.g. several builds sent to the daemon one after another.
+
+    Args:
+        config_dir (Path): the directory nginx reads our configuration files from, via the softlinked path
+        test_command (str): checks the whole configuration of nginx, e.g. "sudo nginx -t"; empty to skip the check
+        reload_command (str): reloads nginx gracefully, e.g. "sudo systemctl reload nginx"; empty to never reload
+        reload_delay (float): seconds to wait for further changes before reloading; 0 to reload right away
+    """
+
+    def __init__(
+        self,
+        config_dir: Path,
+        test_command: str,
+        reload_command: str,
+        reload_delay: float,
+    ) -> None:
+        self.config_dir = config_dir
+        self.staging_dir = config_dir / ".staging"
+        self.lock_file = config_dir / ".apply.lock"
+        self.test_command = test_command
+        self.reload_command = reload_command
+        self.reload_delay = reload_delay
+        self._lock = threading.Lock()
+        self._pending_reload: threading.Timer | None = None
+
+    def stage(self, path: Path, content: str) -> None:
+        """Writes a configuration file into the staging directory, nginx does not see it until it has been applied.
+
+        Args:
+            path (Path): where the file should end up, inside the config directory
+            content (str): the content of the file
+        """
+        staged = self.staging_dir / path.relative_to(self.config_dir)
+        staged.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(staged, content)
+
+    def apply(self) -> list[Path]:
+        """Moves all staged files into place and checks the configuration of nginx with them. If the check succeeds, a reload is scheduled.
+
+        Raises:
+            NginxConfigTestFailedError: raised if nginx rejects the configuration; the applied files have been rolled back
+
+        Returns:
+            list[Path]: the files that have been applied
+        """
+        # several invocations might apply their files at the same time, the check needs to see all of them
+        with file_lock(self.lock_file), tracer().span("nginx.apply") as span:
+            staged = (
+                sorted(p for p in self.staging_dir.rglob("*") if p.is_file())
+                if self.staging_dir.exists()
+                else []
+            )
+            span.set_attribute("files", len(staged))
+            if not staged:
+                return []
+            applied: dict[Path, str | None] = {}
+            for file in staged:
+                destination = self.config_dir / file.relative_to(self.staging_dir)
+                applied[destination] = (
+                    destination.read_text() if destination.exists() else None
+                )
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                file.replace(destination)
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            try:
+                self._test()
+            except NginxConfigTestFailedError:
+                log().error("nginx rejected the new configuration, rolling it back")
+                for destination, previous in applied.items():
+                    if previous is None:
+                        destination.unlink(missing_ok=True)
+                    else:
+                        atomic_write_text(destination, previous)
+                raise
+        log().info(f"applied {len(applied)} nginx configuration file(s)")
+        self.schedule_reload()
+        return list(applied)
+
+    def schedule_reload(self) -> None:
+        """Reloads nginx once the reload delay passed without another reload being scheduled."""
+        if not self.reload_command:
+            return
+        with self._lock:
+            if self._pending_reload is not None:
+                self._pending_reload.cancel()
+            if self.reload_delay <= 0:
+                self._pending_reload = None
+            else:
+                self._pending_reload = threading.Timer(
+                    self.reload_delay, propagate_context(self._reload_pending)
+                )
+                self._pending_reload.daemon = True
+                self._pending_reload.start()
+                return
+        self._reload()
+
+    def flush(self) -> None:
+        """Reloads nginx right away if a reload is pending, e.g. before the process exits."""
+        with self._lock:
+            if self._pending_reload is None:
+                return
+            self._pending_reload.cancel()
+            self._pending_reload = None
+        self._reload()
+
+    def _reload_pending(self) -> None:
+        with self._lock:
+            if self._pending_reload is None:
+                # flushed in the meantime
+                return
+            self._pending_reload = None
+        self._reload()
+
+    def _test(self) -> None:
+        if not self.test_command:
+            return
+        with tracer().span("nginx.test"):
+            result = subprocess.run(
+                shlex.split(self.test_command),
+                capture_output=True,
+                text=True,
+            )
+        if result.returncode != 0:
+            raise NginxConfigTestFailedError(
+                self.test_command, (result.stderr or result.stdout).strip()
+            )
+
+    def _reload(self) -> None:
+        log().info("reloading nginx, our proxy server")
+        with tracer().span("nginx.reload"):
+            result = subprocess.run(
+                shlex.split(self.reload_command),
+                capture_output=True,
+                text=True,
+            )
+        if result.returncode != 0:
+            # nginx keeps running with it's previous configuration, so the next reload will pick up our changes
+            log().error(
+                f"reloading nginx failed: {(result.stderr or result.stdout).strip()}"
+            )
+
+
+def nginx_configs() -> NginxConfigs:
+    # hacky, but hides implementation detail about the singleton and allows us
+    # to avoid the circular dependency issues if each import is directly
+    # embedded into the services
+    from ..app import application
+
+    # sometimes mypy is just a funny thing.
+    return cast(NginxConfigs, application().cross_cutting_concerns.nginx_configs())
@@ -0,0 +1,84 @@
+import bisect
+import functools
+from collections.abc import Iterable, Mapping
+
+from packaging import version
+from packaging.version import Version
+
+from ..exceptions import UnsupportedMoodleVersionError
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_version(moodle_version: str) -> Version:
+    # the same few Moodle versions are resolved over and over again, e.g. once per build and once per matrix entry
+    # Comparing version strings lexicographically does not work, i.e. "3.9" would be higher than "3.11". There isn't an official specification of Moodle versions either: they mostly follow semver (X.Y.Z), but also allow release candidates (e.g. 4.3.0-rc1) or betas (e.g. 4.3.0-beta). The latter isn't allowed per python specification, but for backwards compatibility to older specifications, it's still parsed as "4.3.0b0", which compares correctly again.
+    return version.parse(moodle_version)
+
+
+class PhpImageTags:
+    """Resolves the tag of the moodle-php-apache image a Moodle version runs on, i.e. the newest PHP version it supports, so we probably run into no issues with it.
+    The mapping from the configuration only lists breakpoints, i.e. Moodle versions where the supported PHP versions change. They are sorted once, so a Moodle version is resolved by a binary search for the newest breakpoint it has reached, regardless of the order they are listed in.
+
+    Args:
+        moodle_versions_to_php_versions (Mapping[Version, list[Version]]): the breakpoints, mapped to the oldest and newest supported PHP version
+    """
+
+    def __init__(
+        self, moodle_versions_to_php_versions: Mapping[Version, list[Version]]
+    ) -> None:
+        self.breakpoints = sorted(moodle_versions_to_php_versions)
+        self.image_tags = [
+            str(moodle_versions_to_php_versions[breakpoint][1])
+            for breakpoint in self.breakpoints
+        ]
+        newest = self.breakpoints[-1]
+        # Moodle versions newer than everything we know have not been released when the mapping was written, they run on the "dev" image
+        self.newest_release = (newest.major, newest.minor)
+
+    def resolve(self, moodle_version: str) -> str:
+        """Resolves the image tag for a single Moodle version.
+
+        Args:
+            moodle_version (str): the Moodle version, e.g. "4.3.1" or "4.3.0-beta"
+
+        Raises:
+            UnsupportedMoodleVersionError: raised if the Moodle version is older than all breakpoints
+
+        Returns:
+            str: the image tag, "dev" for Moodle versions newer than the newest breakpoint
+        """
+        image_tag = self._resolve(parse_version(moodle_version))
+        if image_tag is None:
+            raise UnsupportedMoodleVersionError(moodle_version)
+        return image_tag
+
+    def resolve_many(self, moodle_versions: Iterable[str]) -> dict[str, str | None]:
+        """Resolves the image tags for many Moodle versions in a single pass: the versions are sorted, so the breakpoint of each version is found by moving on from the breakpoint of the previous one.
+
+        Args:
+            moodle_versions (Iterable[str]): the Moodle versions
+
+        Returns:
+            dict[str, str | None]: the given Moodle versions, sorted, mapped to their image tag; None if they are unsupported
+        """
+        resolved: dict[str, str | None] = {}
+        index = 0
+        for parsed, moodle_version in sorted(
+            (parse_version(v), v) for v in dict.fromkeys(moodle_versions)
+        ):
+            while index < len(self.breakpoints) and self.breakpoints[index] <= parsed:
+                index += 1
+            resolved[moodle_version] = self._image_tag(parsed, index)
+        return resolved
+
+    def _resolve(self, parsed: Version) -> str | None:
+        return self._image_tag(parsed, bisect.bisect_right(self.breakpoints, parsed))
+
+    def _image_tag(self, parsed: Version, reached: int) -> str | None:
+        # reached: how many breakpoints are older than or equal to the version
+        if (parsed.major, parsed.minor) > self.newest_release:
+            return "dev"
+        if reached == 0:
+            # so old, we really do not support it anymore
+            return None
+        return self.image_tags[reached - 1]
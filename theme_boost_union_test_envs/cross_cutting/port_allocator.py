@@ -0,0 +1,75 @@
+import socket
+from contextlib import closing
+from typing import cast
+
+from ..exceptions import PortRangeExhaustedError
+from . import log
+from .state_backend import StateBackend
+
+
+class PortAllocator:
+    """Hands out the ports of new Moodle test environments from the configured port range. Every allocation is leased to it's environment in our "database" right away, so parallel builds and concurrent invocations never receive the same port, even before the environment itself is persisted.
+
+    Args:
+        state (StateBackend): our "database", which persists the leases
+        first_port (int): the first port of the range
+        last_port (int): the last port of the range, inclusive
+    """
+
+    def __init__(self, state: StateBackend, first_port: int, last_port: int) -> None:
+        self.state = state
+        self.first_port = first_port
+        self.last_port = last_port
+
+    def allocate(
+        self, infrastructure_name: str, version: str, count: int = 2
+    ) -> list[int]:
+        """Allocates free ports and leases them to the given Moodle test environment, replacing the ports leased to it before, e.g. by a failed build.
+
+        Args:
+            infrastructure_name (str): the infrastructure of the environment
+            version (str): the Moodle version of the environment
+            count (int, optional): how many ports are needed. Defaults to 2, one for the webserver and one for the database.
+
+        Raises:
+            PortRangeExhaustedError: raised if not enough free ports are left in the configured range
+
+        Returns:
+            list[int]: the allocated ports, in ascending order
+        """
+        with self.state.transaction():
+            # a single lookup for all allocations of this call, afterwards each check is a set lookup
+            used_ports = self.state.used_ports()
+            ports: list[int] = []
+            for port in range(self.first_port, self.last_port + 1):
+                # ports used by processes outside of our testbed are skipped as well
+                if port in used_ports or not _is_bindable(port):
+                    continue
+                ports.append(port)
+                if len(ports) == count:
+                    self.state.lease_ports(infrastructure_name, version, ports)
+                    log().debug(
+                        f"leased ports {ports} to {infrastructure_name}/{version}"
+                    )
+                    return ports
+        raise PortRangeExhaustedError(self.first_port, self.last_port)
+
+
+def _is_bindable(port: int) -> bool:
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("", port))
+        except OSError:
+            return False
+        return True
+
+
+def port_allocator() -> PortAllocator:
+    # hacky, but hides implementation detail about the singleton and allows us
+    # to avoid the circular dependency issues if each import is directly
+    # embedded into the services
+    from ..app import application
+
+    # sometimes mypy is just a funny thing.
+    return cast(PortAllocator, application().cross_cutting_concerns.port_allocator())
@@ -0,0 +1,309 @@
+import sqlite3
+import threading
+from collections.abc import Iterator, MutableMapping
+from contextlib import AbstractContextManager, closing, contextmanager
+from pathlib import Path
+from typing import Any
+
+from ..exceptions import BoostUnionTestEnvValueError, InfrastructureDoesNotExistYetError
+from .state_backend import StateBackend
+
+# bump this and add a migration to _migrate() when changing the schema
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS infrastructures (
+    name TEXT PRIMARY KEY,
+    git_ref_type TEXT NOT NULL,
+    -- untyped on purpose: pull requests are referenced by number, everything else by name
+    git_ref NOT NULL
+);
+CREATE TABLE IF NOT EXISTS moodles (
+    infrastructure TEXT NOT NULL REFERENCES infrastructures(name) ON DELETE CASCADE,
+    version TEXT NOT NULL,
+    status TEXT,
+    url TEXT,
+    admin_pw TEXT,
+    www_port INTEGER,
+    db_port INTEGER,
+    PRIMARY KEY (infrastructure, version)
+);
+CREATE INDEX IF NOT EXISTS moodles_by_version ON moodles(version);
+CREATE INDEX IF NOT EXISTS moodles_by_www_port ON moodles(www_port);
+CREATE INDEX IF NOT EXISTS moodles_by_db_port ON moodles(db_port);
+"""
+
+_SCHEMA_PORT_LEASES = """
+CREATE TABLE IF NOT EXISTS port_leases (
+    port INTEGER PRIMARY KEY,
+    -- not referencing moodles, as ports are leased before the environment is persisted at the end of the build
+    infrastructure TEXT NOT NULL REFERENCES infrastructures(name) ON DELETE CASCADE,
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS port_leases_by_moodle ON port_leases(infrastructure, version);
+"""
+
+_MOODLE_COLUMNS = ("status", "url", "admin_pw", "www_port", "db_port")
+
+
+class SQLiteStateBackend(StateBackend):
+    """Persists our infrastructures in a SQLite database. In contrast to the yaml file, lookups are indexed and every mutation is a single transaction, which also serializes concurrent invocations of this application.
+
+    The database is only opened by the first access to the state, as it lives inside the working directory, which does not exist before the testbed has been initialized.
+
+    Args:
+        database (Path): the SQLite database file, will be created if it does not exist
+        legacy_yaml (Path | None, optional): the yaml file database of earlier versions, which is imported once when the database is created. Defaults to None.
+    """
+
+    def __init__(self, database: Path, legacy_yaml: Path | None = None) -> None:
+        self.database = database
+        self.legacy_yaml = legacy_yaml
+        # every thread gets it's own connection for the duration of a transaction
+        self._local = threading.local()
+        # reentrant, as importing the legacy yaml file accesses the state itself
+        self._prepare_lock = threading.RLock()
+        self._preparing = False
+        self._prepared = False
+
+    def transaction(self) -> AbstractContextManager[sqlite3.Connection]:
+        self._prepare()
+        return self._transaction()
+
+    def _prepare(self) -> None:
+        """Creates or migrates the database on the first access to the state, and imports the yaml file database of earlier versions into a new database."""
+        if self._prepared:
+            return
+        with self._prepare_lock:
+            if self._prepared or self._preparing:
+                return
+            self._preparing = True
+            try:
+                is_new = not self.database.exists()
+                self._migrate()
+                if (
+                    is_new
+                    and self.legacy_yaml is not None
+                    and self.legacy_yaml.exists()
+                ):
+                    self.import_yaml(self.legacy_yaml)
+                self._prepared = True
+            finally:
+                self._preparing = False
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is not None:
+            # nested transaction, the outermost one commits
+            yield conn
+            return
+        conn = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        self._local.conn = conn
+        try:
+            # taking the write lock right away prevents two invocations from reading the same state and both acting upon it
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            self._local.conn = None
+            conn.close()
+
+    def load_testbed_info(self) -> MutableMapping[Any, Any]:
+        with self.transaction() as conn:
+            testbed: dict[Any, Any] = {
+                row["name"]: {
+                    "git_ref": {
+                        "type": row["git_ref_type"],
+                        "reference": row["git_ref"],
+                    },
+                    "moodles": {},
+                }
+                for row in conn.execute("SELECT * FROM infrastructures ORDER BY name")
+            }
+            for row in conn.execute(
+                "SELECT * FROM moodles ORDER BY infrastructure, version"
+            ):
+                testbed[row["infrastructure"]]["moodles"][
+                    row["version"]
+                ] = _moodle_from_row(row)
+            return testbed
+
+    def serialize_testbed_info(self, new_yaml: MutableMapping[Any, Any]) -> None:
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM infrastructures")
+            for infrastructure_name, data in new_yaml.items():
+                git_ref = data.get("git_ref", {})
+                self.new_infrastructure(
+                    infrastructure_name, git_ref["reference"], git_ref["type"]
+                )
+                self.add_moodles_to_infrastructure(
+                    infrastructure_name, data.get("moodles") or {}
+                )
+
+    def new_infrastructure(
+        self,
+        infrastructure_name: str,
+        git_ref: str | int,
+        git_ref_type: str,
+    ) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                """INSERT INTO infrastructures (name, git_ref_type, git_ref) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET git_ref_type = excluded.git_ref_type, git_ref = excluded.git_ref""",
+                (infrastructure_name, git_ref_type, git_ref),
+            )
+
+    def add_moodles_to_infrastructure(
+        self,
+        infrastructure_name: str,
+        new_moodles: dict[Any, Any],
+    ) -> None:
+        with self.transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM infrastructures WHERE name = ?", (infrastructure_name,)
+            ).fetchone()
+            if not exists:
+                raise InfrastructureDoesNotExistYetError(infrastructure_name)
+            for version, moodle in new_moodles.items():
+                unknown = set(moodle) - set(_MOODLE_COLUMNS)
+                if unknown:
+                    raise BoostUnionTestEnvValueError(
+                        f"unknown attributes for moodle {version}: {unknown}"
+                    )
+                columns = list(moodle)
+                # only the given columns are updated for existing environments, same as merging into the yaml file
+                updates = ", ".join(f"{c} = excluded.{c}" for c in columns)
+                conn.execute(
+                    f"""INSERT INTO moodles (infrastructure, version{''.join(', ' + c for c in columns)})
+                    VALUES (?, ?{', ?' * len(columns)})
+                    ON CONFLICT (infrastructure, version) DO {'UPDATE SET ' + updates if columns else 'NOTHING'}""",
+                    (infrastructure_name, str(version), *moodle.values()),
+                )
+
+    def change_moodle_test_container_status(
+        self,
+        infrastructure_name: str,
+        state: str,
+        *versions: str,
+    ) -> None:
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE moodles SET status = ? WHERE infrastructure = ? AND version = ?",
+                [(state, infrastructure_name, ver) for ver in versions],
+            )
+
+    def remove_infrastructure(self, infrastructure_name: str) -> None:
+        with self.transaction() as conn:
+            # the moodles of this infrastructure and their port leases are removed via ON DELETE CASCADE
+            conn.execute(
+                "DELETE FROM infrastructures WHERE name = ?", (infrastructure_name,)
+            )
+
+    def remove_moodle(self, infrastructure_name: str, version: str) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM moodles WHERE infrastructure = ? AND version = ?",
+                (infrastructure_name, version),
+            )
+            self.release_ports(infrastructure_name, version)
+
+    def get_infrastructure(self, infrastructure_name: str) -> dict[Any, Any] | None:
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM infrastructures WHERE name = ?", (infrastructure_name,)
+            ).fetchone()
+            if row is None:
+                return None
+            moodles = conn.execute(
+                "SELECT * FROM moodles WHERE infrastructure = ? ORDER BY version",
+                (infrastructure_name,),
+            )
+            return {
+                "git_ref": {"type": row["git_ref_type"], "reference": row["git_ref"]},
+                "moodles": {m["version"]: _moodle_from_row(m) for m in moodles},
+            }
+
+    def find_moodles_by_version(self, version: str) -> dict[str, dict[Any, Any]]:
+        with self.transaction() as conn:
+            return {
+                row["infrastructure"]: _moodle_from_row(row)
+                for row in conn.execute(
+                    "SELECT * FROM moodles WHERE version = ? ORDER BY infrastructure",
+                    (version,),
+                )
+            }
+
+    def used_ports(self) -> set[int]:
+        with self.transaction() as conn:
+            return {
+                int(port)
+                for (port,) in conn.execute(
+                    """SELECT port FROM port_leases
+                    UNION SELECT www_port FROM moodles WHERE www_port IS NOT NULL
+                    UNION SELECT db_port FROM moodles WHERE db_port IS NOT NULL"""
+                )
+            }
+
+    def lease_ports(
+        self, infrastructure_name: str, version: str, ports: list[int]
+    ) -> None:
+        with self.transaction() as conn:
+            self.release_ports(infrastructure_name, version)
+            try:
+                conn.executemany(
+                    "INSERT INTO port_leases (port, infrastructure, version) VALUES (?, ?, ?)",
+                    [(port, infrastructure_name, version) for port in ports],
+                )
+            except sqlite3.IntegrityError as e:
+                # either a port is leased already or the infrastructure does not exist
+                raise BoostUnionTestEnvValueError(
+                    f"cannot lease ports {ports} to {infrastructure_name}/{version}: {e}"
+                ) from e
+
+    def release_ports(
+        self, infrastructure_name: str, version: str | None = None
+    ) -> None:
+        with self.transaction() as conn:
+            if version is None:
+                conn.execute(
+                    "DELETE FROM port_leases WHERE infrastructure = ?",
+                    (infrastructure_name,),
+                )
+            else:
+                conn.execute(
+                    "DELETE FROM port_leases WHERE infrastructure = ? AND version = ?",
+                    (infrastructure_name, version),
+                )
+
+    def _migrate(self) -> None:
+        # WAL allows readers to proceed while another invocation is writing; it cannot be enabled inside a transaction
+        with closing(sqlite3.connect(self.database, timeout=30)) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+        with self._transaction() as conn:
+            (version,) = conn.execute("PRAGMA user_version").fetchone()
+            if version < 1:
+                _execute_script(conn, _SCHEMA)
+            if version < 2:
+                _execute_script(conn, _SCHEMA_PORT_LEASES)
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+
+def _execute_script(conn: sqlite3.Connection, script: str) -> None:
+    # executescript() would commit our transaction
+    for statement in script.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _moodle_from_row(row: sqlite3.Row) -> dict[str, Any]:
+    # unset columns are left out, just like missing keys in the yaml file
+    return {
+        column: row[column] for column in _MOODLE_COLUMNS if row[column] is not None
+    }
@@ -0,0 +1,127 @@
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import Any
+
+import yaml
+from yaml.loader import SafeLoader
+
+from ..exceptions import BoostUnionTestEnvValueError
+from .filesystem import atomic_write_text
+
+
+class StateBackend(ABC):
+    """The interface of our "database", which persists all infrastructures and their Moodle test environments.
+    The data is always exchanged in the shape of our original yaml file:
+        $infrastructure_name:
+            git_ref: {type: ..., reference: ...}
+            moodles:
+                $moodle_version: {status: ..., url: ..., admin_pw: ..., www_port: ..., db_port: ...}
+    """
+
+    @abstractmethod
+    def transaction(self) -> AbstractContextManager[Any]:
+        """Returns a context manager, inside of which all calls to this backend are executed atomically and isolated from concurrent invocations of this application. Transactions can be nested, the outermost one wins."""
+
+    @abstractmethod
+    def load_testbed_info(self) -> MutableMapping[Any, Any]:
+        """Returns all infrastructures with their Moodle test environments."""
+
+    @abstractmethod
+    def serialize_testbed_info(self, new_yaml: MutableMapping[Any, Any]) -> None:
+        """Replaces all persisted infrastructures with the given ones."""
+
+    @abstractmethod
+    def new_infrastructure(
+        self,
+        infrastructure_name: str,
+        git_ref: str | int,
+        git_ref_type: str,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def add_moodles_to_infrastructure(
+        self,
+        infrastructure_name: str,
+        new_moodles: dict[Any, Any],
+    ) -> None:
+        """Adds the given Moodle test environments to the infrastructure; already persisted environments are updated with the given values."""
+
+    @abstractmethod
+    def change_moodle_test_container_status(
+        self,
+        infrastructure_name: str,
+        state: str,
+        *versions: str,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def remove_infrastructure(self, infrastructure_name: str) -> None:
+        pass
+
+    @abstractmethod
+    def remove_moodle(self, infrastructure_name: str, version: str) -> None:
+        pass
+
+    @abstractmethod
+    def get_infrastructure(self, infrastructure_name: str) -> dict[Any, Any] | None:
+        pass
+
+    @abstractmethod
+    def find_moodles_by_version(self, version: str) -> dict[str, dict[Any, Any]]:
+        """Returns all Moodle test environments of the given version, mapped by the name of their infrastructure."""
+
+    @abstractmethod
+    def used_ports(self) -> set[int]:
+        """Returns all ports that are either leased or used by a persisted Moodle test environment."""
+
+    @abstractmethod
+    def lease_ports(
+        self, infrastructure_name: str, version: str, ports: list[int]
+    ) -> None:
+        """Leases the given ports to the Moodle test environment, replacing it's previous leases. The leases are released together with the environment or it's infrastructure."""
+
+    @abstractmethod
+    def release_ports(
+        self, infrastructure_name: str, version: str | None = None
+    ) -> None:
+        """Releases the ports leased to the given Moodle test environment, or to all environments of the infrastructure if no version is given."""
+
+    def export_yaml(self, path: Path) -> None:
+        atomic_write_text(path, yaml.dump(dict(self.load_testbed_info())))
+
+    def import_yaml(self, path: Path) -> None:
+        imported = yaml.load(path.read_text(), Loader=SafeLoader)
+        self.serialize_testbed_info(imported or {})
+
+
+def create_state_backend(
+    backend: str, database: Path, yaml_database: Path
+) -> StateBackend:
+    """Creates the state backend selected in the environment config.
+
+    Args:
+        backend (str): name of the selected backend, either "sqlite" or "yaml"
+        database (Path): the SQLite database file, only used by the "sqlite" backend
+        yaml_database (Path): the yaml file database, imported by the "sqlite" backend when it's database is created
+
+    Raises:
+        BoostUnionTestEnvValueError: raised if an unknown backend has been selected
+
+    Returns:
+        StateBackend: the selected backend
+    """
+    # imported here as both backends depend on this module
+    from .infrastructure_parser import InfrastructureYAMLParser
+    from .sqlite_state_backend import SQLiteStateBackend
+
+    if backend == "yaml":
+        return InfrastructureYAMLParser()
+    if backend == "sqlite":
+        return SQLiteStateBackend(database, legacy_yaml=yaml_database)
+    raise BoostUnionTestEnvValueError(
+        f"unknown state backend {backend}, please choose either sqlite or yaml"
+    )
@@ -1,16 +1,32 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
 import secrets
-import socket
 import string
-from contextlib import closing
 from pathlib import Path
 from string import Template
-from typing import Any, cast
+from typing import TYPE_CHECKING, Any, Mapping, cast
+
+from ..exceptions import BoostUnionTestEnvValueError, UnsupportedMoodleVersionError
+from . import config, log
+from .env_file import load_env_file
+from .filesystem import atomic_write_text
+from .nginx import NginxRouting, nginx_configs
+from .port_allocator import port_allocator
+
+if TYPE_CHECKING:
+    import jinja2
+
 
-import jinja2
-from packaging import version
+@functools.lru_cache(maxsize=None)
+def _jinja_environment(template_path: Path) -> jinja2.Environment:
+    # jinja2 takes a while to import, so it's only imported once the first template gets rendered
+    import jinja2
 
-from ..exceptions import UnsupportedMoodleVersionError
-from . import config, log, yaml_parser
+    # the environment caches compiled templates and only recompiles them if they changed on disk
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(template_path))
 
 
 class TemplateEngine:
@@ -22,12 +38,38 @@ class TemplateEngine:
         self.template_files = [file for file in files_in_cwd if file.is_file()]
 
     def test_environment_overview_html(self, infrastructures: dict[str, Any]) -> None:
-        index_html = self.template_path / "index.html.j2"
-        with index_html.open("r") as f:
-            template = jinja2.Template(f.read())
-        rendered_text = template.render(infrastructures)
-        if config().overview_page_index.parent.exists():
-            config().overview_page_index.write_text(rendered_text)
+        """Renders the static webpage displaying all available test environments. Rendering is skipped if neither the given infrastructures nor the template changed since the page has been rendered the last time.
+
+        Args:
+            infrastructures (dict[str, Any]): the variables for the template, i.e. all infrastructures from our "database"
+        """
+        index_page = config().overview_page_index
+        if not index_page.parent.exists():
+            return
+        template_name = "index.html.j2"
+        fingerprint_file = config().overview_page_fingerprint
+        fingerprint = hashlib.sha256(
+            json.dumps(
+                {
+                    "template": (self.template_path / template_name).stat().st_mtime_ns,
+                    "variables": infrastructures,
+                },
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+        if (
+            index_page.exists()
+            and fingerprint_file.exists()
+            and fingerprint_file.read_text() == fingerprint
+        ):
+            return
+        template = _jinja_environment(self.template_path).get_template(template_name)
+        # nginx serves this page, so it must never see a half-written file
+        atomic_write_text(index_page, template.render(infrastructures))
+        atomic_write_text(fingerprint_file, fingerprint)
+        # earlier versions kept the fingerprint next to the page, where nginx served it as well
+        index_page.with_name(f".{index_page.name}.sha256").unlink(missing_ok=True)
 
     def docker_customisation(
         self, template_path: Path, boost_union_source_dir: Path
@@ -48,13 +90,16 @@ class TemplateEngine:
             infrastructure_name, moodle_version
         )
         web_host = self._create_web_url(infrastructure_name, moodle_version)
+        www_port, db_port = port_allocator().allocate(
+            infrastructure_name, moodle_version
+        )
         substitutes = {
             "REPLACE_COMPOSE_NAME": compose_safe_name,
             "REPLACE_MOODLE_SOURCE_PATH": f"{template_path / 'moodle'}",
             "REPLACE_PASSWORD": self._create_new_admin_pw(),
             "REPLACE_MOODLE_WEB_HOST": web_host,
-            "REPLACE_MOODLE_WEB_PORT": self._find_free_port(),
-            "REPLACE_MOODLE_DB_PORT": self._find_free_port(),
+            "REPLACE_MOODLE_WEB_PORT": www_port,
+            "REPLACE_MOODLE_DB_PORT": db_port,
             "REPLACE_MOODLE_DOCKER_PHP_VERSION": self._select_fitting_docker_image_tag(
                 moodle_version
             ),
@@ -76,12 +121,15 @@ class TemplateEngine:
         template = Template(nginx_conf_template.read_text())
         # using safe_substitute here instead as the nginx config contains variables starting with "$", which would make the default substitute call throw an KeyError as we are not replacing the template placeholder which we do not want
         replaced_strings = template.safe_substitute(substitutes)
-        new_config = self.create_overview_nginx_conf_path()
-        new_config.write_text(replaced_strings)
+        # nginx only sees the new config once it has been applied
+        nginx_configs().stage(self.create_overview_nginx_conf_path(), replaced_strings)
 
     def moodle_nginx_config(
         self, infrastructure_name: str, moodle_version: str, port: str
     ) -> None:
+        if config().nginx_routing == NginxRouting.MAP:
+            # the environment is routed by the map, which is rendered once the new environment has been persisted
+            return
         nginx_conf_template = self.template_path / "moodle_nginx.conf"
         # get only "path" from the fqdn, we don't need the domain name, called
         # location in nginx
@@ -90,17 +138,93 @@ class TemplateEngine:
             config().base_url
             + "/"
         )[2]
+        access_log = self.create_moodle_access_log_path(
+            infrastructure_name, moodle_version
+        )
+        access_log.parent.mkdir(exist_ok=True)
         substitutes = {
             "REPLACE_LOCATION": location,
             "REPLACE_PORT": port,
+            # nginx sees our nginx directory only via the softlinked path
+            "REPLACE_ACCESS_LOG": config().softlinked_nginx_path
+            / access_log.relative_to(config().nginx_dir),
+            "REPLACE_WAKE_NAME": self._create_compose_safe_name(
+                infrastructure_name, moodle_version
+            ),
+            "REPLACE_ENVIRONMENT": f"{infrastructure_name}/{moodle_version}",
+            "REPLACE_WAKE_PORT": config().wake_port,
         }
         template = Template(nginx_conf_template.read_text())
         # using safe_substitute here instead as the nginx config contains variables starting with "$", which would make the default substitute call throw an KeyError as we are not replacing the template placeholder which we do not want
         replaced_strings = template.safe_substitute(substitutes)
-        new_config = self.create_moodle_nginx_conf_path(
-            infrastructure_name, moodle_version
+        # the configs of all environments built together are applied at once, see BoostUnionTestEnvCore.build_infrastructure
+        nginx_configs().stage(
+            self.create_moodle_nginx_conf_path(infrastructure_name, moodle_version),
+            replaced_strings,
         )
-        new_config.write_text(replaced_strings)
+
+    def moodle_nginx_map(self, infrastructures: Mapping[str, Any]) -> bool:
+        """Renders the map routing requests to all test environments and the single location using it, if the environments are routed by a map. As the map is rendered from our state store instead of being changed per environment, environments which are gone can never be left behind in it.
+        Both files are only staged if they changed; they still need to be applied.
+
+        Args:
+            infrastructures (Mapping[str, Any]): all infrastructures from our "database"
+
+        Returns:
+            bool: whether anything has been staged
+        """
+        if (
+            config().nginx_routing != NginxRouting.MAP
+            or not config().nginx_dir.exists()
+        ):
+            return False
+        environments = []
+        for infrastructure_name, infrastructure in sorted(infrastructures.items()):
+            for moodle_version, moodle in sorted(
+                (infrastructure.get("moodles") or {}).items()
+            ):
+                port = self._environment_port(
+                    infrastructure_name, moodle_version, moodle
+                )
+                if port is None:
+                    # nginx would reject the whole map because of a single environment
+                    log().warning(
+                        f"leaving {infrastructure_name}/{moodle_version} out of the nginx map, as it's port is unknown"
+                    )
+                    continue
+                environments.append(
+                    {
+                        "name": f"{infrastructure_name}/{moodle_version}",
+                        "port": port,
+                        # nginx sees our nginx directory only via the softlinked path
+                        "access_log": config().softlinked_nginx_path
+                        / self.create_moodle_access_log_path(
+                            infrastructure_name, moodle_version
+                        ).relative_to(config().nginx_dir),
+                    }
+                )
+        template = _jinja_environment(self.template_path).get_template(
+            "moodle_nginx.map.j2"
+        )
+        routing_template = Template(
+            (self.template_path / "moodle_nginx_map_routing.conf").read_text()
+        )
+        files = {
+            self.create_moodle_nginx_map_path(): template.render(
+                environments=environments
+            ),
+            # using safe_substitute here instead as the nginx config contains variables starting with "$", which would make the default substitute call throw an KeyError as we are not replacing the template placeholder which we do not want
+            self.create_moodle_nginx_map_routing_conf_path(): routing_template.safe_substitute(
+                {"REPLACE_WAKE_PORT": config().wake_port}
+            ),
+        }
+        staged = False
+        for path, content in files.items():
+            # every unchanged map would cost a check and a reload of nginx for nothing
+            if not path.exists() or path.read_text() != content:
+                nginx_configs().stage(path, content)
+                staged = True
+        return staged
 
     def _create_web_url(
         self,
@@ -129,6 +253,23 @@ class TemplateEngine:
             self._create_file_name(infrastructure_name, moodle_version)
         )
 
+    def create_moodle_nginx_map_path(self) -> Path:
+        # not a ".conf" file, as it must not be included in the server context like our other configs
+        return config().nginx_dir / "maps" / "testenvs.map"
+
+    def create_moodle_nginx_map_routing_conf_path(self) -> Path:
+        # file names of the environments always contain a dash, so this never clashes with one of them
+        return self.get_testenvs_base_dir() / self._create_nginx_conf_name("routing")
+
+    def create_moodle_access_log_path(
+        self, infrastructure_name: str, moodle_version: str
+    ) -> Path:
+        return (
+            config().nginx_dir
+            / "logs"
+            / f"{self._create_file_name(infrastructure_name, moodle_version)}.access.log"
+        )
+
     def _create_file_name(self, infrastructure_name: str, moodle_version: str) -> str:
         return f"{infrastructure_name}-{moodle_version}"
 
@@ -138,6 +279,26 @@ class TemplateEngine:
         compose_safe_version = self._create_compose_safe_version_string(moodle_version)
         return self._create_file_name(infrastructure_name, compose_safe_version)
 
+    def _environment_port(
+        self, infrastructure_name: str, moodle_version: str, moodle: Mapping[str, Any]
+    ) -> int | None:
+        if moodle.get("www_port") is not None:
+            return int(moodle["www_port"])
+        # environments built before their ports have been kept in the state only know them from their environment file
+        env_file = (
+            config().working_dir
+            / infrastructure_name
+            / "moodles"
+            / moodle_version
+            / ".env"
+        )
+        if not env_file.exists():
+            return None
+        try:
+            return load_env_file(env_file).get_int("MOODLE_DOCKER_WEB_PORT")
+        except BoostUnionTestEnvValueError:
+            return None
+
     def _create_compose_safe_version_string(self, version: str) -> str:
         # Because docker compose does not allow dots in it's project name, we are replacing these by underscores
         # https://docs.docker.com/compose/environment-variables/envvars/
@@ -147,48 +308,9 @@ class TemplateEngine:
         alphabet = string.ascii_letters + string.digits
         return "".join(secrets.choice(alphabet) for i in range(32))
 
-    def _find_free_port(self) -> Any:
-        infrastructures = yaml_parser().load_testbed_info()
-        used_ports = []
-        for _, data in infrastructures.items():
-            for _, access_info in data["moodles"].items():
-                used_ports.append(access_info["www_port"])
-                used_ports.append(access_info["db_port"])
-        while True:
-            with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
-                s.bind(("", 0))
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                new_port = s.getsockname()[1]
-                if new_port not in used_ports:
-                    return new_port
-
     def _select_fitting_docker_image_tag(self, moodle_version: str) -> str:
-        supported_versions = config().moodle_versions_to_php_versions
-        # if given moodle version is outside of defined moodle-to-php dictionary, default to container image tag "dev", if and only if the major or minor version is higher.
-        # using max(dict) here instead of just selecting the first element of the map. ensures we will not have an error just because somebody *wink* in the future updating our map does not respect the carefully chosen insertion order
-        # empty string as little, dirty sentinel value
-        image_tag = ""
-        if (version.parse(moodle_version).major > max(supported_versions).major) or (
-            version.parse(moodle_version).major == max(supported_versions).major
-            and version.parse(moodle_version).minor > max(supported_versions).minor
-        ):
-            image_tag = "dev"
-        else:
-            for ver in supported_versions:
-                # For the given moodle_version, we want to ideally select the newest supported php version - to ensure that we have probably no issues.
-                # To do so, we iterate through our map and check if given moodle_version can be fitted to a available version.
-                # As the map contains only breakpoints, i.e. Moodle versions where the supported PHP versions change, we need to iterate through the map and check if the given moodle_ver is higher than the currently selected key we are iterating over.
-                # If true; take the 2nd element of it's persisted value (a tuple), which denotes the newest suppported php version
-                # else: go to next iteration, selecting the next persisted moodle version string and try again
-                # Using version.parse here to compare the versions, because lexigraphically comparing versions does not really work well, i.e. 3.9 would be "higher" (>) than 3.11. because it would compare the 9 to the first digit of eleven, i.e. 1.
-                # Handrolling a parsing for this isn't trivial, and there isn't a official Moodle specification for how they structure Moodle versions, apparently. We could just explode the version string into tuples and compare then, or we try more reliable solutions. It mostly follows semver (X.Y.Z), but it isn't clarified it does so. It also allows release candidates (e.g. 4.3.0-rc1) or beta (e.g. 4.3.0-beta) versions. Relying on python's version.parse works from a few pre-tests. "4.3.0-beta" isn't allowed per python specification, but for backwards compatibility to older specifications, it still is transformed into "4.3.0b0"; for which the comparison work again.
-                if version.parse(moodle_version) > ver:
-                    image_tag = str(supported_versions[ver][1])
-                    log().info(f"selecting php version {image_tag} for this container")
-                    break
-            # at this point, the given moodle_version is so old, we really do not support it anymore. raise exception and scold user for molesting ancient moodle versions.
-        if not image_tag:
-            raise UnsupportedMoodleVersionError(moodle_version)
+        image_tag = config().php_image_tags.resolve(moodle_version)
+        log().info(f"selecting php version {image_tag} for this container")
         return image_tag
 
 
@@ -196,10 +318,10 @@ def template_engine() -> TemplateEngine:
     # hacky, but hides implementation detail about the singleton and allows us
     # to avoid the circular dependency issues if each import is directly
     # embedded into the services
-    from ..app import Application
+    from ..app import application
 
     # sometimes mypy is just a funny thing.
     engine = cast(
-        TemplateEngine, Application().cross_cutting_concerns.template_engine()
+        TemplateEngine, application().cross_cutting_concerns.template_engine()
     )
     return engine
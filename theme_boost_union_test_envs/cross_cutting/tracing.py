@@ -0,0 +1,311 @@
+import contextvars
+import functools
+import inspect
+import json
+import secrets
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, TypeVar, cast
+
+AttributeValue = str | int | float | bool
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+class TraceFormat(str, Enum):
+    # one span per line
+    JSONL = "jsonl"
+    # one OpenTelemetry ExportTraceServiceRequest per line, as written by the file exporter of the OpenTelemetry collector
+    OTLP = "otlp"
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    # nanoseconds since the epoch
+    start_ns: int
+    end_ns: int = 0
+    attributes: dict[str, AttributeValue] = field(default_factory=dict)
+    # "ok", or the name of the exception that ended the span
+    status: str = "ok"
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+
+@dataclass
+class SpanSummary:
+    name: str
+    count: int = 0
+    # seconds
+    total: float = 0.0
+    max: float = 0.0
+    failed: int = 0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+# the span the code currently runs in; worker threads only know it if they run inside a propagated context
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Tracer:
+    """Records how long the phases of a command take as nested spans, e.g. downloading, unpacking and installing a Moodle version during a build.
+    As long as the tracer is disabled, spans are neither recorded nor linked to each other, so tracing costs next to nothing.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: AttributeValue) -> Iterator[Span]:
+        """Records the time the with-block takes as a span, which is a child of the span the with-block is nested in.
+
+        Args:
+            name (str): name of the span, e.g. "container.start"
+            **attributes (AttributeValue): attributes of the span, e.g. the Moodle version
+
+        Yields:
+            Iterator[Span]: the span, to which further attributes can be added inside the with-block
+        """
+        parent = _current_span.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent else None,
+            start_ns=time.time_ns(),
+            attributes=dict(attributes),
+        )
+        if not self.enabled:
+            yield span
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = type(e).__name__
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def current_span(self) -> Span | None:
+        return _current_span.get() if self.enabled else None
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        """Adds an attribute to the span the code currently runs in, e.g. whether the cache has been hit; does nothing outside of a span."""
+        span = self.current_span()
+        if span is not None:
+            span.set_attribute(key, value)
+
+    def summary(self) -> list[SpanSummary]:
+        """Aggregates all recorded spans by their name.
+
+        Returns:
+            list[SpanSummary]: count and durations of each span name, in the order the spans have been started in
+        """
+        summaries: dict[str, SpanSummary] = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        for span in spans:
+            summary = summaries.setdefault(span.name, SpanSummary(span.name))
+            summary.count += 1
+            summary.total += span.duration
+            summary.max = max(summary.max, span.duration)
+            summary.failed += span.status != "ok"
+        return list(summaries.values())
+
+    def export(
+        self, path: Path, trace_format: TraceFormat, clear: bool = False
+    ) -> None:
+        """Appends all recorded spans to the given file.
+
+        Args:
+            path (Path): the file the spans are appended to
+            trace_format (TraceFormat): the format the spans are written in
+            clear (bool, optional): whether the exported spans should be forgotten, so a long-running process does not export them again. Defaults to False.
+        """
+        with self._lock:
+            spans = list(self.spans)
+            if clear:
+                self.spans.clear()
+        if not spans:
+            return
+        if trace_format == TraceFormat.OTLP:
+            lines = [json.dumps(_otlp_request(spans))]
+        else:
+            lines = [json.dumps(_jsonl_record(span)) for span in spans]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def traced(
+    name: str | None = None,
+    attributes: Callable[..., dict[str, AttributeValue]] | None = None,
+) -> Callable[[_F], _F]:
+    """This decorator records every call of the wrapped function as a span.
+
+    Args:
+        name (str | None, optional): name of the span. Defaults to the qualified name of the wrapped function.
+        attributes (Callable[..., dict[str, AttributeValue]] | None, optional): called with the arguments of the wrapped function to determine the attributes of the span. Defaults to all arguments that are strings, numbers or tuples of those, except self.
+
+    Returns:
+        Callable[[_F], _F]: the decorator
+    """
+
+    def decorator(func: _F) -> _F:
+        span_name = name or func.__qualname__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper_decorator(*args: Any, **kwargs: Any) -> Any:
+            if not tracer().enabled:
+                return func(*args, **kwargs)
+            with tracer().span(
+                span_name,
+                **(
+                    attributes(*args, **kwargs)
+                    if attributes
+                    else _scalar_arguments(signature, args, kwargs)
+                ),
+            ):
+                return func(*args, **kwargs)
+
+        return cast(_F, wrapper_decorator)
+
+    return decorator
+
+
+def propagate_context(func: _F) -> _F:
+    """Wraps a function that is run in a worker thread, so spans started inside of it become children of the span it has been handed to the worker in.
+
+    Args:
+        func (_F): a function that is going to be submitted to a worker thread
+
+    Returns:
+        _F: the wrapped function
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        # a context can only be entered by one thread at a time, but the same function might be run by several workers
+        return context.copy().run(func, *args, **kwargs)
+
+    return cast(_F, wrapper)
+
+
+def _scalar_arguments(
+    signature: inspect.Signature, args: tuple[Any, ...], kwargs: dict[str, Any]
+) -> dict[str, AttributeValue]:
+    bound = signature.bind_partial(*args, **kwargs)
+    bound.apply_defaults()
+    result: dict[str, AttributeValue] = {}
+    for key, value in bound.arguments.items():
+        if key == "self":
+            continue
+        if isinstance(value, (str, int, float, bool)):
+            result[key] = value
+        elif isinstance(value, tuple) and value:
+            result[key] = ",".join(str(v) for v in value)
+    return result
+
+
+def _jsonl_record(span: Span) -> dict[str, Any]:
+    return {
+        "name": span.name,
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "start_ns": span.start_ns,
+        "end_ns": span.end_ns,
+        "duration": span.duration,
+        "status": span.status,
+        "attributes": span.attributes,
+    }
+
+
+def _otlp_value(value: AttributeValue) -> dict[str, Any]:
+    # bool needs to be checked first, as it's a subclass of int
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP's JSON encoding transports 64 bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value}
+
+
+def _otlp_request(spans: list[Span]) -> dict[str, Any]:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {
+                            "key": "service.name",
+                            "value": {"stringValue": "theme_boost_union_test_envs"},
+                        }
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "theme_boost_union_test_envs"},
+                        "spans": [
+                            {
+                                "traceId": span.trace_id,
+                                "spanId": span.span_id,
+                                "parentSpanId": span.parent_id or "",
+                                "name": span.name,
+                                # SPAN_KIND_INTERNAL
+                                "kind": 1,
+                                "startTimeUnixNano": str(span.start_ns),
+                                "endTimeUnixNano": str(span.end_ns),
+                                "attributes": [
+                                    {"key": key, "value": _otlp_value(value)}
+                                    for key, value in span.attributes.items()
+                                ],
+                                # STATUS_CODE_OK or STATUS_CODE_ERROR
+                                "status": {"code": 1}
+                                if span.status == "ok"
+                                else {"code": 2, "message": span.status},
+                            }
+                            for span in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+# a single tracer per invocation, so spans recorded anywhere end up in the same trace
+_tracer = Tracer()
+
+
+def tracer() -> Tracer:
+    """Returns the tracer of this invocation."""
+    return _tracer
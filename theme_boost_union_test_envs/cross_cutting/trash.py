@@ -0,0 +1,165 @@
+import fcntl
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, cast
+
+from .logger import log
+from .tracing import propagate_context, tracer
+
+
+class Trash:
+    """Deletes directories in the background. A directory is renamed into the trash first, which is a single, instant operation on the same filesystem, so it's name is free again right away; the actual deletion of it's files happens in a worker thread.
+    The worker is no daemon thread, so an invocation of the CLI still waits for the deletion to finish before it exits, but everything else it does in the meantime is not held up by it.
+    Several invocations might share the trash, so each one only deletes what it claimed: it's own subdirectory of the trash, which is locked as long as the invocation lives. Directories left in the subdirectory of an invocation that has been killed are claimed by the next one putting something into the trash, once it could take over that lock.
+
+    Args:
+        directory (Path): the trash directory, must be on the same filesystem as the directories put into it
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: dict[Path, Future[int]] = {}
+        self._claimed: Path | None = None
+        # held open as long as this process lives, the lock is released by the OS even if it's killed
+        self._claim_lock: IO[str] | None = None
+
+    def discard(self, path: Path) -> Path:
+        """Moves the given directory into the trash and schedules it's deletion.
+
+        Args:
+            path (Path): the directory that should be deleted
+
+        Returns:
+            Path: where the directory lives until it has been deleted
+        """
+        with self._lock:
+            claimed = self._claim_directory()
+        # the same name might be torn down again before the previous one has been deleted
+        trashed = claimed / f"{path.name}-{secrets.token_hex(4)}"
+        with tracer().span("trash.discard"):
+            path.rename(trashed)
+        log().info(f"moved {path} to the trash, deleting it in the background")
+        self._schedule()
+        return trashed
+
+    def wait(self) -> int:
+        """Waits until everything this process put into the trash has been deleted, e.g. before the process exits.
+
+        Returns:
+            int: bytes freed by the deletions that have been waited for
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+        return sum(future.result() for future in pending)
+
+    def _claim_directory(self) -> Path:
+        # the caller holds self._lock
+        if self._claimed is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            token = secrets.token_hex(4)
+            # the lock is only put into place once it's held, otherwise another invocation could take it for an abandoned one
+            unpublished = self.directory / f".{token}.lock.tmp"
+            claim_lock = unpublished.open("a")
+            fcntl.flock(claim_lock.fileno(), fcntl.LOCK_EX)
+            unpublished.rename(self.directory / f".{token}.lock")
+            claimed = self.directory / f".{token}"
+            claimed.mkdir()
+            self._claim_lock, self._claimed = claim_lock, claimed
+        return self._claimed
+
+    def _claim_abandoned(self, lock_file: Path, claimed: Path) -> None:
+        with lock_file.open("a") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # the invocation owning it is still alive
+                return
+            abandoned = lock_file.with_suffix("")
+            try:
+                abandoned.rename(claimed / abandoned.name)
+            except FileNotFoundError:
+                # claimed by another invocation in the meantime
+                pass
+            lock_file.unlink(missing_ok=True)
+
+    def _schedule(self) -> None:
+        with self._lock:
+            claimed = self._claim_directory()
+            if self._executor is None:
+                # deleting is bound by the filesystem, more workers would only compete for it
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="trash"
+                )
+            for lock_file in self.directory.glob(".*.lock"):
+                if lock_file.with_suffix("") != claimed:
+                    self._claim_abandoned(lock_file, claimed)
+            for entry in claimed.iterdir():
+                if entry not in self._pending:
+                    self._pending[entry] = self._executor.submit(
+                        propagate_context(self._delete), entry
+                    )
+
+    def _delete(self, path: Path) -> int:
+        """Deletes the given directory from the bottom up and sums up the space it's files occupied on disk. Files hardlinked somewhere else, e.g. into the Moodle cache, do not free any space, so they are not counted.
+
+        Args:
+            path (Path): the trashed directory
+
+        Returns:
+            int: bytes freed on disk
+        """
+        freed = 0
+        failed = 0
+        start = time.monotonic()
+        with tracer().span("trash.delete") as span:
+            for root, dirs, files in os.walk(path, topdown=False):
+                for name in files:
+                    file = os.path.join(root, name)
+                    try:
+                        stat = os.lstat(file)
+                        os.unlink(file)
+                    except OSError:
+                        failed += 1
+                        continue
+                    if stat.st_nlink == 1:
+                        freed += stat.st_blocks * 512
+                for name in dirs:
+                    directory = os.path.join(root, name)
+                    try:
+                        # symlinks into the shared moodle-docker trees are listed as directories, but must not be followed
+                        if os.path.islink(directory):
+                            os.unlink(directory)
+                        else:
+                            os.rmdir(directory)
+                    except OSError:
+                        failed += 1
+            try:
+                path.rmdir()
+            except OSError:
+                failed += 1
+            span.set_attribute("freed_bytes", freed)
+        if failed:
+            # e.g. files written by a container as root; they stay in the trash for now
+            log().error(
+                f"could not delete {failed} entries of {path}, they are left in the trash"
+            )
+        log().info(
+            f"deleted {path.name} from the trash, freed {freed / 1024 / 1024:.1f} MB in {time.monotonic() - start:.1f}s"
+        )
+        return freed
+
+
+def trash() -> Trash:
+    # hacky, but hides implementation detail about the singleton and allows us
+    # to avoid the circular dependency issues if each import is directly
+    # embedded into the services
+    from ..app import application
+
+    # sometimes mypy is just a funny thing.
+    return cast(Trash, application().cross_cutting_concerns.trash())
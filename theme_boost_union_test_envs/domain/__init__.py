@@ -1,11 +1,32 @@
+from .cache_index import CachePruneResult, CacheStats
+from .container_executor import (
+    ContainerActionExecutor,
+    ContainerActionResult,
+    ContainerBatchResult,
+)
 from .git import (
+    GitMirror,
     GitReference,
     GitReferenceType,
     GitRepository,
+    boost_union_mirror,
     clone_boost_union_repo,
     clone_moodle_docker_repo,
+    list_released_moodle_versions,
+)
+from .inventory import EnvironmentInventory, invalidate_inventory, inventory
+from .lifecycle import LifecycleCheckpoint, LifecycleStep
+from .matrix import (
+    MatrixEntry,
+    MatrixEntryResult,
+    MatrixResult,
+    MatrixSpec,
+    load_matrix_spec,
 )
 from .moodle import MoodleCache, MoodleDownloader, moodle_cache
+from .moodle_docker import MoodleDockerTrees
+from .snapshot import DatabaseSnapshot, DatabaseSnapshotStore, database_snapshots
+from .supervisor import Supervisor
 from .test_container import TestContainer
-from .test_infrastructure import TestInfrastructure
+from .test_infrastructure import TeardownResult, TestInfrastructure
 from .testbed import Testbed
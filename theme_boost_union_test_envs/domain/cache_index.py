@@ -0,0 +1,107 @@
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from pathlib import Path
+
+import yaml
+from yaml.loader import SafeLoader
+
+from ..cross_cutting import atomic_write_text, file_lock
+
+
+class EvictionPolicy(str, Enum):
+    LRU = "lru"
+    LFU = "lfu"
+
+
+class VerificationMode(str, Enum):
+    # hash the whole archive on every cache hit
+    FULL = "full"
+    # only re-hash the archive if it's size or mtime changed since it has been verified the last time
+    LAZY = "lazy"
+
+
+@dataclass
+class CacheEntry:
+    version: str
+    digest: str
+    size: int
+    last_access: float = field(default_factory=time.time)
+    hits: int = 0
+    # mtime of the archive at the time it's checksum has been verified the last time
+    verified_mtime: float = 0.0
+
+    def eviction_key(self, policy: EvictionPolicy) -> tuple[float, ...]:
+        """Returns the key by which entries are sorted for eviction; the entry with the smallest key will be evicted first.
+
+        Args:
+            policy (EvictionPolicy): the configured eviction policy
+
+        Returns:
+            tuple[float, ...]: the sort key of this entry
+        """
+        if policy == EvictionPolicy.LFU:
+            # ties between equally often used entries are broken by their recency
+            return (self.hits, self.last_access)
+        return (self.last_access,)
+
+
+@dataclass
+class CacheStats:
+    entries: list[CacheEntry]
+    total_size: int
+    max_size: int
+    eviction_policy: EvictionPolicy
+
+
+@dataclass
+class CachePruneResult:
+    evicted: list[str] = field(default_factory=list)
+    freed_bytes: int = 0
+
+
+def total_size(entries: dict[str, CacheEntry]) -> int:
+    # archives shared by several versions only occupy their space once
+    return sum({e.digest: e.size for e in entries.values()}.values())
+
+
+class CacheIndex:
+    """The index of the Moodle cache, persisted as yaml next to the cached archives. It records each cached Moodle version with the checksum, size and usage of it's archive."""
+
+    def __init__(self, index_file: Path) -> None:
+        self.index_file = index_file
+        self.lock_file = index_file.with_suffix(".lock")
+
+    @contextmanager
+    def locked(self) -> Iterator[dict[str, CacheEntry]]:
+        """Loads the index while holding the cache's lock and saves all changes done to the yielded entries afterwards. Concurrent invocations of this application will wait for the lock to be released.
+
+        Yields:
+            Iterator[dict[str, CacheEntry]]: all cached Moodle versions mapped to their index entry
+        """
+        with file_lock(self.lock_file):
+            entries = self.load()
+            yield entries
+            self._save(entries)
+
+    def load(self) -> dict[str, CacheEntry]:
+        if not self.index_file.exists():
+            return {}
+        saved_yaml = yaml.load(self.index_file.read_text(), Loader=SafeLoader)
+        # an empty file is loaded as None
+        if not saved_yaml:
+            return {}
+        return {
+            str(version): CacheEntry(version=str(version), **data)
+            for version, data in saved_yaml.items()
+        }
+
+    def _save(self, entries: dict[str, CacheEntry]) -> None:
+        serialized = {}
+        for version, entry in sorted(entries.items()):
+            data = asdict(entry)
+            data.pop("version")
+            serialized[version] = data
+        atomic_write_text(self.index_file, yaml.dump(serialized))
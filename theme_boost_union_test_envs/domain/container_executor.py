@@ -0,0 +1,106 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+from ..cross_cutting import log, propagate_context
+from ..exceptions import ContainerCommandFailedError
+from .test_container import TestContainer
+
+
+@dataclass
+class ContainerActionResult:
+    version: str
+    action: str
+    # seconds the action took for this container
+    duration: float
+    # exit code of the failed docker compose command; 0 if the action succeeded, -1 if it failed for another reason
+    returncode: int = 0
+    error: str | None = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0
+
+
+@dataclass
+class ContainerBatchResult:
+    infrastructure: str
+    action: str
+    duration: float = 0.0
+    results: list[ContainerActionResult] = field(default_factory=list)
+
+    @property
+    def succeeded(self) -> list[str]:
+        return [r.version for r in self.results if r.succeeded]
+
+    @property
+    def failed(self) -> list[str]:
+        return [r.version for r in self.results if not r.succeeded]
+
+
+class ContainerActionExecutor:
+    """Issues the same action (start/up, stop, restart, destroy/down) to several Moodle test containers at once, with a bounded number of containers handled in parallel."""
+
+    def __init__(self, max_parallel: int) -> None:
+        self.max_parallel = max(1, max_parallel)
+
+    def run(
+        self,
+        infrastructure_name: str,
+        function: Callable[[TestContainer], None],
+        containers: list[TestContainer],
+        action: str | None = None,
+    ) -> ContainerBatchResult:
+        """Calls the given function for every given container. A failing container does not stop the action for the other containers; it's failure is recorded in the returned result instead.
+
+        Args:
+            infrastructure_name (str): the infrastructure all given containers belong to
+            function (Callable[[TestContainer], None]): the action that should be issued to the containers
+            containers (list[TestContainer]): the containers the action should be issued to
+            action (str | None, optional): how the action is called in the logs and the result. Defaults to the name of the function.
+
+        Returns:
+            ContainerBatchResult: the outcome and duration of the action for every container
+        """
+        # use function name for logging as it describes perfectly what is going to happen
+        batch = ContainerBatchResult(infrastructure_name, action or function.__name__)
+        start = time.monotonic()
+        with ThreadPoolExecutor(
+            max_workers=self.max_parallel, thread_name_prefix=batch.action
+        ) as executor:
+            batch.results = list(
+                executor.map(
+                    # spans of the containers become children of the span of the whole action
+                    propagate_context(
+                        lambda container: self._run_single(batch, function, container)
+                    ),
+                    containers,
+                )
+            )
+        batch.duration = time.monotonic() - start
+        return batch
+
+    def _run_single(
+        self,
+        batch: ContainerBatchResult,
+        function: Callable[[TestContainer], None],
+        container: TestContainer,
+    ) -> ContainerActionResult:
+        with log().contextualize(env=f"{batch.infrastructure}/{container.version}"):
+            log().info(f"{batch.action}ing container for moodle {container.version}")
+            start = time.monotonic()
+            result = ContainerActionResult(container.version, batch.action, 0.0)
+            try:
+                # pythonic way to call a passed, higher-order class instance function on an existing object
+                function(container)
+                log().info(f"done {batch.action}ing container")
+            except ContainerCommandFailedError as e:
+                result.returncode = e.returncode
+                result.error = f"docker compose exited with {e.returncode}"
+            except Exception as e:
+                result.returncode = -1
+                result.error = str(e) or type(e).__name__
+                log().error(f"{batch.action}ing container failed: {result.error}")
+            result.duration = time.monotonic() - start
+            return result
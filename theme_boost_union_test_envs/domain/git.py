@@ -1,10 +1,19 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from git import Repo
+from ..cross_cutting import config, file_lock, log, parse_version
+from ..exceptions import InvalidGitReferenceError
 
-from ..cross_cutting import config, log
+# GitPython takes a while to import, so it's only imported by commands that actually work with repositories
+if TYPE_CHECKING:
+    from git import Repo
 
 Branch = str
 Commit = str
@@ -25,18 +34,189 @@ class GitReference:
     type: GitReferenceType
 
 
+# references fetched by GitMirror.prefetched(), keyed by the directory of their mirror
+_prefetched: set[tuple[Path, GitReferenceType, str]] = set()
+_prefetched_lock = threading.Lock()
+
+
+class GitMirror:
+    """A bare mirror of a remote repository inside our testbed. Only the git references that are actually requested are fetched into it, and each fetch only transfers the objects the mirror does not have yet.
+    Working copies are created from the mirror by borrowing it's objects (like 'git clone --shared'), so a new working copy only costs it's checked out files instead of a full clone.
+
+    Args:
+        remote_repo_url (str): the repository that is mirrored
+        directory (Path): where the bare mirror is kept, will be created on first use
+    """
+
+    def __init__(self, remote_repo_url: str, directory: Path) -> None:
+        self.remote_url = remote_repo_url
+        self.directory = directory
+        self.lock_file = directory.with_name(f"{directory.name}.lock")
+
+    def clone(self, destination: Path, git_ref: GitReference) -> Repo:
+        """Creates a working copy of the mirrored repository with the given git reference checked out. The 'origin' remote of the working copy points to the mirrored repository, not to the mirror.
+
+        Args:
+            destination (Path): where the working copy should be created
+            git_ref (GitReference): the git reference that should be checked out
+
+        Raises:
+            InvalidGitReferenceError: raised if the git reference does not exist in the mirrored repository
+
+        Returns:
+            Repo: the working copy
+        """
+        # the mirror is shared by all infrastructures, so concurrent setups need to take turns
+        with file_lock(self.lock_file):
+            mirror = self._open()
+            local_ref = self._fetch(mirror, git_ref)
+        from git import Repo
+
+        repo = Repo.init(destination)
+        # borrow all objects of the mirror instead of copying them, exactly what 'git clone --shared' does
+        alternates = Path(repo.git_dir) / "objects" / "info" / "alternates"
+        alternates.write_text(f"{(self.directory / 'objects').resolve()}\n")
+        repo.create_remote("origin", self.remote_url)
+        if git_ref.type == GitReferenceType.COMMIT:
+            repo.git.checkout(str(git_ref.ref))
+        elif git_ref.type == GitReferenceType.TAG:
+            repo.git.fetch(str(self.directory), f"+{local_ref}:{local_ref}")
+            repo.git.checkout(str(git_ref.ref))
+        else:
+            # branches and PRs are checked out as local branches tracking origin, same as after a regular clone
+            branch_name = (
+                f"pr/{git_ref.ref}"
+                if git_ref.type == GitReferenceType.PULL_REQUEST
+                else str(git_ref.ref)
+            )
+            remote_ref = f"refs/remotes/origin/{branch_name}"
+            # no objects need to be transferred by this fetch, they are all borrowed already
+            repo.git.fetch(str(self.directory), f"+{local_ref}:{remote_ref}")
+            repo.git.checkout("-b", branch_name, "--track", f"origin/{branch_name}")
+        return repo
+
+    @contextmanager
+    def prefetched(self, *git_refs: GitReference) -> Iterator[None]:
+        """Fetches each of the given git references into the mirror once. Clones created during the with-block reuse these instead of fetching their reference again, e.g. several infrastructures built from the same PR at once.
+
+        Args:
+            *git_refs (GitReference): the git references that are about to be cloned
+
+        Yields:
+            Iterator[None]: nothing, the fetched references are reused while the with-block is executed
+        """
+        keys = []
+        with file_lock(self.lock_file):
+            mirror = self._open()
+            for git_ref in git_refs:
+                key = (self.directory, git_ref.type, str(git_ref.ref))
+                if key in keys:
+                    continue
+                try:
+                    self._fetch(mirror, git_ref)
+                except InvalidGitReferenceError:
+                    # cloning it raises the same error again, for the infrastructure that needs it
+                    continue
+                keys.append(key)
+        with _prefetched_lock:
+            _prefetched.update(keys)
+        try:
+            yield
+        finally:
+            with _prefetched_lock:
+                _prefetched.difference_update(keys)
+
+    def _open(self) -> Repo:
+        from git import Repo
+
+        if self.directory.exists():
+            return Repo(self.directory)
+        log().info(f"creating local mirror of {self.remote_url} @ {self.directory}")
+        mirror = Repo.init(self.directory, bare=True)
+        mirror.create_remote("origin", self.remote_url)
+        with mirror.config_writer() as writer:
+            # working copies borrow objects from the mirror, these must never be pruned, even if a force-pushed PR no longer references them
+            writer.set_value("gc", "pruneExpire", "never")
+        return mirror
+
+    def _fetch(self, mirror: Repo, git_ref: GitReference) -> str:
+        # only fetch the requested reference instead of all branches or even all PRs
+        if git_ref.type == GitReferenceType.BRANCH:
+            local_ref = f"refs/heads/{git_ref.ref}"
+            refspec = f"+{local_ref}:{local_ref}"
+        elif git_ref.type == GitReferenceType.TAG:
+            local_ref = f"refs/tags/{git_ref.ref}"
+            refspec = f"+{local_ref}:{local_ref}"
+        elif git_ref.type == GitReferenceType.PULL_REQUEST:
+            # only GitHub is supported for now, GitLab would need refs/merge-requests/*/head
+            local_ref = f"refs/pull/{git_ref.ref}/head"
+            refspec = f"+{local_ref}:{local_ref}"
+        else:
+            # keep the commit reachable in the mirror, so it is never pruned
+            local_ref = f"refs/commits/{git_ref.ref}"
+            if self._has_commit(mirror, str(git_ref.ref)):
+                return local_ref
+            refspec = f"+{git_ref.ref}:{local_ref}"
+        with _prefetched_lock:
+            if (self.directory, git_ref.type, str(git_ref.ref)) in _prefetched:
+                return local_ref
+        from git import GitCommandError
+
+        from ..ui.cli import GitRemoteProgress
+
+        log().info(f"fetching {git_ref.type.value} {git_ref.ref} into local mirror")
+        try:
+            if git_ref.type == GitReferenceType.COMMIT:
+                # GitPython cannot parse the result of fetching a commit id, so git is called directly
+                mirror.git.fetch("origin", refspec)
+            else:
+                mirror.remote("origin").fetch(refspec, progress=GitRemoteProgress())
+        except GitCommandError as e:
+            if git_ref.type != GitReferenceType.COMMIT:
+                raise InvalidGitReferenceError(
+                    f"{git_ref.type.value} {git_ref.ref} does not exist in {self.remote_url}"
+                ) from e
+            # some servers do not allow fetching commits by their id, fall back to fetching all branches
+            mirror.remote("origin").fetch(
+                "+refs/heads/*:refs/heads/*", progress=GitRemoteProgress()
+            )
+            if not self._has_commit(mirror, str(git_ref.ref)):
+                raise InvalidGitReferenceError(
+                    f"commit {git_ref.ref} does not exist in {self.remote_url}"
+                ) from e
+            mirror.git.update_ref(local_ref, str(git_ref.ref))
+        return local_ref
+
+    def _has_commit(self, mirror: Repo, commit: str) -> bool:
+        from git import GitCommandError
+
+        try:
+            mirror.git.cat_file("-e", f"{commit}^{{commit}}")
+            return True
+        except GitCommandError:
+            return False
+
+
 class GitRepository:
     def __init__(
         self,
         remote_repo_url: str,
         destination: Path,
         git_ref: GitReference,
+        mirror: GitMirror | None = None,
     ) -> None:
         self.remote_url = remote_repo_url
-        self.repo = self.__clone_repo(destination, git_ref)
+        if mirror is not None:
+            log().info("cloning repository from local mirror...")
+            self.repo = mirror.clone(destination, git_ref)
+            log().info(f"done cloning, checked out: {git_ref}")
+        else:
+            self.repo = self.__clone_repo(destination, git_ref)
 
     def __clone_helper(self, dest: Path, **clone_args) -> Repo:  # type: ignore
         # helper function to always include our progress bar
+        from git import Repo
+
         from ..ui.cli import GitRemoteProgress
 
         return Repo.clone_from(
@@ -79,14 +259,44 @@ class GitRepository:
         return repo
 
 
+def boost_union_mirror() -> GitMirror:
+    return GitMirror(config().boost_union_repo_url, config().boost_union_mirror_dir)
+
+
 def clone_boost_union_repo(directory: Path, git_ref: GitReference) -> GitRepository:
     return GitRepository(
         config().boost_union_repo_url,
         directory / config().boost_union_base_directory_name,
         git_ref,
+        mirror=boost_union_mirror(),
     )
 
 
+def list_released_moodle_versions() -> list[str]:
+    """Lists every Moodle version that has been released, i.e. has been tagged in the Moodle repository, without cloning it.
+
+    Returns:
+        list[str]: the Moodle versions, e.g. "4.3.1" or "4.3.0-rc1"
+    """
+    from git import cmd
+    from packaging.version import InvalidVersion
+
+    # only the names of the tags are needed, not the commits they point to
+    output = str(cmd.Git().ls_remote("--tags", "--refs", config().moodle_repo_url))
+    versions = []
+    for line in output.splitlines():
+        tag = line.rpartition("refs/tags/")[2]
+        if not tag.startswith("v"):
+            continue
+        try:
+            parse_version(tag[1:])
+        except InvalidVersion:
+            # e.g. tags of Moodle's own tooling
+            continue
+        versions.append(tag[1:])
+    return versions
+
+
 def clone_moodle_docker_repo() -> GitRepository:
     return GitRepository(
         config().moodle_docker_repo_url,
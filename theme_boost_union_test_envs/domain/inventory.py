@@ -0,0 +1,96 @@
+import threading
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any
+
+from ..cross_cutting import config, log, yaml_parser
+
+
+class EnvironmentInventory:
+    """An in-memory snapshot of the testbed: which infrastructures exist, which Moodle test environments exist inside their "moodles" directory and what our "database" knows about them.
+    Everything is looked up lazily and only once, so the checks done by our decorators and commands during a single invocation do not hit the filesystem or the state store again and again. After the testbed has been changed, the inventory needs to be invalidated via invalidate_inventory().
+    """
+
+    def __init__(self, working_dir: Path) -> None:
+        self.working_dir = working_dir
+        self.testbed_exists = working_dir.exists()
+        # the inventory is shared by the threads handling several environments in parallel
+        self._lock = threading.RLock()
+        self._infrastructures: dict[str, bool] = {}
+        self._versions: dict[str, list[str]] = {}
+        self._state: MutableMapping[Any, Any] | None = None
+
+    @property
+    def state(self) -> MutableMapping[Any, Any]:
+        with self._lock:
+            if self._state is None:
+                self._state = yaml_parser().load_testbed_info()
+            return self._state
+
+    def has_infrastructure(self, infrastructure_name: str) -> bool:
+        with self._lock:
+            if infrastructure_name not in self._infrastructures:
+                self._infrastructures[infrastructure_name] = (
+                    self.working_dir / infrastructure_name
+                ).is_dir()
+            return self._infrastructures[infrastructure_name]
+
+    def versions(self, infrastructure_name: str) -> list[str]:
+        """Returns the versions of all Moodle test environments that exist inside the given infrastructure.
+
+        Args:
+            infrastructure_name (str): name of the infrastructure
+
+        Returns:
+            list[str]: the Moodle versions, sorted by name; empty if the infrastructure does not exist
+        """
+        with self._lock:
+            if infrastructure_name not in self._versions:
+                moodles = self.working_dir / infrastructure_name / "moodles"
+                self._versions[infrastructure_name] = (
+                    sorted(d.name for d in moodles.iterdir() if d.is_dir())
+                    if moodles.is_dir()
+                    else []
+                )
+                # environments our database knows of, but which are gone from disk, e.g. after a failed destroy
+                persisted = (self.state.get(infrastructure_name) or {}).get(
+                    "moodles"
+                ) or {}
+                stale = set(persisted) - set(self._versions[infrastructure_name])
+                if stale:
+                    log().warning(
+                        f"{infrastructure_name} lists environments that do not exist on disk: {', '.join(sorted(stale))}"
+                    )
+            return self._versions[infrastructure_name]
+
+    def has_environment(self, infrastructure_name: str, version: str) -> bool:
+        with self._lock:
+            versions = self.versions(infrastructure_name)
+            if version in versions:
+                return True
+            # the environment might have been created after the directory has been scanned, e.g. during a build
+            if (self.working_dir / infrastructure_name / "moodles" / version).is_dir():
+                versions.append(version)
+                versions.sort()
+                return True
+            return False
+
+
+_inventory: EnvironmentInventory | None = None
+_inventory_lock = threading.Lock()
+
+
+def inventory() -> EnvironmentInventory:
+    """Returns the inventory of this invocation, building it on first use."""
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = EnvironmentInventory(config().working_dir)
+        return _inventory
+
+
+def invalidate_inventory() -> None:
+    """Drops the current inventory, the next call to inventory() will build a new one. Needs to be called after every change to the testbed."""
+    global _inventory
+    with _inventory_lock:
+        _inventory = None
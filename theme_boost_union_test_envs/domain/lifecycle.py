@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+from enum import Enum
+from pathlib import Path
+
+import yaml
+from yaml.loader import SafeLoader
+
+from ..cross_cutting import atomic_write_text
+
+
+class LifecycleStep(str, Enum):
+    # in the order they are completed
+    CREATED = "created"
+    DB_INSTALLED = "db-installed"
+    THEME_SET = "theme-set"
+    DATA_SEEDED = "data-seeded"
+
+
+class LifecycleCheckpoint:
+    """Remembers which steps of it's lifecycle a Moodle test environment has completed, so every step runs only once and an interrupted start resumes from the last completed step.
+    The checkpoint is a small yaml file inside the environment, mapping each completed step to when it has been completed.
+
+    Args:
+        path (Path): the checkpoint file
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def completed(self) -> dict[LifecycleStep, str]:
+        if not self.path.exists():
+            return {}
+        steps = yaml.load(self.path.read_text(), Loader=SafeLoader) or {}
+        return {
+            LifecycleStep(step): completed_at for step, completed_at in steps.items()
+        }
+
+    def is_done(self, step: LifecycleStep) -> bool:
+        return step in self.completed()
+
+    def mark(self, *steps: LifecycleStep) -> None:
+        completed = self.completed()
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        for step in steps:
+            completed.setdefault(step, now)
+        # an interrupted write must not lose the steps completed before
+        atomic_write_text(
+            self.path,
+            yaml.dump(
+                {
+                    step.value: completed[step]
+                    for step in LifecycleStep
+                    if step in completed
+                },
+                sort_keys=False,
+            ),
+        )
@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+from ..exceptions import InvalidMatrixSpecError
+from .git import GitReference, GitReferenceType
+
+
+@dataclass
+class MatrixEntry:
+    infrastructure: str
+    git_ref: GitReference
+    versions: list[str]
+
+
+@dataclass
+class MatrixSpec:
+    """Which infrastructures should be built with which Moodle versions, e.g. "for these 5 PRs, build Moodle 4.1 to 4.4"."""
+
+    entries: list[MatrixEntry] = field(default_factory=list)
+
+    @property
+    def versions(self) -> list[str]:
+        # every Moodle version is only downloaded once, no matter how many infrastructures need it
+        return list(
+            dict.fromkeys(
+                version for entry in self.entries for version in entry.versions
+            )
+        )
+
+
+@dataclass
+class MatrixEntryResult:
+    infrastructure: str
+    git_ref: str
+    versions: list[str]
+    # whether the infrastructure has been set up by this run; existing ones are only built
+    set_up: bool = False
+    # seconds it took to set up and build the infrastructure
+    duration: float = 0.0
+    error: str | None = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class MatrixResult:
+    duration: float = 0.0
+    results: list[MatrixEntryResult] = field(default_factory=list)
+
+    @property
+    def failed(self) -> list[str]:
+        return [r.infrastructure for r in self.results if not r.succeeded]
+
+
+def load_matrix_spec(path: Path) -> MatrixSpec:
+    """Reads a matrix spec from the given yaml file. Each infrastructure names exactly one git reference of Boost Union by it's type and may list it's own Moodle versions, otherwise the versions listed for all of them are used, e.g.:
+        versions: ["4.1", "4.2", "4.3", "4.4"]
+        infrastructures:
+          pr-512:
+            pr: 512
+          main:
+            branch: main
+            versions: ["4.4"]
+
+    Args:
+        path (Path): the yaml file containing the spec
+
+    Raises:
+        InvalidMatrixSpecError: raised if the file does not describe a valid spec
+
+    Returns:
+        MatrixSpec: the spec, with the infrastructures in the order they are listed
+    """
+    try:
+        raw: Any = yaml.safe_load(path.read_text())
+    except yaml.YAMLError as e:
+        raise InvalidMatrixSpecError(f"{path} is not valid yaml: {e}") from e
+    if not isinstance(raw, dict) or not isinstance(raw.get("infrastructures"), dict):
+        raise InvalidMatrixSpecError(f"{path} does not list any infrastructures")
+    default_versions = raw.get("versions") or []
+    spec = MatrixSpec()
+    for name, infrastructure in raw["infrastructures"].items():
+        infrastructure = infrastructure or {}
+        ref_types = [t for t in GitReferenceType if t.value in infrastructure]
+        if len(ref_types) != 1:
+            raise InvalidMatrixSpecError(
+                f"infrastructure {name} needs exactly one git reference: {', '.join(t.value for t in GitReferenceType)}"
+            )
+        versions = infrastructure.get("versions", default_versions)
+        if not versions:
+            raise InvalidMatrixSpecError(f"no Moodle versions given for {name}")
+        spec.entries.append(
+            MatrixEntry(
+                str(name),
+                GitReference(infrastructure[ref_types[0].value], ref_types[0]),
+                [str(version) for version in versions],
+            )
+        )
+    return spec
@@ -1,17 +1,46 @@
+import os
+import shutil
+import tempfile
 import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 from pathlib import Path
 from typing import cast
 
-import requests
-from requests.exceptions import HTTPError
-
-from ..cross_cutting import config, log
-from ..exceptions import InvalidMoodleVersionError
+from ..cross_cutting import (
+    CloneStrategy,
+    clone_tree,
+    config,
+    file_lock,
+    log,
+    make_read_only,
+    propagate_context,
+    sha256_of_file,
+    traced,
+    tracer,
+)
+from ..exceptions import InvalidMoodleVersionError, MoodleDownloadFailedError
+from .cache_index import (
+    CacheEntry,
+    CacheIndex,
+    CachePruneResult,
+    CacheStats,
+    EvictionPolicy,
+    VerificationMode,
+    total_size,
+)
 
 
 class MoodleDownloader:
-    def __init__(self, url: str, retries: int, retry_timeout: int) -> None:
+    def __init__(
+        self,
+        url: str,
+        retries: int,
+        retry_timeout: int,
+        chunk_size: int = 1024 * 1024,
+        parallel_downloads: int = 4,
+    ) -> None:
         self.url = url
         self.retries = retries
         self.retry_codes = [
@@ -22,53 +51,434 @@ class MoodleDownloader:
             HTTPStatus.GATEWAY_TIMEOUT,
         ]
         self.retry_timeout = retry_timeout
+        self.chunk_size = chunk_size
+        self.parallel_downloads = parallel_downloads
 
     def download(self, file_name: str, destination: Path) -> None:
+        """Downloads the given file into the destination. The response is streamed in chunks into a partial file next to the destination, which is only renamed to the destination after the download has been completed. This makes sure a destination that exists is always complete.
+        If the connection drops, the download is resumed from the partial file via a HTTP range request, given the server supports it.
+
+        Args:
+            file_name (str): name of the file that should be downloaded, relative to the configured url
+            destination (Path): path the downloaded file should be saved to
+
+        Raises:
+            HTTPError: raised if the server answered with a status code that should not be retried
+            MoodleDownloadFailedError: raised if the download did not succeed after all retries
+        """
+        # requests takes a while to import, so it's only imported by commands that actually download something
+        from requests.exceptions import ChunkedEncodingError
+        from requests.exceptions import ConnectionError as RequestsConnectionError
+        from requests.exceptions import HTTPError, Timeout
+
+        dl_link_for_vers = self.url + file_name
+        partial_destination = _partial_file(destination)
         for retry in range(self.retries):
             try:
-                dl_link_for_vers = self.url + file_name
                 log().info(
                     f"downloading from {dl_link_for_vers} - try {retry+1} from {self.retries}"
                 )
-                resp = requests.get(dl_link_for_vers, allow_redirects=True)
-                resp.raise_for_status()
-                with destination.open(mode="wb") as file:
-                    file.write(resp.content)
+                self._stream_to_file(dl_link_for_vers, partial_destination)
+                # the rename is atomic, so nobody will ever see a half-written archive under the real name
+                os.replace(partial_destination, destination)
                 log().info(f"download done, saved to cache: {destination}")
-                # if successful, we need to break out of the loop
-                break
+                return
             except HTTPError as e:
                 if e.response.status_code in self.retry_codes:
                     # retry after exponential backoff
                     time.sleep(retry * self.retry_timeout)
                     continue
+                partial_destination.unlink(missing_ok=True)
                 raise e
+            except (RequestsConnectionError, ChunkedEncodingError, Timeout) as e:
+                # keep the partial file, the next try will resume from it
+                log().warning(f"download of {file_name} interrupted: {e}")
+                time.sleep(retry * self.retry_timeout)
+                continue
+        raise MoodleDownloadFailedError(file_name)
+
+    def _stream_to_file(self, url: str, partial_destination: Path) -> None:
+        import requests
+        from requests.exceptions import ChunkedEncodingError
+
+        offset = (
+            partial_destination.stat().st_size if partial_destination.exists() else 0
+        )
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with requests.get(
+            url, headers=headers, stream=True, allow_redirects=True, timeout=60
+        ) as resp:
+            if (
+                offset
+                and resp.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+                and resp.headers.get("Content-Range") == f"bytes */{offset}"
+            ):
+                # the previous try received everything, but failed before the rename
+                return
+            resp.raise_for_status()
+            if resp.status_code != HTTPStatus.PARTIAL_CONTENT:
+                # the server ignored our range request, so we have to start over
+                offset = 0
+            else:
+                log().info(f"resuming download at byte {offset}")
+            expected_size = resp.headers.get("Content-Length")
+            written = 0
+            with partial_destination.open(mode="ab" if offset else "wb") as file:
+                for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                    file.write(chunk)
+                    written += len(chunk)
+            if expected_size is not None and written != int(expected_size):
+                raise ChunkedEncodingError(
+                    f"received {written} of {expected_size} bytes from {url}"
+                )
 
 
 class MoodleCache:
-    def __init__(self, downloader: MoodleDownloader) -> None:
+    """A disk cache for the source archives of Moodle versions.
+    Archives are stored content-addressed, i.e. named by their sha256 checksum, while an index maps each Moodle version onto it's archive and records it's size and usage. This allows us to detect truncated or otherwise damaged archives before serving them, and to evict archives if the cache grows beyond it's configured size.
+    """
+
+    def __init__(
+        self,
+        downloader: MoodleDownloader,
+        max_size_mb: int = 0,
+        eviction_policy: str = EvictionPolicy.LRU,
+        verification: str = VerificationMode.LAZY,
+        clone_strategies: list[str] | None = None,
+    ) -> None:
         self.directory = config().moodle_cache_dir
+        self.blob_dir = self.directory / "blobs"
+        self.tree_dir = self.directory / "trees"
+        self.download_dir = self.directory / "downloads"
+        self.index = CacheIndex(self.directory / "index.yaml")
         self.downloader = downloader
+        # 0 denotes an unbounded cache
+        self.max_size = max_size_mb * 1024 * 1024
+        self.eviction_policy = EvictionPolicy(eviction_policy)
+        self.verification = VerificationMode(verification)
+        self.clone_strategies = [
+            CloneStrategy(strategy)
+            for strategy in clone_strategies or list(CloneStrategy)
+        ]
 
     def get(self, version: str) -> Path:
-        moodle_tar_name = _generate_archive_file_name(version)
-        archive_path = self.directory / moodle_tar_name
-        # if the selected moodle version isn't on disk, we need to download it
-        if not archive_path.exists():
-            log().info(f"cache miss - trying to download moodle {version}")
+        return self.get_many(version)[version]
+
+    @traced(
+        "cache.get",
+        attributes=lambda self, *versions: {"versions": ",".join(versions)},
+    )
+    def get_many(self, *versions: str) -> dict[str, Path]:
+        """Returns the paths to the source archives of all given Moodle versions. Every version that is not in the cache yet, or whose cached archive turned out to be damaged, will be downloaded; several cache misses are downloaded concurrently.
+
+        Args:
+            versions (tuple[str, ...]): the Moodle versions for which the source archives are needed
+
+        Raises:
+            InvalidMoodleVersionError: raised if a Moodle version does not exist
+
+        Returns:
+            dict[str, Path]: the given Moodle versions mapped to their source archive
+        """
+        archives: dict[str, Path] = {}
+        misses: dict[str, Path] = {}
+        with self.index.locked() as entries:
+            for version in dict.fromkeys(versions):
+                entry = entries.get(version) or self._adopt_legacy_archive(version)
+                if entry is not None and self._verify(entry):
+                    # just return the path to the source of the selected moodle version, as we have the file on disk; effectively hitting our 'cache'
+                    log().info(f"cache hit - getting moodle {version} from disk")
+                    entry.hits += 1
+                    entry.last_access = time.time()
+                    entries[version] = entry
+                    archives[version] = self._blob_path(entry.digest)
+                    continue
+                if entry is not None:
+                    log().warning(
+                        f"cached archive of moodle {version} is damaged - discarding it"
+                    )
+                    entries.pop(version, None)
+                    # the download is stored at the same path, the damaged archive must not be taken for it
+                    self._remove_archive(entry.digest)
+                # if the selected moodle version isn't on disk, we need to download it
+                log().info(f"cache miss - trying to download moodle {version}")
+                misses[version] = self.download_dir / _generate_archive_file_name(
+                    version
+                )
+        tracer().set_attribute("cache.hits", ",".join(archives))
+        tracer().set_attribute("cache.misses", ",".join(misses))
+        if not misses:
+            return {version: archives[version] for version in versions}
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        # downloading is mostly waiting on the network, so threads are sufficient here
+        with ThreadPoolExecutor(
+            max_workers=max(1, self.downloader.parallel_downloads),
+            thread_name_prefix="download",
+        ) as executor:
+            futures = [
+                executor.submit(propagate_context(self._download), version, download)
+                for version, download in misses.items()
+            ]
+        # re-raises the first failed download, after all other downloads are done
+        for future in futures:
+            future.result()
+        with self.index.locked() as entries:
+            for version, download in misses.items():
+                # a concurrent invocation might have downloaded and stored the same version in the meantime
+                if not download.exists() and version in entries:
+                    archives[version] = self._blob_path(entries[version].digest)
+                    continue
+                entry = self._store(version, download)
+                entry.hits = 1
+                entries[version] = entry
+                archives[version] = self._blob_path(entry.digest)
+            self._evict(entries, self.max_size, self.eviction_policy, set(archives))
+        return {version: archives[version] for version in versions}
+
+    def get_source_trees(self, *versions: str) -> dict[str, Path]:
+        """Returns the paths to the extracted sources of all given Moodle versions. Each archive is only extracted once into a read-only "golden" tree, which is kept next to the archive; see clone_source_tree() to create a usable copy of it.
+
+        Args:
+            versions (tuple[str, ...]): the Moodle versions for which the extracted sources are needed
+
+        Raises:
+            InvalidMoodleVersionError: raised if a Moodle version does not exist
+
+        Returns:
+            dict[str, Path]: the given Moodle versions mapped to the root of their extracted sources
+        """
+        return {
+            version: self._extract(version, archive)
+            for version, archive in self.get_many(*versions).items()
+        }
+
+    def clone_source_tree(self, source_tree: Path, destination: Path) -> None:
+        """Creates a copy of an extracted Moodle source tree at the given destination, preferring reflinks and hard links over plain copies to save both time and disk space.
+
+        Args:
+            source_tree (Path): a tree returned by get_source_trees()
+            destination (Path): where the Moodle sources should be placed, must not exist yet
+        """
+        strategy = clone_tree(source_tree, destination, self.clone_strategies)
+        tracer().set_attribute("clone_strategy", strategy.value)
+        log().info(f"cloned moodle sources to {destination} via {strategy.value}")
+
+    def _extract(self, version: str, archive: Path) -> Path:
+        # trees are named by the checksum of their archive, just like the archives themselves
+        tree = self._tree_path(archive.name.removesuffix(_DEFAULT_ARCHIVE_EXT))
+        source_tree = tree / "moodle"
+        with tracer().span("cache.extract", version=version) as span, file_lock(
+            self._tree_lock(tree.name)
+        ):
+            span.set_attribute("cache", "hit" if source_tree.exists() else "miss")
+            if source_tree.exists():
+                return source_tree
+            log().info(f"extracting moodle {version} into the cache")
+            # extract next to the final location and rename it afterwards, so an interrupted extraction never leaves an incomplete tree behind
+            self.tree_dir.mkdir(parents=True, exist_ok=True)
+            tmp_tree = Path(
+                tempfile.mkdtemp(
+                    dir=self.tree_dir, prefix=f"{_EXTRACTING_PREFIX}{tree.name}-"
+                )
+            )
             try:
-                self.downloader.download(moodle_tar_name, archive_path)
+                shutil.unpack_archive(archive, tmp_tree)
+                # unpacking the archive will create a folder called "moodle-{ver}"
+                # rename the folder afterwards to ensure moodle sources are at the same location in every tree
+                shutil.move(tmp_tree / f"moodle-{version}", tmp_tree / "moodle")
+                # the tree might be shared via hard links, so nobody must be able to change it by accident
+                make_read_only(tmp_tree)
+                os.replace(tmp_tree, tree)
+            except BaseException:
+                shutil.rmtree(tmp_tree, ignore_errors=True)
+                raise
+        return source_tree
+
+    def stats(self) -> CacheStats:
+        entries = self.index.load()
+        return CacheStats(
+            entries=sorted(entries.values(), key=lambda e: e.last_access, reverse=True),
+            total_size=total_size(entries),
+            max_size=self.max_size,
+            eviction_policy=self.eviction_policy,
+        )
+
+    def prune(
+        self, max_size_mb: int | None = None, eviction_policy: str | None = None
+    ) -> CachePruneResult:
+        """Removes everything from the cache that is no longer of use: damaged archives, archives no version refers to anymore, left-over partial downloads and, lastly, archives that need to be evicted to fit the cache into the given size.
+
+        Args:
+            max_size_mb (int | None, optional): the size the cache should be shrunk to; 0 keeps all valid archives. Defaults to the configured maximum size.
+            eviction_policy (str | None, optional): the policy selecting which archives are evicted first. Defaults to the configured policy.
+
+        Returns:
+            CachePruneResult: the evicted versions and how many bytes have been freed
+        """
+        budget = self.max_size if max_size_mb is None else max_size_mb * 1024 * 1024
+        policy = EvictionPolicy(eviction_policy or self.eviction_policy)
+        result = CachePruneResult()
+        with self.index.locked() as entries:
+            for version, entry in list(entries.items()):
+                if not self._verify(entry):
+                    log().info(f"removing damaged archive of moodle {version}")
+                    entries.pop(version)
+                    result.evicted.append(version)
+            referenced = {self._blob_path(e.digest) for e in entries.values()}
+            leftovers = [
+                blob
+                for blob in self._iter_files(self.blob_dir)
+                if blob not in referenced
+            ] + list(self._iter_files(self.download_dir))
+            for leftover in leftovers:
+                result.freed_bytes += leftover.stat().st_size
+                leftover.unlink()
+            # extracted trees whose archive is gone, as well as interrupted extractions
+            digests = {e.digest for e in entries.values()}
+            if self.tree_dir.exists():
+                for tree in list(self.tree_dir.iterdir()):
+                    if not tree.is_dir() or tree.name in digests:
+                        continue
+                    # interrupted extractions are named after the tree they were extracting
+                    digest = tree.name.removeprefix(_EXTRACTING_PREFIX).split("-")[0]
+                    # an extraction holds the lock of it's tree, so it's only removed once nobody extracts it anymore
+                    with file_lock(self._tree_lock(digest)):
+                        shutil.rmtree(tree, ignore_errors=True)
+            evicted = self._evict(entries, budget, policy, set())
+            result.evicted += [entry.version for entry in evicted]
+            result.freed_bytes += total_size({e.version: e for e in evicted})
+        return result
+
+    @traced(
+        "cache.download",
+        attributes=lambda self, version, download: {"version": version},
+    )
+    def _download(self, version: str, download: Path) -> None:
+        from requests.exceptions import HTTPError
+
+        # only one invocation may write to the same partial download at a time
+        with file_lock(download.with_name(f"{download.name}.lock")):
+            if version in self.index.load() and not download.exists():
+                return
+            try:
+                self.downloader.download(download.name, download)
             except HTTPError as e:
                 if e.response.status_code == HTTPStatus.NOT_FOUND:
                     raise InvalidMoodleVersionError(version)
-        # else, just return the path to the source of the selected moodle
-        # version, as we have the file on disk; effectively hitting our 'cache'
+                raise e
+
+    def _store(self, version: str, archive: Path) -> CacheEntry:
+        """Moves the given archive to it's content-addressed location and returns a new index entry for it.
+
+        Args:
+            version (str): the Moodle version of the archive
+            archive (Path): the complete archive, will be moved
+
+        Returns:
+            CacheEntry: the index entry for said archive
+        """
+        digest = sha256_of_file(archive)
+        blob = self._blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if (
+            blob.exists()
+            and blob.stat().st_size == archive.stat().st_size
+            and (sha256_of_file(blob) == digest)
+        ):
+            # same content is already cached under another version
+            archive.unlink()
         else:
-            log().info(f"cache hit - getting moodle {version} from disk")
-        return archive_path
+            # a damaged archive stored at this path is replaced by the intact one
+            os.replace(archive, blob)
+        stat = blob.stat()
+        return CacheEntry(
+            version=version,
+            digest=digest,
+            size=stat.st_size,
+            verified_mtime=stat.st_mtime,
+        )
+
+    def _adopt_legacy_archive(self, version: str) -> CacheEntry | None:
+        # archives downloaded before the cache has been indexed are stored next to the index, named after their version
+        legacy_archive = self.directory / _generate_archive_file_name(version)
+        if not legacy_archive.exists():
+            return None
+        log().info(f"adding previously downloaded moodle {version} to the cache index")
+        return self._store(version, legacy_archive)
+
+    def _verify(self, entry: CacheEntry) -> bool:
+        blob = self._blob_path(entry.digest)
+        if not blob.exists():
+            return False
+        stat = blob.stat()
+        if stat.st_size != entry.size:
+            return False
+        if (
+            self.verification == VerificationMode.LAZY
+            and stat.st_mtime == entry.verified_mtime
+        ):
+            return True
+        if sha256_of_file(blob) != entry.digest:
+            return False
+        entry.verified_mtime = stat.st_mtime
+        return True
+
+    def _evict(
+        self,
+        entries: dict[str, CacheEntry],
+        budget: int,
+        policy: EvictionPolicy,
+        protected: set[str],
+    ) -> list[CacheEntry]:
+        """Removes entries and their archives from the cache until the cache fits into the given budget.
+
+        Args:
+            entries (dict[str, CacheEntry]): the loaded index, will be modified
+            budget (int): the size in bytes the cache should fit in; 0 means unbounded
+            policy (EvictionPolicy): the policy selecting which archives are evicted first
+            protected (set[str]): versions that must not be evicted, e.g. because they are about to be used
+
+        Returns:
+            list[CacheEntry]: the evicted entries
+        """
+        evicted: list[CacheEntry] = []
+        if budget <= 0:
+            return evicted
+        candidates = sorted(
+            (e for e in entries.values() if e.version not in protected),
+            key=lambda e: e.eviction_key(policy),
+        )
+        while total_size(entries) > budget and candidates:
+            entry = candidates.pop(0)
+            entries.pop(entry.version)
+            evicted.append(entry)
+            # several versions may share the same archive
+            if all(e.digest != entry.digest for e in entries.values()):
+                self._remove_archive(entry.digest)
+            log().info(f"evicted moodle {entry.version} from the cache")
+        return evicted
+
+    def _remove_archive(self, digest: str) -> None:
+        # the archive and the tree extracted from it
+        self._blob_path(digest).unlink(missing_ok=True)
+        shutil.rmtree(self._tree_path(digest), ignore_errors=True)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / f"{digest}{_DEFAULT_ARCHIVE_EXT}"
+
+    def _tree_path(self, digest: str) -> Path:
+        return self.tree_dir / digest
+
+    def _tree_lock(self, digest: str) -> Path:
+        return self.tree_dir / f"{digest}.lock"
+
+    def _iter_files(self, directory: Path) -> Iterator[Path]:
+        if directory.exists():
+            yield from (f for f in directory.iterdir() if f.is_file())
 
 
 _DEFAULT_ARCHIVE_EXT = ".tar.gz"
+_EXTRACTING_PREFIX = ".extracting-"
 
 
 def _generate_archive_file_name(version: str) -> str:
@@ -77,11 +487,15 @@ def _generate_archive_file_name(version: str) -> str:
     return f"{version}{_DEFAULT_ARCHIVE_EXT}"
 
 
+def _partial_file(destination: Path) -> Path:
+    return destination.with_name(f"{destination.name}.part")
+
+
 def moodle_cache() -> MoodleCache:
     # hacky, but hides implementation detail about the singleton and allows us
     # to avoid the circular dependency issues if each import is directly
     # embedded into the services
-    from ..app import Application
+    from ..app import application
 
     # sometimes mypy is just a funny thing.
-    return cast(MoodleCache, Application().domain.moodle_cache())
+    return cast(MoodleCache, application().domain.moodle_cache())
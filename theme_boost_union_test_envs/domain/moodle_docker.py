@@ -0,0 +1,102 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+
+from ..cross_cutting import file_lock, log, make_read_only
+
+# files every test environment renders or changes for itself, so they are copied instead of shared
+MATERIALIZED_FILES = [".env", "local.yml"]
+# moodle-docker's scripts find the compose files relative to their own location, so they need to live inside the test environment
+MATERIALIZED_DIRS = ["bin"]
+# never needed by docker compose
+EXCLUDED = [".git"]
+
+
+class MoodleDockerTrees:
+    """Keeps immutable copies of our moodle-docker checkout, which all test environments share instead of copying the whole checkout into each of them.
+    A test environment is an overlay on top of such a tree: it only holds real copies of the files it renders for itself and the scripts, everything else is a symlink into the shared tree. As soon as the checkout changes, e.g. after it has been updated, new test environments get a new tree while the existing ones keep the tree they have been built with.
+
+    Args:
+        checkout (Path): the moodle-docker checkout of our testbed
+        directory (Path): where the shared trees are kept
+    """
+
+    def __init__(self, checkout: Path, directory: Path) -> None:
+        self.checkout = checkout
+        self.directory = directory
+
+    def overlay(self, destination: Path) -> Path:
+        """Populates the given test environment with the files of moodle-docker, as symlinks into the shared tree of the current checkout.
+
+        Args:
+            destination (Path): directory of the test environment, created if it does not exist yet
+
+        Returns:
+            Path: the shared tree the test environment refers to
+        """
+        tree = self.current_tree()
+        destination.mkdir(parents=True, exist_ok=True)
+        for entry in tree.iterdir():
+            target = destination / entry.name
+            if entry.name in MATERIALIZED_FILES:
+                shutil.copyfile(entry, target)
+                _make_writable(target)
+            elif entry.name in MATERIALIZED_DIRS:
+                shutil.copytree(entry, target, dirs_exist_ok=True)
+                for root, _, files in os.walk(target):
+                    for file in files:
+                        _make_writable(Path(root) / file)
+            elif not target.exists():
+                target.symlink_to(entry, target_is_directory=entry.is_dir())
+        log().info(f"linked moodle-docker files of {tree.name} into {destination}")
+        return tree
+
+    def current_tree(self) -> Path:
+        """Returns the shared tree of the current checkout, creating it if it does not exist yet.
+
+        Returns:
+            Path: root of the shared tree
+        """
+        tree = self.directory / self._fingerprint()
+        if tree.exists():
+            return tree
+        # parallel builds must not create the same tree twice
+        with file_lock(tree.with_name(f"{tree.name}.lock")):
+            if tree.exists():
+                return tree
+            log().info(f"creating shared moodle-docker tree {tree.name}")
+            tmp_tree = Path(tempfile.mkdtemp(dir=self.directory, prefix=".creating-"))
+            try:
+                shutil.copytree(
+                    self.checkout,
+                    tmp_tree,
+                    ignore=shutil.ignore_patterns(*EXCLUDED),
+                    dirs_exist_ok=True,
+                )
+                # nobody must change the tree by accident, it's shared by all test environments built from it
+                make_read_only(tmp_tree)
+                os.replace(tmp_tree, tree)
+            except BaseException:
+                shutil.rmtree(tmp_tree, ignore_errors=True)
+                raise
+        return tree
+
+    def _fingerprint(self) -> str:
+        # names, sizes and modification times are enough to notice an updated checkout, without reading every file on each build
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(self.checkout):
+            dirs[:] = sorted(d for d in dirs if d not in EXCLUDED)
+            for file in sorted(files):
+                path = Path(root) / file
+                stats = path.lstat()
+                digest.update(
+                    f"{path.relative_to(self.checkout)}:{stats.st_size}:{stats.st_mtime_ns}\n".encode()
+                )
+        return digest.hexdigest()[:16]
+
+
+def _make_writable(path: Path) -> None:
+    path.chmod(path.stat().st_mode | stat.S_IWUSR)
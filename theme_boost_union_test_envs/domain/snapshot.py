@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import cast
+
+from ..cross_cutting import config, file_lock, log, sha256_of_file
+
+
+@dataclass
+class DatabaseSnapshot:
+    """The state of a freshly installed Moodle site with generated test data: a dump of it's Postgres database and an archive of it's moodledata directory."""
+
+    directory: Path
+
+    @property
+    def database(self) -> Path:
+        # pg_dump's custom format, restored by pg_restore
+        return self.directory / "database.dump"
+
+    @property
+    def moodledata(self) -> Path:
+        return self.directory / "moodledata.tar.gz"
+
+
+class DatabaseSnapshotStore:
+    """Keeps a snapshot of the first Moodle site that has been installed and seeded for each Moodle version and data generator. New test environments of the same version are seeded from it instead of running the installation and the data generator again, which takes minutes.
+
+    Args:
+        enabled (bool, optional): whether snapshots are captured and used at all. Defaults to True.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.directory = config().working_dir / ".snapshots"
+        self.enabled = enabled
+
+    def find(self, version: str, generator: Path) -> DatabaseSnapshot | None:
+        """Returns the snapshot for the given Moodle version and data generator, if one has been captured.
+
+        Args:
+            version (str): the Moodle version
+            generator (Path): the script generating the test data, e.g. smartdata.php
+
+        Returns:
+            DatabaseSnapshot | None: the snapshot, or None if none exists (yet) or snapshots are disabled
+        """
+        if not self.enabled:
+            return None
+        snapshot = DatabaseSnapshot(self._snapshot_dir(version, generator))
+        return snapshot if snapshot.directory.exists() else None
+
+    @contextmanager
+    def capture(
+        self, version: str, generator: Path
+    ) -> Iterator[DatabaseSnapshot | None]:
+        """Yields an empty snapshot inside a temporary directory, which should be filled inside the with-block. Once the with-block succeeded, the snapshot is published for the given Moodle version and data generator; if it failed, the snapshot is discarded.
+
+        Args:
+            version (str): the Moodle version
+            generator (Path): the script that generated the test data, e.g. smartdata.php
+
+        Yields:
+            Iterator[DatabaseSnapshot | None]: the snapshot to fill, or None if there is nothing to capture because a snapshot exists already or snapshots are disabled
+        """
+        if not self.enabled:
+            yield None
+            return
+        destination = self._snapshot_dir(version, generator)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # environments of the same version started in parallel must not capture the same snapshot twice
+        with file_lock(destination.with_name(f"{destination.name}.lock")):
+            if destination.exists():
+                yield None
+                return
+            tmp = Path(tempfile.mkdtemp(dir=self.directory, prefix=".capture-"))
+            try:
+                yield DatabaseSnapshot(tmp)
+                tmp.rename(destination)
+                log().info(f"captured database snapshot {destination.name}")
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def _snapshot_dir(self, version: str, generator: Path) -> Path:
+        # a changed data generator generates different data, so it needs a new snapshot
+        return self.directory / f"{version}-{sha256_of_file(generator)[:16]}"
+
+
+def database_snapshots() -> DatabaseSnapshotStore:
+    # hacky, but hides implementation detail about the singleton and allows us
+    # to avoid the circular dependency issues if each import is directly
+    # embedded into the services
+    from ..app import application
+
+    # sometimes mypy is just a funny thing.
+    return cast(DatabaseSnapshotStore, application().domain.database_snapshots())
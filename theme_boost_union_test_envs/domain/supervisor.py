@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import html
+import threading
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from ..cross_cutting import log
+
+# only the 'supervise' command serves anything, all other commands should not pay for importing the http server
+if TYPE_CHECKING:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# infrastructure name and Moodle version of a test environment
+Environment = tuple[str, str]
+
+_WAKE_PAGE = """<html>
+<head>
+<title>Starting {environment}</title>
+<meta http-equiv="refresh" content="{retry_after}">
+</head>
+<body>
+<h1>The test environment {environment} is starting</h1>
+<p>It has been stopped as nobody used it for a while. This page reloads itself as soon as it should be available again.</p>
+</body>
+</html>
+"""
+
+
+class Supervisor:
+    """Stops started Moodle test environments once nobody used them for a while and starts them again on their next request, so only the environments actually in use occupy memory.
+    Usage is measured by the access log nginx writes for each environment: as long as it has been written to within the idle timeout, the environment is in use. Requests for a stopped environment cannot reach Moodle, so nginx forwards them to the wake endpoint served by this supervisor, which starts the environment again and tells the browser to retry.
+
+    Args:
+        started_environments (Callable[[], Iterable[Environment]]): returns all currently started environments
+        access_log (Callable[[str, str], Path]): returns the access log nginx writes for an environment
+        stop (Callable[[str, str], None]): stops an environment
+        wake (Callable[[str, str], None]): starts a stopped environment again
+        idle_timeout (float): seconds without any request after which an environment is stopped
+        retry_after (int, optional): seconds after which a browser waiting for a waking environment should retry. Defaults to 10.
+    """
+
+    def __init__(
+        self,
+        started_environments: Callable[[], Iterable[Environment]],
+        access_log: Callable[[str, str], Path],
+        stop: Callable[[str, str], None],
+        wake: Callable[[str, str], None],
+        idle_timeout: float,
+        retry_after: int = 10,
+    ) -> None:
+        self.started_environments = started_environments
+        self.access_log = access_log
+        self.stop = stop
+        self.wake = wake
+        self.idle_timeout = idle_timeout
+        self.retry_after = retry_after
+        # when we noticed an environment or woke it up, for environments that have not been requested since
+        self._last_seen: dict[Environment, float] = {}
+        self._waking: set[Environment] = set()
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        port: int,
+        check_interval: float,
+        stop_event: threading.Event | None = None,
+    ) -> None:
+        """Serves the wake endpoint on localhost and checks for idle environments every check_interval seconds, until the stop event is set or the process is interrupted.
+
+        Args:
+            port (int): port of the wake endpoint
+            check_interval (float): seconds between two checks for idle environments
+            stop_event (threading.Event | None, optional): stops the supervisor once set. Defaults to None.
+        """
+        server = self.serve(port)
+        stop_event = stop_event or threading.Event()
+        try:
+            while not stop_event.is_set():
+                self.stop_idle_environments()
+                stop_event.wait(check_interval)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """Serves the wake endpoint on localhost in a background thread.
+
+        Args:
+            port (int): port of the wake endpoint, 0 to let the OS choose a free one
+
+        Returns:
+            ThreadingHTTPServer: the running server, which needs to be shut down by the caller
+        """
+        from http.server import ThreadingHTTPServer
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), self._wake_handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log().info(
+            f"serving wake endpoint @ http://127.0.0.1:{server.server_address[1]}"
+        )
+        return server
+
+    def stop_idle_environments(self, now: float | None = None) -> list[Environment]:
+        """Stops every started environment that has not been requested within the idle timeout.
+
+        Args:
+            now (float | None, optional): the current time as timestamp. Defaults to the actual current time.
+
+        Returns:
+            list[Environment]: the environments that have been stopped
+        """
+        now = time.time() if now is None else now
+        started = set(self.started_environments())
+        with self._lock:
+            # forget environments that have been stopped or destroyed by someone else
+            self._last_seen = {
+                env: seen for env, seen in self._last_seen.items() if env in started
+            }
+            for env in started:
+                # environments without any request get the whole idle timeout, starting from the moment we noticed them
+                self._last_seen.setdefault(env, now)
+            candidates = [
+                (env, self._last_seen[env])
+                for env in sorted(started)
+                if env not in self._waking
+            ]
+        stopped = []
+        for env, last_seen in candidates:
+            access_log = self.access_log(*env)
+            if access_log.exists():
+                last_seen = max(last_seen, access_log.stat().st_mtime)
+            if now - last_seen < self.idle_timeout:
+                continue
+            log().info(
+                f"stopping {env[0]}/{env[1]}, it has been idle for {(now - last_seen) / 60:.0f} minutes"
+            )
+            try:
+                self.stop(*env)
+            except Exception as e:
+                log().error(f"could not stop {env[0]}/{env[1]}: {e}")
+                continue
+            stopped.append(env)
+        return stopped
+
+    def request_wake(self, infrastructure_name: str, version: str) -> bool:
+        """Starts the given environment again in the background, unless it is being started already.
+
+        Args:
+            infrastructure_name (str): the infrastructure of the environment
+            version (str): the Moodle version of the environment
+
+        Returns:
+            bool: whether the environment is started due to this request
+        """
+        env = (infrastructure_name, version)
+        with self._lock:
+            if env in self._waking:
+                return False
+            self._waking.add(env)
+        threading.Thread(target=self._wake, args=(env,), daemon=True).start()
+        return True
+
+    def _wake(self, env: Environment) -> None:
+        log().info(f"waking {env[0]}/{env[1]} up")
+        try:
+            self.wake(*env)
+        except Exception as e:
+            log().error(f"could not wake {env[0]}/{env[1]} up: {e}")
+        finally:
+            with self._lock:
+                self._waking.discard(env)
+                # the woken environment gets the whole idle timeout, even if the browser gave up in the meantime
+                self._last_seen[env] = time.time()
+
+    def _wake_handler(self) -> type[BaseHTTPRequestHandler]:
+        from http.server import BaseHTTPRequestHandler
+
+        supervisor = self
+
+        class WakeHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                infrastructure_name, _, version = self.headers.get(
+                    "X-Test-Environment", ""
+                ).partition("/")
+                if not infrastructure_name or not version:
+                    self.send_error(400, "No test environment given")
+                    return
+                supervisor.request_wake(infrastructure_name, version)
+                body = _WAKE_PAGE.format(
+                    environment=html.escape(f"{infrastructure_name}/{version}"),
+                    retry_after=supervisor.retry_after,
+                ).encode()
+                self.send_response(503)
+                self.send_header("Retry-After", str(supervisor.retry_after))
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+                # the body of e.g. a POST is not read, so the connection cannot be reused
+                self.close_connection = True
+
+            do_HEAD = do_GET
+            do_POST = do_GET
+
+            def log_message(self, format: str, *args: Any) -> None:
+                log().debug(format % args)
+
+        return WakeHandler
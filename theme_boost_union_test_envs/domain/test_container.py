@@ -1,11 +1,53 @@
-import shutil
+import shlex
 import subprocess
+import uuid
+from contextlib import ExitStack
+from dataclasses import dataclass
 from functools import wraps
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, Callable, cast
 
-from ..cross_cutting import config, log, template_engine
-from ..exceptions import MoodleTestEnvironmentDoesNotExistYetError
+from ..cross_cutting import (
+    AttributeValue,
+    EnvironmentFile,
+    config,
+    load_env_file,
+    log,
+    template_engine,
+    traced,
+    tracer,
+    trash,
+)
+from ..exceptions import (
+    ContainerCommandFailedError,
+    MoodleTestEnvironmentDoesNotExistYetError,
+    PhpSessionAbortedError,
+)
+from .inventory import inventory
+from .lifecycle import LifecycleCheckpoint, LifecycleStep
+from .snapshot import DatabaseSnapshot, database_snapshots
+
+# where moodle-docker mounts the Moodle sources and the data directory inside the webserver container
+WEBSERVER_MOODLE_DIR = "/var/www/html"
+WEBSERVER_MOODLEDATA_DIR = "/var/www/moodledata"
+
+
+@dataclass
+class PhpScriptResult:
+    script: str
+    # None if the script has not been run, as an earlier script of the same session failed
+    returncode: int | None
+    # stdout and stderr of the script
+    output: str = ""
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0
+
+
+def _span_attributes(container: "TestContainer") -> dict[str, AttributeValue]:
+    # defined before the class, as the decorators of it's methods need it
+    return {"infrastructure": container.infrastructure, "version": container.version}
 
 
 class TestContainer:
@@ -36,27 +78,37 @@ class TestContainer:
 
         @wraps(func)
         def wrapper(self) -> Any:  # type: ignore
-            if not self.path.exists():
+            if self.path.parent.parent.parent == inventory().working_dir:
+                # the usual case, a test environment inside our testbed
+                exists = inventory().has_environment(self.infrastructure, self.version)
+            else:
+                exists = self.path.exists()
+            if not exists:
                 raise MoodleTestEnvironmentDoesNotExistYetError(self.path.name)
             retval = func(self)
             return retval
 
         return wrapper
 
+    @traced("container.create", attributes=_span_attributes)
     def create(self) -> None:
         """Spawns a sub-shell to call 'docker-compose create' on this container.
         This makes sure the containers are functional.
         Might be more modern to call "up --no-start".
         """
         self._run_docker_command("create")
+        self.lifecycle().mark(LifecycleStep.CREATED)
 
+    @traced("container.start", attributes=_span_attributes)
     @check_path_existence
     def start(self) -> None:
         """Spawns a sub-shell to call 'docker-compose up -d' on this container.
         This starts the container. Furthermore, this function will call a script to wait until the DB has started, to make sure the services can be used properly when this function has executed successfully.
         """
-        self._run_docker_command("up -d && bin/moodle-docker-wait-for-db")
-        self._configure_manual_testing()
+        with tracer().span("container.up"):
+            self._run_docker_command("up -d && bin/moodle-docker-wait-for-db")
+        with tracer().span("container.configure"):
+            self._configure_manual_testing()
         host, port, pw, _ = self.get_access_info()
         log().info("Please access the created Moodle container here:")
         if config().is_proxied:
@@ -67,6 +119,15 @@ class TestContainer:
             )
         log().info(f"Login as admin with pw: {pw}")
 
+    @traced("container.wake", attributes=_span_attributes)
+    @check_path_existence
+    def wake(self) -> None:
+        """Spawns a sub-shell to call 'docker-compose up -d' on this previously stopped container.
+        In contrast to start, Moodle is expected to be configured already, so the container is usable as soon as the DB has started.
+        """
+        self._run_docker_command("up -d && bin/moodle-docker-wait-for-db")
+
+    @traced("container.restart", attributes=_span_attributes)
     @check_path_existence
     def restart(self) -> None:
         """Spawns a sub-shell to call 'docker-compose restart' on this container.
@@ -74,6 +135,7 @@ class TestContainer:
         """
         self._run_docker_command("restart")
 
+    @traced("container.stop", attributes=_span_attributes)
     @check_path_existence
     def stop(self) -> None:
         """Spawns a sub-shell to call 'docker-compose stop' on this container.
@@ -81,10 +143,20 @@ class TestContainer:
         """
         self._run_docker_command("stop")
 
+    @traced("container.destroy", attributes=_span_attributes)
     @check_path_existence
     def destroy(self) -> None:
         """Spawns a sub-shell to call 'docker-compose down' on this container.
-        This optionally stops and then removes the container.
+        This optionally stops and then removes the container. It's files are deleted in the background afterwards.
+        """
+        self.take_down()
+        trash().discard(self.path)
+
+    @traced("container.take_down", attributes=_span_attributes)
+    @check_path_existence
+    def take_down(self) -> None:
+        """Spawns a sub-shell to call 'docker-compose down' on this container and removes everything nginx knows about it, but leaves it's files in place.
+        Used if the files are deleted together with others, e.g. during the teardown of the whole infrastructure.
         """
         self._run_docker_command("down")
         nginx_conf = template_engine().create_moodle_nginx_conf_path(
@@ -95,8 +167,9 @@ class TestContainer:
         )
         if nginx_conf.exists():
             nginx_conf.unlink()
-        if self.path.exists():
-            shutil.rmtree(self.path)
+        template_engine().create_moodle_access_log_path(
+            self.infrastructure, self.version
+        ).unlink(missing_ok=True)
 
     @check_path_existence
     def get_access_info(self) -> tuple[str, str, str, str]:
@@ -105,68 +178,290 @@ class TestContainer:
         Returns:
             tuple[str, str, str]: host, port and admin's PW in a tuple.
         """
-        www_host = self._extract_from_env("MOODLE_DOCKER_WEB_HOST")
-        www_port = self._extract_from_env("MOODLE_DOCKER_WEB_PORT")
-        admin_password = self._extract_from_env("MOODLE_ADMIN_PASSWORD")
-        db_port = self._extract_from_env("MOODLE_DOCKER_DB_PORT")
+        env = self.environment()
+        www_host = env.get("MOODLE_DOCKER_WEB_HOST")
+        www_port = env.get("MOODLE_DOCKER_WEB_PORT")
+        admin_password = env.get("MOODLE_ADMIN_PASSWORD")
+        db_port = env.get("MOODLE_DOCKER_DB_PORT")
         return (www_host, www_port, admin_password, db_port)
 
+    def environment(self) -> EnvironmentFile:
+        """Returns the variables of this container's environment file. The file is parsed natively and only once as long as it is not modified, instead of spawning a sub-shell to source it for every variable.
+
+        Returns:
+            EnvironmentFile: the variables of the environment file
+        """
+        return load_env_file(self.path / ".env")
+
+    def _is_installed(self) -> bool:
+        # an empty database has no tables at all, regardless of the table prefix Moodle is configured with
+        result = self._run_docker_command(
+            "exec -T db psql -U moodle -d moodle -tAc \"SELECT count(*) FROM information_schema.tables WHERE table_schema = 'public'\""
+        )
+        lines = result.stdout.strip().splitlines()
+        return bool(lines) and lines[-1].strip() != "0"
+
+    def _capture_snapshot(self, snapshot: DatabaseSnapshot) -> None:
+        self._stream_docker_command(
+            "exec -T db pg_dump -U moodle -Fc moodle", stdout=snapshot.database
+        )
+        # caches and sessions are specific to the captured site and would only be purged after restoring anyways
+        excludes = " ".join(
+            f"--exclude=./{d}"
+            for d in ("cache", "localcache", "sessions", "temp", "trashdir", "lock")
+        )
+        self._stream_docker_command(
+            f"exec -T webserver tar -C {WEBSERVER_MOODLEDATA_DIR} {excludes} -czf - .",
+            stdout=snapshot.moodledata,
+        )
+
+    def _restore_snapshot(self, snapshot: DatabaseSnapshot) -> None:
+        self._stream_docker_command(
+            "exec -T db pg_restore -U moodle -d moodle --no-owner --no-privileges",
+            stdin=snapshot.database,
+        )
+        self._stream_docker_command(
+            f"exec -T webserver tar -C {WEBSERVER_MOODLEDATA_DIR} -xzf -",
+            stdin=snapshot.moodledata,
+        )
+        self._run_docker_command(
+            f"exec -T webserver chown -R www-data:www-data {WEBSERVER_MOODLEDATA_DIR}"
+        )
+        # snapshots are shared by all infrastructures, so the captured site might run an older commit of Boost Union or Moodle than this one
+        (upgrade,) = self._run_local_php_scripts(
+            [("admin/cli/upgrade.php", "--non-interactive")]
+        )
+        if upgrade.returncode:
+            log().error(
+                f"'{upgrade.script}' exited with {upgrade.returncode}:\n{upgrade.output}"
+            )
+            raise ContainerCommandFailedError(
+                f"php {upgrade.script}", upgrade.returncode
+            )
+        # the snapshot still carries the name and admin password of the environment it has been captured from
+        name = _php_string(f"{self.infrastructure} - {self.version}")
+        password = _php_string(self.environment().get("MOODLE_ADMIN_PASSWORD"))
+        self._run_local_php_code(
+            "define('CLI_SCRIPT', true);"
+            f"require('{WEBSERVER_MOODLE_DIR}/config.php');"
+            f"$DB->update_record('course', (object) ['id' => SITEID, 'fullname' => {name}, 'shortname' => {name}, 'summary' => {name}]);"
+            f"update_internal_user_password($DB->get_record('user', ['username' => 'admin']), {password});"
+            "purge_all_caches();"
+        )
+
+    def lifecycle(self) -> LifecycleCheckpoint:
+        """Returns the checkpoint of this container, which tracks the completed steps of it's lifecycle.
+
+        Returns:
+            LifecycleCheckpoint: the checkpoint of this container
+        """
+        return LifecycleCheckpoint(self.path / ".lifecycle.yml")
+
     def _configure_manual_testing(self) -> None:
+        """Installs Moodle, activates Boost Union and generates test data; each of these steps only once during the lifetime of this container, so starting it again or resuming an interrupted start does not repeat a completed step.
+        If a database snapshot exists for this Moodle version and data generator, a new site is seeded from it instead and upgraded to the code of this container, which takes seconds instead of minutes. Otherwise, a snapshot is captured once the test data has been generated for the next test environment of this version.
+        """
+        checkpoint = self.lifecycle()
+        if not checkpoint.is_done(LifecycleStep.DB_INSTALLED) and self._is_installed():
+            if not checkpoint.exists():
+                # environments created before checkpoints were kept have been configured completely on their first start
+                checkpoint.mark(*LifecycleStep)
+            else:
+                # the last start has been interrupted right after the installation
+                checkpoint.mark(LifecycleStep.DB_INSTALLED)
+        generator = self.path / "moodle" / "smartdata.php"
+        if not checkpoint.is_done(LifecycleStep.DB_INSTALLED):
+            snapshot = database_snapshots().find(self.version, generator)
+            if snapshot is not None:
+                log().info(
+                    f"seeding Moodle from database snapshot {snapshot.directory.name}"
+                )
+                with tracer().span("container.restore_snapshot"):
+                    self._restore_snapshot(snapshot)
+                checkpoint.mark(
+                    LifecycleStep.DB_INSTALLED,
+                    LifecycleStep.THEME_SET,
+                    LifecycleStep.DATA_SEEDED,
+                )
         admin_email = "admin@example.com"
+        admin_password = self.environment().get("MOODLE_ADMIN_PASSWORD")
         # we do not actual care about concrete names here, so let's make it all the same; var naming is just kept for parity with CLI interface
         short_name = f"{self.infrastructure} - {self.version}"
         full_name = short_name
         summary = short_name
-        # create the correct tables on the database server
-        self._run_local_php_script(
-            "admin/cli/install_database.php",
-            f'--agree-license --fullname="{full_name}" --shortname="{short_name}" --summary="{summary}" --adminpass=$MOODLE_ADMIN_PASSWORD --adminemail="{admin_email}"',
-        )
-        # activate "Boost Union" theme
-        self._run_local_php_script(
-            "admin/cli/cfg.php",
-            "--name=theme --set=boost_union",
-        )
-        # add some test data
-        self._run_local_php_script("smartdata.php", "")
+        steps = [
+            # create the correct tables on the database server
+            (
+                LifecycleStep.DB_INSTALLED,
+                "admin/cli/install_database.php",
+                f'--agree-license --fullname="{full_name}" --shortname="{short_name}" --summary="{summary}" --adminpass={shlex.quote(admin_password)} --adminemail="{admin_email}"',
+            ),
+            # activate "Boost Union" theme
+            (
+                LifecycleStep.THEME_SET,
+                "admin/cli/cfg.php",
+                "--name=theme --set=boost_union",
+            ),
+            # add some test data
+            (LifecycleStep.DATA_SEEDED, "smartdata.php", ""),
+        ]
+        pending = []
+        for step, script, args in steps:
+            if checkpoint.is_done(step):
+                log().info(f"skipping {step.value}, it has been completed already")
+            else:
+                pending.append((step, script, args))
+        if not pending:
+            return
+        # all pending steps share one exec session, instead of paying for the shell and docker compose once per script
+        with tracer().span(
+            "container.run_php_scripts",
+            steps=",".join(step.value for step, _, _ in pending),
+        ):
+            results = self._run_local_php_scripts(
+                [(script, args) for _, script, args in pending]
+            )
+        for (step, _, _), result in zip(pending, results):
+            # only the scripts after a failed one have no exit code, aborted sessions raised already
+            if result.returncode:
+                log().error(
+                    f"'{result.script}' exited with {result.returncode}, {step.value} has not been completed"
+                )
+                raise ContainerCommandFailedError(
+                    f"php {result.script}", result.returncode
+                )
+            checkpoint.mark(step)
+        if pending[-1][0] == LifecycleStep.DATA_SEEDED:
+            self._capture_snapshot_once(generator)
+
+    def _capture_snapshot_once(self, generator: Path) -> None:
+        try:
+            with database_snapshots().capture(self.version, generator) as new_snapshot:
+                if new_snapshot is not None:
+                    with tracer().span("container.capture_snapshot"):
+                        self._capture_snapshot(new_snapshot)
+        except ContainerCommandFailedError:
+            # the environment itself is fine, the next one of this version will simply be installed from scratch again
+            log().warning("could not capture a database snapshot of this environment")
 
-    def _extract_from_env(self, var_name: str) -> str:
-        """Extracts the value of the given variable name from the container's environment file.
-        Might be slower due to it's implementation, as we spawn a sub-shell, source the .env and then echo the exported variables. It was the easiest way, and the "slowness" of this implemenation shouldn't matter.
+    def _run_local_php_scripts(
+        self, scripts: list[tuple[str, str]]
+    ) -> list[PhpScriptResult]:
+        """Runs several PHP scripts local to the webserver container, where Moodle is installed, one after another in a single exec session. The scripts are run until the first one fails, as the later ones usually rely on it.
 
         Args:
-            var_name (str): name of the variable for which the value should be extracted
+            scripts (list[tuple[str, str]]): path and file name of each script that is to be run, together with the arguments that should be passed to it.
+
+        Raises:
+            ContainerCommandFailedError: raised if the exec session itself failed
+            PhpSessionAbortedError: raised if the session ended before a script reported it's exit code, although no script before it failed
 
         Returns:
-            str: extracted value
+            list[PhpScriptResult]: the result of each script, in the given order
         """
-        return subprocess.run(
-            [f". ./.env && echo ${var_name}"],
-            cwd=self.path,
-            shell=True,
-            capture_output=True,
-            text=True,
-        ).stdout.strip()
+        # the marker separates the output of the scripts and carries their exit code
+        marker = f"--- php script finished {uuid.uuid4().hex}"
+        # the session itself is read from stdin, a script reading from it would swallow the scripts after it
+        session = "".join(
+            f'php {script} {args} </dev/null 2>&1; rc=$?; echo "{marker} $rc"; [ "$rc" -eq 0 ] || exit 0\n'
+            for script, args in scripts
+        )
+        result = self._run_docker_command("exec -T webserver sh -s", input=session)
+        outputs: list[str] = []
+        returncodes: list[int] = []
+        lines: list[str] = []
+        for line in result.stdout.splitlines():
+            if line.startswith(marker):
+                returncodes.append(int(line[len(marker) :]))
+                outputs.append("\n".join(lines))
+                lines = []
+            else:
+                lines.append(line)
+        if len(returncodes) < len(scripts) and all(rc == 0 for rc in returncodes):
+            script = scripts[len(returncodes)][0]
+            log().error(
+                f"the session ended before '{script}' finished:\n" + "\n".join(lines)
+            )
+            raise PhpSessionAbortedError(script)
+        return [
+            PhpScriptResult(
+                script,
+                returncodes[i] if i < len(returncodes) else None,
+                outputs[i] if i < len(outputs) else "",
+            )
+            for i, (script, _) in enumerate(scripts)
+        ]
+
+    def _run_local_php_code(self, code: str) -> None:
+        """Runs the given PHP code inside the webserver container, where Moodle is installed.
+
+        Args:
+            code (str): PHP code, without the opening tag
+        """
+        self._run_docker_command(f"exec -T webserver php -r {shlex.quote(code)}")
 
-    def _run_local_php_script(self, script: str, args: str) -> None:
-        """Runs a PHP script local to the webserver container, where Moodle is installed.
+    def _stream_docker_command(
+        self, action: str, stdin: Path | None = None, stdout: Path | None = None
+    ) -> None:
+        """Runs a docker compose command like _run_docker_command, but streams it's input from and it's output into the given files, e.g. for database dumps.
 
         Args:
-            script (str): path and file name of the script that is to be run.
-            args (str): arguments that should be passed to the script.
+            action (str): a docker compose command that should be sent to the containers
+            stdin (Path | None, optional): file the command reads from. Defaults to None.
+            stdout (Path | None, optional): file the output of the command is written to. Defaults to None.
+
+        Raises:
+            ContainerCommandFailedError: raised if the command exited with a non-zero exit code
         """
-        self._run_docker_command(f"exec webserver php {script} {args}")
+        command = self._build_command(action)
+        log().info(f"executing {command}")
+        with ExitStack() as stack:
+            result = subprocess.run(
+                [command],
+                cwd=self.path,
+                shell=True,
+                stdin=stack.enter_context(stdin.open("rb"))
+                if stdin
+                else subprocess.DEVNULL,
+                stdout=stack.enter_context(stdout.open("wb"))
+                if stdout
+                else subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+        _log_output(action, result.returncode, result.stderr.decode(errors="replace"))
+        if result.returncode != 0:
+            raise ContainerCommandFailedError(command, result.returncode)
 
-    def _run_docker_command(self, action: str) -> None:
+    def _run_docker_command(
+        self, action: str, input: str | None = None
+    ) -> subprocess.CompletedProcess[str]:
         """Runs a typical docker compose command via the script that is provided by the moodle-docker project.
+        The output is captured and logged afterwards, so the output of several containers handled in parallel does not interleave.
 
         Args:
             action (str): a typical docker compose command that should be sent to the containers (up, down, stop, restart)
+            input (str | None, optional): text passed to the command via stdin. Defaults to None.
+
+        Raises:
+            ContainerCommandFailedError: raised if the command exited with a non-zero exit code
+
+        Returns:
+            subprocess.CompletedProcess[str]: the finished command with it's captured output
         """
         command = self._build_command(action)
         log().info(f"executing {command}")
-        result = subprocess.run([command], cwd=self.path, shell=True)
-        log().info(result)
+        result = subprocess.run(
+            [command],
+            cwd=self.path,
+            shell=True,
+            input=input,
+            capture_output=True,
+            text=True,
+        )
+        _log_output(action, result.returncode, result.stdout + result.stderr)
+        if result.returncode != 0:
+            raise ContainerCommandFailedError(command, result.returncode)
+        return result
 
     def _build_command(self, action: str) -> str:
         """Builds a string containing the command line that will be used in the sub-shell and returns it, by sourcing the environment file for this test container and afterwards calling into the script wrapping docker compose commands.
@@ -178,3 +473,17 @@ class TestContainer:
             str: the string containing the command line
         """
         return f". ./.env && {self.compose_script} {action}"
+
+
+def _php_string(value: str) -> str:
+    # single-quoted PHP strings only interpret escaped quotes and backslashes
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _log_output(action: str, returncode: int, output: str) -> None:
+    # the output of a successful command is progress, the output of a failed one is the reason it failed
+    if returncode == 0:
+        for line in output.splitlines():
+            log().info(line)
+    else:
+        log().error(f"'{action}' exited with {returncode}:\n{output.rstrip()}")
@@ -1,11 +1,36 @@
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
-from ..cross_cutting import config, log, template_engine
+from ..cross_cutting import (
+    config,
+    log,
+    propagate_context,
+    template_engine,
+    traced,
+    tracer,
+    trash,
+)
 from ..domain import TestContainer, moodle_cache
 from ..domain.git import GitReference, clone_boost_union_repo
-from ..exceptions import VersionArgumentNeededError
+from ..domain.moodle_docker import MoodleDockerTrees
+from ..exceptions import BoostUnionTestEnvValueError, VersionArgumentNeededError
+from .container_executor import ContainerActionExecutor, ContainerBatchResult
+
+
+@dataclass
+class TeardownResult:
+    infrastructure: str
+    containers: ContainerBatchResult
+    # seconds each phase took, in the order they ran
+    durations: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.containers.failed
 
 
 class TestInfrastructure:
@@ -15,6 +40,9 @@ class TestInfrastructure:
     ) -> None:
         self.directory = directory
         self.template_engine = template_engine()
+        self.moodle_docker = MoodleDockerTrees(
+            config().moodle_docker_dir, config().moodle_docker_trees_dir
+        )
 
     def setup(
         self,
@@ -44,9 +72,36 @@ class TestInfrastructure:
             log().info("oh, no moodles yet. starting the stove...")
             moodles.mkdir()
 
-    def build(self, *versions: str) -> dict[Any, Any]:
+    @traced(
+        "infrastructure.build",
+        attributes=lambda self, *versions, jobs=1: {
+            "infrastructure": self.directory.name,
+            "versions": ",".join(versions),
+            "jobs": jobs,
+        },
+    )
+    def build(self, *versions: str, jobs: int = 1) -> dict[Any, Any]:
+        """Builds a new Moodle test environment for each given version that does not exist yet inside this infrastructure.
+        Each version runs through the same pipeline (unpack, copy moodle-docker, render templates, create containers). With jobs > 1, these pipelines run concurrently on a worker pool, as they do not share any files with each other.
+        The state of the testbed is not touched here; the caller is responsible to persist the returned info once all pipelines are done, so the "yaml database" is only written once.
+
+        Args:
+            versions (tuple[str, ...]): the Moodle versions for which a new test environment should be built
+            jobs (int, optional): how many test environments may be built in parallel. Defaults to 1.
+
+        Raises:
+            VersionArgumentNeededError: raised if no version has been passed
+            BoostUnionTestEnvValueError: raised if jobs is not a positive number
+
+        Returns:
+            dict[Any, Any]: the access info of each newly built Moodle test environment, keyed by it's version
+        """
         if not versions:
             raise VersionArgumentNeededError()
+        if jobs < 1:
+            raise BoostUnionTestEnvValueError(
+                f"the number of parallel jobs needs to be atleast 1, got {jobs}"
+            )
         # check the existing infrastructure if the selected moodle versions are already present
         new_versions = self._find_sources_for_versions(*versions)
         if not new_versions:
@@ -59,7 +114,51 @@ class TestInfrastructure:
         for version in new_versions:
             log().info(f"* {version}")
         built_moodles = {}
-        for version_nr, archive_path in new_versions.items():
+        if jobs == 1:
+            for version_nr, source_tree in new_versions.items():
+                built_moodles[version_nr] = self._build_test_env(
+                    version_nr, source_tree
+                )
+        else:
+            log().info(f"building with {jobs} parallel jobs")
+            with ThreadPoolExecutor(
+                max_workers=jobs, thread_name_prefix="build"
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        propagate_context(self._build_test_env),
+                        version_nr,
+                        source_tree,
+                    ): version_nr
+                    for version_nr, source_tree in new_versions.items()
+                }
+                try:
+                    for future in as_completed(futures):
+                        built_moodles[futures[future]] = future.result()
+                except BaseException:
+                    # same semantics as the sequential build: the first failing env aborts the whole build; envs that are already running are allowed to finish
+                    for future in futures:
+                        future.cancel()
+                    raise
+        log().info("your moodles are cooked al-dente; enjoy")
+        return built_moodles
+
+    def _build_test_env(self, version_nr: str, source_tree: Path) -> dict[str, Any]:
+        """Runs the complete pipeline to create a single Moodle test environment. Only touches files inside the environment's own directory, which makes it safe to run several of these pipelines concurrently.
+
+        Args:
+            version_nr (str): the Moodle version of the new test environment
+            source_tree (Path): path to the extracted sources of said Moodle version inside the Moodle cache
+
+        Returns:
+            dict[str, Any]: the access info of the newly created test environment
+        """
+        # binding the env to every log message of this pipeline keeps the output readable if several pipelines are interleaved
+        with log().contextualize(
+            env=f"{self.directory.name}/{version_nr}"
+        ), tracer().span(
+            "build.environment", infrastructure=self.directory.name, version=version_nr
+        ):
             log().info(f"{20*'-'} {version_nr} {20*'-'}")
             log().info("creating test env")
             # create a new moodle test environment, residing in a folder named after it's version
@@ -67,22 +166,17 @@ class TestInfrastructure:
             # inside previously created folder, create a folder called "moodle" to contain the actually sources of said moodle version - will be mounted into our test containers
             moodle_source_path = new_moodle_test_env / "moodle"
             new_moodle_test_env.mkdir(exist_ok=True)
-            # unpacking the archive will created a folder called "moodle-{ver}"
-            # rename the folder afterwards to ensure moodle sources are at the
-            # same location in every created test infrastructure
-            shutil.unpack_archive(archive_path, new_moodle_test_env)
-            extracted_path = new_moodle_test_env / f"moodle-{version_nr}"
-            shutil.move(extracted_path, moodle_source_path)
-            log().info(f"extracted moodle {version} to {moodle_source_path}")
-            # dirs_exist_ok needed so function doesn't raise FileExistsError
-            shutil.copytree(
-                config().moodle_docker_dir, new_moodle_test_env, dirs_exist_ok=True
-            )
-            log().info(f"copied docker files to {new_moodle_test_env}")
+            # the cache keeps an extracted copy of each moodle version, so we only need to clone it instead of unpacking the whole archive again
+            with tracer().span("build.clone_sources"):
+                moodle_cache().clone_source_tree(source_tree, moodle_source_path)
+            with tracer().span("build.link_docker_files"):
+                # all environments share the same moodle-docker files, only the ones rendered for this environment are copied
+                self.moodle_docker.overlay(new_moodle_test_env)
             log().info(
                 "create environment file with needed vars for our docker containers"
             )
-            shutil.copy(
+            # the template is shared and read-only, the config is not
+            shutil.copyfile(
                 new_moodle_test_env / "config.docker-template.php",
                 moodle_source_path / "config.php",
             )
@@ -91,35 +185,34 @@ class TestInfrastructure:
                 config().moodle_cache_dir / "smartdata.php",
                 moodle_source_path / "smartdata.php",
             )
-            self.template_engine.docker_customisation(
-                new_moodle_test_env,
-                self.directory / config().boost_union_base_directory_name,
-            )
-            self.template_engine.environment_file(
-                new_moodle_test_env, self.directory.name, version_nr
-            )
+            with tracer().span("build.render_templates"):
+                self.template_engine.docker_customisation(
+                    new_moodle_test_env,
+                    self.directory / config().boost_union_base_directory_name,
+                )
+                self.template_engine.environment_file(
+                    new_moodle_test_env, self.directory.name, version_nr
+                )
             container = TestContainer(new_moodle_test_env)
             container.create()
-            host, port, pw, db_port = container.get_access_info()
-            built_moodles[version_nr] = {
+            host, port, pw, _ = container.get_access_info()
+            self.template_engine.moodle_nginx_config(
+                self.directory.name, version_nr, port
+            )
+            log().info(f"test env for {version_nr} done")
+            return {
                 "status": "CREATED",
                 "url": f"https://{host}"
                 if config().is_proxied
                 else f"http://{host}:{port}",
                 "admin_pw": pw,
-                "www_port": port,
-                "db_port": db_port,
+                "www_port": container.environment().get_int("MOODLE_DOCKER_WEB_PORT"),
+                "db_port": container.environment().get_int("MOODLE_DOCKER_DB_PORT"),
             }
-            self.template_engine.moodle_nginx_config(
-                self.directory.name, version_nr, port
-            )
-            log().info(f"test env for {version_nr} done")
-        log().info("your moodles are cooked al-dente; enjoy")
-        return built_moodles
 
     def _find_sources_for_versions(self, *versions: str) -> dict[str, Path]:
-        """This function iterates through the given list of versions to return a dictionary which contains Moodle version strings mapped to it's downloaded source archive (tar.gz); if they have not been already created inside the "./moodles" directory.
-        If for a given version, the source archive does not exist locally, it will be downloaded to the "Moodle disk cache".
+        """This function iterates through the given list of versions to return a dictionary which contains Moodle version strings mapped to it's extracted sources inside the "Moodle disk cache"; if they have not been already created inside the "./moodles" directory.
+        If for a given version, the source archive does not exist locally, it will be downloaded to the "Moodle disk cache"; several missing archives are downloaded concurrently. Each archive is only extracted once by the cache.
         The created dictionary will not contain Moodle versions for which a test environment already exists.
 
         Args:
@@ -127,32 +220,51 @@ class TestInfrastructure:
             versions (tuple[str, ...]): the versions for which a new Moodle test environment should be created
 
         Returns:
-            dict[str, Path]: Dictionary that mappes Moodle version strings without an already existing test environment to it's downloaded source archive.
+            dict[str, Path]: Dictionary that mappes Moodle version strings without an already existing test environment to it's extracted sources.
         """
-        sources_to_versions: dict[str, Path] = {}
-        for ver in versions:
-            vers_path = self._get_moodles_dir() / ver
-            if not vers_path.exists():
-                # adding the Moodle version string + it's source archive via merge operator
-                sources_to_versions |= {ver: moodle_cache().get(ver)}
-        return sources_to_versions
+        missing_versions = [
+            ver for ver in versions if not (self._get_moodles_dir() / ver).exists()
+        ]
+        # fetching all missing versions at once allows the cache to download them concurrently
+        return moodle_cache().get_source_trees(*missing_versions)
 
     def _get_moodles_dir(self) -> Path:
         return self.directory / "moodles"
 
-    def teardown(self) -> None:
+    @traced(
+        "infrastructure.teardown",
+        attributes=lambda self, jobs=None: {"infrastructure": self.directory.name},
+    )
+    def teardown(self, jobs: int | None = None) -> TeardownResult:
+        """Tears down this infrastructure: all of it's containers are taken down concurrently, afterwards the whole directory is moved into the trash at once and deleted in the background. The name of the infrastructure is therefore free again as soon as this returns.
+        If a container could not be taken down, the files are left in place, as the container might still be using them.
+
+        Args:
+            jobs (int | None, optional): how many containers should be taken down in parallel. Defaults to the configured limit.
+
+        Returns:
+            TeardownResult: the outcome of taking down each container and the duration of each phase
+        """
         log().info(f"starting teardown of test infrastructure {self.directory.name}")
-        moodles = self._get_all_test_container()
-        for moodle in moodles:
-            log().info(
-                f"stopping and destroying container of {self.directory.name}/{moodle.path.name}"
+        containers = self._get_all_test_container()
+        # each container is removed from docker and nginx, but it's files are deleted together with the rest of the infrastructure
+        batch = ContainerActionExecutor(
+            jobs or config().parallel_container_actions
+        ).run(self.directory.name, TestContainer.take_down, containers, "destroy")
+        result = TeardownResult(
+            self.directory.name, batch, {"containers down": batch.duration}
+        )
+        if not result.succeeded:
+            log().error(
+                f"keeping the files of test infrastructure {self.directory.name}, as not all containers could be taken down"
             )
-            moodle.destroy()
-        # pathlib functions require the dir to be empty, but we just can safely
-        # delete all files now, so we resort to shutil
+            return result
+        start = time.monotonic()
         if self.directory.exists():
-            shutil.rmtree(self.directory)
-            log().info(f"removed test infrastructure {self.directory.name}")
+            trash().discard(self.directory)
+        result.durations["moved to trash"] = time.monotonic() - start
+        log().info(f"removed test infrastructure {self.directory.name}")
+        return result
 
     def _get_all_test_container(self) -> list[TestContainer]:
         return [
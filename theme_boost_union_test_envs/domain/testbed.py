@@ -1,8 +1,6 @@
 import shutil
 
-import requests
-
-from ..cross_cutting import config, log, template_engine
+from ..cross_cutting import config, log, nginx_configs, template_engine
 from . import clone_moodle_docker_repo
 
 
@@ -24,6 +22,8 @@ class Testbed:
         if not self.moodle_cache_dir.exists():
             log().info(f"creating moodle cache directory @ {self.moodle_cache_dir}")
             self.moodle_cache_dir.mkdir()
+            import requests
+
             # download datagenerator
             url = "https://raw.githubusercontent.com/andrewnicols/moodle-datagenerator/master/smartdata.php"
             datagenerator_script_path = self.moodle_cache_dir / "smartdata.php"
@@ -35,7 +35,10 @@ class Testbed:
             log().info(f"creating nginx config directory @ {self.nginx_dir}")
             self.nginx_dir.mkdir()
             template_engine().get_testenvs_base_dir().mkdir()
+            # access logs of the test environments, see the 'supervise' command
+            (self.nginx_dir / "logs").mkdir()
             template_engine().overview_nginx_config()
+            nginx_configs().apply()
             initialized = False
         if not self.docker_repo_dir.exists():
             log().info(f"cloning moodle_docker repo into {self.docker_repo_dir}")
@@ -1,10 +1,17 @@
 from .exceptions import (
     BoostUnionTestEnvValueError,
+    ContainerCommandFailedError,
+    DaemonRequestFailedError,
     InfrastructureDoesNotExistYetError,
     InvalidGitReferenceError,
+    InvalidMatrixSpecError,
     InvalidMoodleVersionError,
+    MoodleDownloadFailedError,
     MoodleTestEnvironmentDoesNotExistYetError,
     NameAlreadyTakenError,
+    NginxConfigTestFailedError,
+    PhpSessionAbortedError,
+    PortRangeExhaustedError,
     TestbedDoesNotExistYetError,
     UnsupportedMoodleVersionError,
     UserInterfaceNotYetImplemented,
@@ -73,3 +73,60 @@ class UnsupportedMoodleVersionError(BoostUnionTestEnvValueError):
     def __init__(self, version: str, *args: object) -> None:
         super().__init__(*args)
         self.version = version
+
+
+class MoodleDownloadFailedError(BoostUnionTestEnvValueError):
+    """Exception raised if the source archive of a Moodle version could not be downloaded, even after retrying"""
+
+    def __init__(self, file_name: str, *args: object) -> None:
+        super().__init__(*args)
+        self.file_name = file_name
+
+
+class ContainerCommandFailedError(BoostUnionTestEnvValueError):
+    """Exception raised if a docker compose command issued to a Moodle test container exited with a non-zero exit code"""
+
+    def __init__(self, command: str, returncode: int, *args: object) -> None:
+        super().__init__(*args)
+        self.command = command
+        self.returncode = returncode
+
+
+class PhpSessionAbortedError(BoostUnionTestEnvValueError):
+    """Exception raised if a session running several PHP scripts in a Moodle test container ended before a script reported it's exit code, although none of the scripts before it failed"""
+
+    def __init__(self, script: str, *args: object) -> None:
+        super().__init__(*args)
+        self.script = script
+
+
+class PortRangeExhaustedError(BoostUnionTestEnvValueError):
+    """Exception raised if no free port is left in the configured port range for a new Moodle test environment"""
+
+    def __init__(self, first_port: int, last_port: int, *args: object) -> None:
+        super().__init__(*args)
+        self.first_port = first_port
+        self.last_port = last_port
+
+
+class NginxConfigTestFailedError(BoostUnionTestEnvValueError):
+    """Exception raised if nginx rejected the configuration files we generated"""
+
+    def __init__(self, command: str, output: str, *args: object) -> None:
+        super().__init__(*args)
+        self.command = command
+        self.output = output
+
+
+class DaemonRequestFailedError(BoostUnionTestEnvValueError):
+    """Exception raised if the daemon could not be reached or failed to answer a request of the CLI"""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class InvalidMatrixSpecError(BoostUnionTestEnvValueError):
+    """Exception raised if a matrix spec does not describe which infrastructures should be built with which Moodle versions"""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
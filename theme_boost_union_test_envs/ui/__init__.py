@@ -1,2 +1,3 @@
 from .cli import cli_main
+from .daemon import RemoteCore
 from .gui import gui_main
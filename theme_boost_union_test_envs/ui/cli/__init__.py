@@ -1,2 +1,15 @@
+from typing import TYPE_CHECKING, Any
+
 from .cli import cli_main
-from .components import GitRemoteProgress
+
+if TYPE_CHECKING:
+    from .components import GitRemoteProgress
+
+
+def __getattr__(name: str) -> Any:
+    # see .components, importing the progress bar imports GitPython
+    if name == "GitRemoteProgress":
+        from . import components
+
+        return components.GitRemoteProgress
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
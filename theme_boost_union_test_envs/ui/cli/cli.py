@@ -1,28 +1,63 @@
+from __future__ import annotations
+
+import functools
+import signal
 import sys
-from typing import Any
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
 import fire
-from git import GitCommandError
 
 from ...core import BoostUnionTestEnvCore
-from ...cross_cutting import log
+from ...cross_cutting import config, log, nginx_configs, tracer, trash
+from ...domain import ContainerBatchResult, load_matrix_spec
 from ...domain.git import GitReference, GitReferenceType
 from ...exceptions import (
+    BoostUnionTestEnvValueError,
+    DaemonRequestFailedError,
     InfrastructureDoesNotExistYetError,
+    InvalidMatrixSpecError,
     InvalidMoodleVersionError,
+    MoodleDownloadFailedError,
     MoodleTestEnvironmentDoesNotExistYetError,
     NameAlreadyTakenError,
+    NginxConfigTestFailedError,
     TestbedDoesNotExistYetError,
     UnsupportedMoodleVersionError,
     VersionArgumentNeededError,
 )
+from ..daemon import RemoteCore
+from .components import (
+    print_cache_prune_result,
+    print_cache_stats,
+    print_container_batch_result,
+    print_matrix_result,
+    print_php_matrix,
+    print_teardown_result,
+    print_trace_summary,
+    print_trash_result,
+)
+
+if TYPE_CHECKING:
+    import loguru
 
 
 class BoostUnionTestEnvCLI:
     """BoostUnionTestEnvCLI capsulates all possible business operations to provide a CLI.While it is not needed to be in a single class, we still want to do so, even it's just for making sure we are not shadowing python built-ins (see help)."""
 
-    def __init__(self, core: BoostUnionTestEnvCore) -> None:
-        self.core = core
+    def __init__(
+        self, core: Callable[[], BoostUnionTestEnvCore], remote_core: RemoteCore
+    ) -> None:
+        self._local_core = core
+        self.remote_core = remote_core
+
+    @functools.cached_property
+    def core(self) -> BoostUnionTestEnvCore | RemoteCore:
+        # a running daemon owns the testbed, so commands are sent to it instead of being run here
+        if self.remote_core.is_available():
+            return self.remote_core
+        return self._local_core()
 
     def list(self) -> None:
         try:
@@ -52,6 +87,8 @@ class BoostUnionTestEnvCLI:
         Raises:
             fire.core.FireError: An error describing that either the passed git reference type is invalid or that the name is already in use by another test infrastructure
         """
+        from git import GitCommandError
+
         try:
             if not any([git_ref_type in t for t in GitReferenceType]):
                 raise fire.core.FireError(
@@ -72,18 +109,20 @@ class BoostUnionTestEnvCLI:
                 "No test infrastructure can be setup as the test bed has not been initialized yet. Please initialize the test bed."
             )
 
-    def build(self, infrastructure_name: str, *versions: str) -> None:
+    def build(self, infrastructure_name: str, *versions: str, jobs: int = 1) -> None:
         """The 'build' command is responsible for the creation of new Moodle test containers. For each given Moodle version string, a test container setup is created that will include Moodle in the given version, as well as setup said moodle to be used for manual testing. Per default, each Moodle instance is created completely fresh, with a PostgreSQL DB, Mailpit as a e-mail sink.
         The created Moodle instances can be found inside the infrastructure's "moodles" folder, in an subdirectory equally named to it's Moodle version, e.g.: $infrastructure_directory/moodles/$moodle_version.
 
         Args:
             infrastructure_name (str): Name the test infrastructure for which the Moodle test containers should be build for
+            *versions (str): Moodle versions for which a new Moodle test container should be build
+            jobs (int, optional): How many Moodle test containers should be build in parallel, e.g. "--jobs 4". Defaults to 1.
 
         Raises:
             fire.core.FireError: Error that denotes that the given test infrastructure does not exist, or that either no version at all or an invalid Moodle version string was given
         """
         try:
-            self.core.build_infrastructure(infrastructure_name, *versions)
+            self.core.build_infrastructure(infrastructure_name, *versions, jobs=jobs)
         except VersionArgumentNeededError as e:
             raise fire.core.FireError("Please pass atleast one version") from e
         except InfrastructureDoesNotExistYetError as e:
@@ -98,20 +137,35 @@ class BoostUnionTestEnvCLI:
             raise fire.core.FireError(
                 f"Moodle version {e.version} is invalid, please check if you wrote the correct one."
             ) from e
+        except MoodleDownloadFailedError as e:
+            raise fire.core.FireError(
+                f"Downloading {e.file_name} failed repeatedly, please try again later."
+            ) from e
+        except NginxConfigTestFailedError as e:
+            raise fire.core.FireError(
+                f"The test environments have been built, but '{e.command}' rejected their nginx configuration, so nginx has not been reloaded:\n{e.output}"
+            ) from e
         except TestbedDoesNotExistYetError:
             raise fire.core.FireError(
                 "No test infrastructure can be build as the test bed has not been initialized yet. Please initialize the test bed."
             )
+        except BoostUnionTestEnvValueError as e:
+            raise fire.core.FireError(str(e)) from e
 
-    def start(self, infrastructure_name: str, *versions: str) -> None:
+    def start(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> None:
         """The 'start' command is used to start up the Moodle instances previously created. For the given test infrastructure, the Moodle container containing the corresponding version will be started if available. If no version strings are passed, every available Moodle instance will be started.
 
         Args:
             infrastructure_name (str): Name the test infrastructure for which the Moodle test containers should be started for
             *versions (str): Moodle versions that are going to be used to identify which Moodle containers should be started
+            jobs (int | None, optional): How many Moodle containers should be started in parallel, e.g. "--jobs 4". Defaults to the configured limit.
         """
         try:
-            self.core.start_environment(infrastructure_name, *versions)
+            self._report(
+                self.core.start_environment(infrastructure_name, *versions, jobs=jobs)
+            )
         except MoodleTestEnvironmentDoesNotExistYetError as e:
             raise fire.core.FireError(
                 f"No test environment available for Moodle version {e.version}"
@@ -121,15 +175,20 @@ class BoostUnionTestEnvCLI:
                 "No Moodle test instance can be started as the test bed has not been initialized yet. Please initialize the test bed."
             )
 
-    def restart(self, infrastructure_name: str, *versions: str) -> None:
+    def restart(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> None:
         """The 'restart' command is used to reboot the Moodle instances previously created. For the given test infrastructure, the Moodle container containing the corresponding version will be restarted if available. If no version strings are passed, every available Moodle instance will be restarted.
 
         Args:
             infrastructure_name (str): Name the test infrastructure for which the Moodle test containers should be restarted for
             *versions (str): Moodle versions that are going to be used to identify which Moodle containers should be restarted
+            jobs (int | None, optional): How many Moodle containers should be restarted in parallel, e.g. "--jobs 4". Defaults to the configured limit.
         """
         try:
-            self.core.restart_environment(infrastructure_name, *versions)
+            self._report(
+                self.core.restart_environment(infrastructure_name, *versions, jobs=jobs)
+            )
         except MoodleTestEnvironmentDoesNotExistYetError as e:
             raise fire.core.FireError(
                 f"No test environment available for Moodle version {e.version}"
@@ -139,15 +198,20 @@ class BoostUnionTestEnvCLI:
                 "No Moodle test instance can be restarted as the test bed has not been initialized yet. Please initialize the test bed."
             )
 
-    def stop(self, infrastructure_name: str, *versions: str) -> None:
+    def stop(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> None:
         """The 'stop' command is used to stop the Moodle instances previously created. For the given test infrastructure, the Moodle container containing the corresponding version will be stopped if available. If no version strings are passed, every available Moodle instance will be stopped.
 
         Args:
             infrastructure_name (str): Name the test infrastructure for which the Moodle test containers should be stopped for
             *versions (str): Moodle versions that are going to be used to identify which Moodle containers should be stopped
+            jobs (int | None, optional): How many Moodle containers should be stopped in parallel, e.g. "--jobs 4". Defaults to the configured limit.
         """
         try:
-            self.core.stop_environment(infrastructure_name, *versions)
+            self._report(
+                self.core.stop_environment(infrastructure_name, *versions, jobs=jobs)
+            )
         except MoodleTestEnvironmentDoesNotExistYetError as e:
             raise fire.core.FireError(
                 f"No test environment available for Moodle version {e.version}"
@@ -157,44 +221,240 @@ class BoostUnionTestEnvCLI:
                 "No Moodle test instance can be stopped as the test bed has not been initialized yet. Please initialize the test bed."
             )
 
-    def destroy(self, infrastructure_name: str, *versions: str) -> None:
+    def destroy(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> None:
         """The 'destroy' command is used to destroy the Moodle instances previously created. For the given test infrastructure, the Moodle container containing the corresponding version will be destroyed if available. If no version strings are passed, every available Moodle instance will be destroyed.
 
         Args:
             infrastructure_name (str): Name the test infrastructure for which the Moodle test containers should be destroyed for
             *versions (str): Moodle versions that are going to be used to identify which Moodle containers should be destroyed
+            jobs (int | None, optional): How many Moodle containers should be destroyed in parallel, e.g. "--jobs 4". Defaults to the configured limit.
         """
         try:
-            self.core.destroy_environment(infrastructure_name, *versions)
+            self._report(
+                self.core.destroy_environment(infrastructure_name, *versions, jobs=jobs)
+            )
         except MoodleTestEnvironmentDoesNotExistYetError as e:
             raise fire.core.FireError(
                 f"No test environment available for Moodle version {e.version}"
             ) from e
+        except NginxConfigTestFailedError as e:
+            raise fire.core.FireError(
+                f"The test environments have been destroyed, but '{e.command}' rejected the new nginx map, so nginx still routes to them:\n{e.output}"
+            ) from e
         except TestbedDoesNotExistYetError:
             raise fire.core.FireError(
                 "No Moodle test instance can be destroyed as the test bed has not been initialized yet. Please initialize the test bed."
             )
 
-    def teardown(self, infrastructure_name: str) -> None:
+    def supervise(self, idle_timeout: float | None = None) -> None:
+        """The 'supervise' command keeps running until interrupted and makes sure that only the Moodle instances actually in use are running. Started Moodle instances without any request for a while are stopped, and started again as soon as they are requested via nginx: a stopped instance answers with a short "starting" page that reloads itself until the instance is available again.
+        Make sure nginx uses the current Moodle nginx configurations, which forward requests for stopped instances to this command.
+
+        Args:
+            idle_timeout (float | None, optional): Minutes without any request after which a Moodle instance is stopped, e.g. "--idle-timeout 30". Defaults to the configured timeout.
+        """
+        try:
+            # supervising runs until interrupted, so it always runs here instead of blocking a daemon
+            self._local_core().supervise(idle_timeout)
+        except TestbedDoesNotExistYetError:
+            raise fire.core.FireError(
+                "No Moodle test instance can be supervised as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+        except OSError as e:
+            raise fire.core.FireError(
+                f"The wake endpoint could not be served: {e}"
+            ) from e
+        except KeyboardInterrupt:
+            log().info("stopped supervising")
+
+    def daemon(self) -> None:
+        """The 'daemon' command keeps running until interrupted and runs all commands of other invocations of this CLI, which send them via a Unix socket instead of running them themselves. This saves each command from starting up, keeps the testbed's state and all caches in memory and makes sure commands changing the testbed never run at the same time.
+        Use 'supervise' next to the daemon, if idle Moodle instances should be stopped.
+        """
+        from ..daemon import Daemon
+
+        if not config().working_dir.exists():
+            raise fire.core.FireError(
+                "No daemon can be started as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+        # e.g. systemd stops services via SIGTERM, the socket needs to be removed nonetheless
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            Daemon(self._local_core(), config().daemon_socket).run()
+        except OSError as e:
+            raise fire.core.FireError(f"The daemon could not be started: {e}") from e
+        except KeyboardInterrupt:
+            log().info("stopped daemon")
+
+    def state_export(self, path: str | None = None) -> None:
+        """The 'state export' command writes all infrastructures and their Moodle test containers into a yaml file, in the same format as the original "yaml file database".
+
+        Args:
+            path (str | None, optional): File the infrastructures should be written to. Defaults to the "infrastructure.yaml" in the working directory.
+        """
+        try:
+            self.core.export_state(Path(path) if path else None)
+        except TestbedDoesNotExistYetError:
+            raise fire.core.FireError(
+                "No test infrastructure can be exported as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+
+    def state_import(self, path: str | None = None) -> None:
+        """The 'state import' command replaces all persisted infrastructures with the ones found in the given yaml file. The containers themselves are not touched, so make sure the file matches the test bed.
+
+        Args:
+            path (str | None, optional): File the infrastructures should be read from. Defaults to the "infrastructure.yaml" in the working directory.
+        """
+        try:
+            self.core.import_state(Path(path) if path else None)
+        except TestbedDoesNotExistYetError:
+            raise fire.core.FireError(
+                "No test infrastructure can be imported as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+        except (FileNotFoundError, KeyError, TypeError) as e:
+            raise fire.core.FireError(
+                "The given file does not exist or does not contain valid infrastructures"
+            ) from e
+
+    def php_matrix(self, *versions: str) -> None:
+        """The 'php-matrix' command lists which moodle-php-apache image, i.e. which PHP version, the test containers of each Moodle version run on, according to the configured Moodle-to-PHP mapping.
+
+        Args:
+            *versions (str): Moodle versions that should be listed. Defaults to every released Moodle version, as tagged in the Moodle repository.
+        """
+        from git import GitCommandError
+        from packaging.version import InvalidVersion
+
+        try:
+            # fire turns versions like "4.3" into numbers
+            print_php_matrix(self.core.php_matrix(*(str(v) for v in versions)))
+        except GitCommandError as e:
+            raise fire.core.FireError(
+                "The released Moodle versions could not be listed, please check your connection"
+            ) from e
+        except InvalidVersion as e:
+            raise fire.core.FireError(f"{e}, please check it's spelling") from e
+
+    def cache_stats(self) -> None:
+        """The 'cache stats' command lists all Moodle versions whose source archives are cached, together with their size and how often and when they have been used."""
+        try:
+            print_cache_stats(self.core.cache_stats())
+        except TestbedDoesNotExistYetError:
+            raise fire.core.FireError(
+                "No Moodle cache can be found as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+
+    def cache_prune(
+        self, max_size_mb: int | None = None, policy: str | None = None
+    ) -> None:
+        """The 'cache prune' command removes damaged archives and left-over downloads from the Moodle cache. Afterwards, archives are evicted until the cache fits into the configured size.
+
+        Args:
+            max_size_mb (int | None, optional): Size in MB the cache should be shrunk to, e.g. "--max-size-mb 2048". Defaults to the configured size.
+            policy (str | None, optional): Which archives to evict first, either "lru" or "lfu". Defaults to the configured policy.
+        """
+        try:
+            print_cache_prune_result(self.core.prune_cache(max_size_mb, policy))
+        except TestbedDoesNotExistYetError:
+            raise fire.core.FireError(
+                "No Moodle cache can be found as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+        except ValueError as e:
+            raise fire.core.FireError(
+                "The eviction policy needs to be either lru or lfu"
+            ) from e
+
+    def _report(self, result: ContainerBatchResult) -> None:
+        print_container_batch_result(result)
+        if result.failed:
+            raise fire.core.FireError(
+                f"Could not {result.action} the Moodle containers for version(s) {', '.join(result.failed)}"
+            )
+
+    def matrix(self, spec: str, jobs: int = 1) -> None:
+        """The 'matrix' command sets up and builds many test infrastructures at once, e.g. "for these 5 PRs, build Moodle 4.1, 4.2, 4.3 and 4.4". The given yaml file lists each infrastructure with it's git reference of Boost Union, and the Moodle versions to build for all of them or per infrastructure:
+            versions: ["4.1", "4.2", "4.3", "4.4"]
+            infrastructures:
+              pr-512:
+                pr: 512
+              main:
+                branch: main
+                versions: ["4.4"]
+        Every Moodle version and git reference is only fetched once. Infrastructures existing already are only built, so the same spec can be run again after some of it failed.
+
+        Args:
+            spec (str): Path to the yaml file describing the matrix
+            jobs (int, optional): How many infrastructures should be set up and built in parallel, e.g. "--jobs 4". Defaults to 1.
+
+        Raises:
+            fire.core.FireError: Error that denotes that the spec is invalid or that some infrastructures could not be built
+        """
+        try:
+            result = self.core.build_matrix(load_matrix_spec(Path(spec)), jobs=jobs)
+        except FileNotFoundError as e:
+            raise fire.core.FireError(f"The matrix spec {spec} does not exist") from e
+        except InvalidMatrixSpecError as e:
+            raise fire.core.FireError(f"Invalid matrix spec: {e}") from e
+        except TestbedDoesNotExistYetError:
+            raise fire.core.FireError(
+                "No test infrastructure can be setup as the test bed has not been initialized yet. Please initialize the test bed."
+            )
+        print_matrix_result(result)
+        if result.failed:
+            raise fire.core.FireError(
+                f"Could not build the test infrastructure(s) {', '.join(result.failed)}"
+            )
+
+    def teardown(self, infrastructure_name: str, jobs: int | None = None) -> None:
         """The 'teardown' command is used to tear down the test infrastructure identified by the passed name. This entailes stopping all Moodle containers pertaining to said infrastructure if available and started, deleted all docker related files for said containers and finally removing the checked out Boost Union repository itself.
+        The containers are taken down in parallel; the files are deleted in the background, so the name of the infrastructure can be used again right away.
 
         Args:
             infrastructure_name (str): Name of the infrastructure that should be torn down
+            jobs (int | None, optional): How many Moodle containers should be taken down in parallel, e.g. "--jobs 4". Defaults to the configured limit.
         """
         try:
-            self.core.teardown_infrastructure(infrastructure_name)
+            result = self.core.teardown_infrastructure(infrastructure_name, jobs=jobs)
+            print_teardown_result(result)
+            if not result.succeeded:
+                raise fire.core.FireError(
+                    f"Could not destroy the Moodle containers for version(s) {', '.join(result.containers.failed)}, so the test infrastructure {infrastructure_name} has been kept"
+                )
+        except NginxConfigTestFailedError as e:
+            raise fire.core.FireError(
+                f"The test infrastructure has been torn down, but '{e.command}' rejected the new nginx map, so nginx still routes to it's environments:\n{e.output}"
+            ) from e
         except TestbedDoesNotExistYetError:
             raise fire.core.FireError(
                 "No test infrastructure can be found as the test bed has not been initialized yet. Please initialize the test bed."
             )
 
 
+def _format_log_record(record: "loguru.Record") -> str:
+    """Builds the format string for a single log record. Messages bound to a specific test environment, e.g. during a parallel build, are prefixed with said environment so interleaved output stays readable.
+
+    Args:
+        record (loguru.Record): the record that is about to be logged
+
+    Returns:
+        str: the format string loguru should use for this record
+    """
+    env = "[{extra[env]}] " if "env" in record["extra"] else ""
+    return (
+        "<green>{time:YYYY-MM-DDTHH:mm:ss!UTC}</green> | {level} | "
+        + env
+        + "<level>{message}</level>\n{exception}"
+    )
+
+
 def configure_cli_logger() -> None:
     config: dict[str, Any] = {
         "handlers": [
             {
                 "sink": sys.stdout,
-                "format": "<green>{time:YYYY-MM-DDTHH:mm:ss!UTC}</green> | {level} | <level>{message}</level>",
+                "format": _format_log_record,
                 "backtrace": True,
                 "colorize": True,
                 "diagnose": True,
@@ -204,9 +464,49 @@ def configure_cli_logger() -> None:
     log().configure(**config)
 
 
-def cli_main(core: BoostUnionTestEnvCore) -> None:
+def _pop_flag(flag: str) -> bool:
+    """Removes a global flag from the command line before Fire sees it, as Fire would pass it to the called command otherwise.
+
+    Args:
+        flag (str): the flag, e.g. "--profile"
+
+    Returns:
+        bool: whether the flag has been given
+    """
+    if flag not in sys.argv[1:]:
+        return False
+    sys.argv = [arg for arg in sys.argv if arg != flag]
+    return True
+
+
+def cli_main(
+    core: Callable[[], BoostUnionTestEnvCore], remote_core: RemoteCore
+) -> None:
     configure_cli_logger()
-    cli = BoostUnionTestEnvCLI(core)
+    cli = BoostUnionTestEnvCLI(core, remote_core)
+    # "--profile" can be added to every command to print how long it's phases took
+    profile = _pop_flag("--profile")
+    trace_file = config().trace_file
+    tracer().enabled = profile or trace_file is not None
+    try:
+        _fire(cli)
+    except DaemonRequestFailedError as e:
+        log().error(str(e))
+        raise SystemExit(1) from e
+    finally:
+        # a single invocation does not need to wait for further changes
+        nginx_configs().flush()
+        # deleting torn down files has been overlapping with everything else so far, but must be done before exiting
+        freed = trash().wait()
+        if freed:
+            print_trash_result(freed)
+        if trace_file is not None:
+            tracer().export(trace_file, config().trace_format)
+        if profile:
+            print_trace_summary(tracer().summary())
+
+
+def _fire(cli: BoostUnionTestEnvCLI) -> None:
     # Initializes the Fire library with the functions we wanna see in the CLI.
     fire.Fire(
         {
@@ -216,11 +516,25 @@ def cli_main(core: BoostUnionTestEnvCore) -> None:
             "list": cli.list,
             "setup": cli.setup,
             "teardown": cli.teardown,
+            "matrix": cli.matrix,
             # moodle container related commands
             "build": cli.build,
             "destroy": cli.destroy,
             "start": cli.start,
             "stop": cli.stop,
             "restart": cli.restart,
+            "supervise": cli.supervise,
+            "daemon": cli.daemon,
+            "php-matrix": cli.php_matrix,
+            # persisted state related commands
+            "state": {
+                "export": cli.state_export,
+                "import": cli.state_import,
+            },
+            # moodle cache related commands
+            "cache": {
+                "stats": cli.cache_stats,
+                "prune": cli.cache_prune,
+            },
         },
     )
@@ -1 +1,24 @@
-from .progressbar import GitRemoteProgress
+from typing import TYPE_CHECKING, Any
+
+from .tables import (
+    print_cache_prune_result,
+    print_cache_stats,
+    print_container_batch_result,
+    print_matrix_result,
+    print_php_matrix,
+    print_teardown_result,
+    print_trace_summary,
+    print_trash_result,
+)
+
+if TYPE_CHECKING:
+    from .progressbar import GitRemoteProgress
+
+
+def __getattr__(name: str) -> Any:
+    # the progress bar extends a class of GitPython, so it's only imported once a repository actually gets cloned
+    if name == "GitRemoteProgress":
+        from . import progressbar
+
+        return progressbar.GitRemoteProgress
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
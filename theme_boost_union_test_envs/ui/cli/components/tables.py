@@ -0,0 +1,149 @@
+from datetime import datetime
+
+from rich import box, console
+from rich.table import Table
+
+from ....cross_cutting import SpanSummary
+from ....domain import (
+    CachePruneResult,
+    CacheStats,
+    ContainerBatchResult,
+    MatrixResult,
+    TeardownResult,
+)
+
+
+def human_readable_size(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def print_cache_stats(stats: CacheStats) -> None:
+    table = Table(title="Moodle cache", box=box.SIMPLE)
+    table.add_column("Version")
+    table.add_column("Size", justify="right")
+    table.add_column("Hits", justify="right")
+    table.add_column("Last access")
+    table.add_column("Checksum (sha256)")
+    for entry in stats.entries:
+        table.add_row(
+            entry.version,
+            human_readable_size(entry.size),
+            str(entry.hits),
+            datetime.fromtimestamp(entry.last_access).isoformat(timespec="seconds"),
+            entry.digest[:12],
+        )
+    budget = human_readable_size(stats.max_size) if stats.max_size > 0 else "unbounded"
+    table.caption = f"{human_readable_size(stats.total_size)} used of {budget}, eviction policy: {stats.eviction_policy.value}"
+    console.Console().print(table)
+
+
+def print_cache_prune_result(result: CachePruneResult) -> None:
+    evicted = ", ".join(result.evicted) if result.evicted else "nothing"
+    console.Console().print(
+        f"evicted: {evicted} - freed {human_readable_size(result.freed_bytes)}"
+    )
+
+
+def print_container_batch_result(result: ContainerBatchResult) -> None:
+    console.Console().print(_container_batch_table(result))
+
+
+def _container_batch_table(result: ContainerBatchResult) -> Table:
+    table = Table(
+        title=f"{result.action} {result.infrastructure}",
+        box=box.SIMPLE,
+        caption=f"{len(result.succeeded)} of {len(result.results)} succeeded in {result.duration:.1f}s",
+    )
+    table.add_column("Version")
+    table.add_column("Result")
+    table.add_column("Exit code", justify="right")
+    table.add_column("Duration", justify="right")
+    table.add_column("Error")
+    for single in result.results:
+        table.add_row(
+            single.version,
+            "[green]ok" if single.succeeded else "[red]failed",
+            str(single.returncode),
+            f"{single.duration:.1f}s",
+            single.error or "",
+        )
+    return table
+
+
+def print_matrix_result(result: MatrixResult) -> None:
+    table = Table(
+        title="matrix",
+        box=box.SIMPLE,
+        caption=f"{len(result.results) - len(result.failed)} of {len(result.results)} infrastructures built in {result.duration:.1f}s",
+    )
+    table.add_column("Infrastructure")
+    table.add_column("Git reference")
+    table.add_column("Versions")
+    table.add_column("Setup")
+    table.add_column("Result")
+    table.add_column("Duration", justify="right")
+    table.add_column("Error")
+    for single in result.results:
+        table.add_row(
+            single.infrastructure,
+            single.git_ref,
+            ", ".join(single.versions),
+            "new" if single.set_up else "existing",
+            "[green]ok" if single.succeeded else "[red]failed",
+            f"{single.duration:.1f}s",
+            single.error or "",
+        )
+    console.Console().print(table)
+
+
+def print_teardown_result(result: TeardownResult) -> None:
+    table = _container_batch_table(result.containers)
+    table.title = f"teardown {result.infrastructure}"
+    phases = ", ".join(
+        f"{phase} {duration:.1f}s" for phase, duration in result.durations.items()
+    )
+    if result.succeeded:
+        table.caption = f"{phases} - the files are deleted in the background"
+    else:
+        table.caption = f"{phases} - the files have been kept, as not all containers could be taken down"
+    console.Console().print(table)
+
+
+def print_trash_result(freed_bytes: int) -> None:
+    console.Console().print(
+        f"deleted torn down files - freed {human_readable_size(freed_bytes)}"
+    )
+
+
+def print_php_matrix(image_tags: dict[str, str | None]) -> None:
+    table = Table(title="PHP images", box=box.SIMPLE)
+    table.add_column("Moodle version")
+    table.add_column("Image tag")
+    for moodle_version, image_tag in image_tags.items():
+        table.add_row(moodle_version, image_tag or "[red]unsupported")
+    console.Console().print(table)
+
+
+def print_trace_summary(summaries: list[SpanSummary]) -> None:
+    table = Table(title="Profile", box=box.SIMPLE)
+    table.add_column("Phase")
+    table.add_column("Calls", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("Mean", justify="right")
+    table.add_column("Max", justify="right")
+    table.add_column("Failed", justify="right")
+    for summary in summaries:
+        table.add_row(
+            summary.name,
+            str(summary.count),
+            f"{summary.total:.2f}s",
+            f"{summary.mean:.2f}s",
+            f"{summary.max:.2f}s",
+            str(summary.failed) if summary.failed else "",
+        )
+    table.caption = "phases of parallel containers overlap, so their totals may exceed the duration of the whole command"
+    console.Console().print(table)
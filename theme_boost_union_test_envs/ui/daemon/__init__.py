@@ -0,0 +1,15 @@
+from typing import TYPE_CHECKING, Any
+
+from .client import RemoteCore
+
+if TYPE_CHECKING:
+    from .server import Daemon
+
+
+def __getattr__(name: str) -> Any:
+    # only the 'daemon' command serves anything, all other commands should not pay for importing the http server
+    if name == "Daemon":
+        from . import server
+
+        return server.Daemon
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+import socket
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, cast
+
+from ...cross_cutting import log, traced
+from ...exceptions import DaemonRequestFailedError
+
+if TYPE_CHECKING:
+    import http.client
+
+    from ...domain import (
+        CachePruneResult,
+        CacheStats,
+        ContainerBatchResult,
+        GitReference,
+        MatrixResult,
+        MatrixSpec,
+        TeardownResult,
+    )
+
+
+class RemoteCore:
+    """Stands in for the core while a daemon is running: every command is sent to the daemon, which runs it with it's own core. Everything the daemon logs while running a command is logged here as well, and exceptions raised by the command are raised here again, so callers cannot tell the difference.
+
+    Args:
+        socket_path (Path): the Unix socket the daemon listens on
+    """
+
+    def __init__(self, socket_path: Path) -> None:
+        self.socket_path = socket_path
+
+    def is_available(self) -> bool:
+        if not self.socket_path.exists():
+            return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(self.socket_path))
+            except OSError:
+                # a socket left behind by a daemon that has been killed
+                return False
+        return True
+
+    def init_testbed(self) -> None:
+        self._call("init_testbed")
+
+    def list_infrastructures(self) -> None:
+        self._call("list_infrastructures")
+
+    def setup_infrastructure(
+        self, infrastructure_name: str, git_ref: GitReference
+    ) -> None:
+        self._call("setup_infrastructure", infrastructure_name, git_ref)
+
+    def build_infrastructure(
+        self, infrastructure_name: str, *versions: str, jobs: int = 1
+    ) -> None:
+        self._call("build_infrastructure", infrastructure_name, *versions, jobs=jobs)
+
+    def build_matrix(self, spec: MatrixSpec, jobs: int = 1) -> MatrixResult:
+        return cast("MatrixResult", self._call("build_matrix", spec, jobs=jobs))
+
+    def teardown_infrastructure(
+        self, infrastructure_name: str, jobs: int | None = None
+    ) -> TeardownResult:
+        return cast(
+            "TeardownResult",
+            self._call("teardown_infrastructure", infrastructure_name, jobs=jobs),
+        )
+
+    def start_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        return cast(
+            "ContainerBatchResult",
+            self._call("start_environment", infrastructure_name, *versions, jobs=jobs),
+        )
+
+    def stop_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        return cast(
+            "ContainerBatchResult",
+            self._call("stop_environment", infrastructure_name, *versions, jobs=jobs),
+        )
+
+    def restart_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        return cast(
+            "ContainerBatchResult",
+            self._call(
+                "restart_environment", infrastructure_name, *versions, jobs=jobs
+            ),
+        )
+
+    def wake_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        return cast(
+            "ContainerBatchResult",
+            self._call("wake_environment", infrastructure_name, *versions, jobs=jobs),
+        )
+
+    def destroy_environment(
+        self, infrastructure_name: str, *versions: str, jobs: int | None = None
+    ) -> ContainerBatchResult:
+        return cast(
+            "ContainerBatchResult",
+            self._call(
+                "destroy_environment", infrastructure_name, *versions, jobs=jobs
+            ),
+        )
+
+    def export_state(self, path: Path | None = None) -> Path:
+        return cast(Path, self._call("export_state", path))
+
+    def import_state(self, path: Path | None = None) -> None:
+        self._call("import_state", path)
+
+    def php_matrix(self, *versions: str) -> dict[str, str | None]:
+        return cast("dict[str, str | None]", self._call("php_matrix", *versions))
+
+    def cache_stats(self) -> CacheStats:
+        return cast("CacheStats", self._call("cache_stats"))
+
+    def prune_cache(
+        self, max_size_mb: int | None = None, eviction_policy: str | None = None
+    ) -> CachePruneResult:
+        return cast(
+            "CachePruneResult", self._call("prune_cache", max_size_mb, eviction_policy)
+        )
+
+    @traced(
+        "daemon.call",
+        attributes=lambda self, command, *args, **kwargs: {"command": command},
+    )
+    def _call(self, command: str, *args: Any, **kwargs: Any) -> Any:
+        """Sends a command to the daemon and waits for it's result, while logging every message the daemon forwards.
+
+        Args:
+            command (str): name of the command of the core
+            *args (Any): positional arguments of the command
+            **kwargs (Any): keyword arguments of the command
+
+        Raises:
+            DaemonRequestFailedError: raised if the daemon could not be reached or did not answer properly
+
+        Returns:
+            Any: the result of the command
+        """
+        from .protocol import decode_error, decode_result, encode
+
+        connection = _unix_http_connection(self.socket_path)
+        outcome: dict[str, Any] | None = None
+        try:
+            connection.request(
+                "POST",
+                f"/commands/{command}",
+                body=json.dumps({"args": encode(args), "kwargs": encode(kwargs)}),
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            if response.status != 200:
+                raise DaemonRequestFailedError(
+                    f"the daemon rejected {command}: {json.loads(response.read())['error']}"
+                )
+            for line in response:
+                message = json.loads(line)
+                if "log" not in message:
+                    outcome = message
+                    break
+                record = message["log"]
+                logger = log().bind(env=record["env"]) if record["env"] else log()
+                logger.log(record["level"], record["message"])
+        except OSError as e:
+            raise DaemonRequestFailedError(
+                f"the daemon could not be reached via {self.socket_path}"
+            ) from e
+        finally:
+            connection.close()
+        if outcome is None:
+            raise DaemonRequestFailedError(
+                f"the daemon stopped while running {command}"
+            )
+        if "error" in outcome:
+            raise decode_error(outcome["error"])
+        return decode_result(command, outcome["result"])
+
+
+def _unix_http_connection(socket_path: Path) -> http.client.HTTPConnection:
+    # only commands actually sent to the daemon should pay for importing the http client
+    import http.client
+
+    class UnixHTTPConnection(http.client.HTTPConnection):
+        def connect(self) -> None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(str(socket_path))
+
+    return UnixHTTPConnection("localhost")
@@ -0,0 +1,158 @@
+import builtins
+import dataclasses
+import inspect
+import types
+import typing
+from enum import Enum
+from pathlib import Path
+from typing import Any, Union
+
+from ... import exceptions
+from ...core import BoostUnionTestEnvCore
+
+# commands of the core the daemon exposes, and whether they change the testbed; the latter are run one after another
+COMMANDS = {
+    "init_testbed": True,
+    "list_infrastructures": False,
+    "setup_infrastructure": True,
+    "build_infrastructure": True,
+    "build_matrix": True,
+    "teardown_infrastructure": True,
+    "start_environment": True,
+    "stop_environment": True,
+    "restart_environment": True,
+    "wake_environment": True,
+    "destroy_environment": True,
+    "export_state": False,
+    "import_state": True,
+    "php_matrix": False,
+    "cache_stats": False,
+    "prune_cache": True,
+}
+
+
+def encode(value: Any) -> Any:
+    """Turns the given value into something json can serialize, e.g. dataclasses into dicts and paths into strings.
+
+    Args:
+        value (Any): an argument or the result of a command
+
+    Returns:
+        Any: the json serializable value
+    """
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {
+            f.name: encode(getattr(value, f.name)) for f in dataclasses.fields(value)
+        }
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Path):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    return value
+
+
+def decode(value: Any, hint: Any) -> Any:
+    """Restores a value encoded by encode(), guided by the type it should have.
+
+    Args:
+        value (Any): the value as read from json
+        hint (Any): the annotated type of the value
+
+    Returns:
+        Any: the restored value
+    """
+    if value is None:
+        return None
+    origin = typing.get_origin(hint)
+    if origin in (Union, types.UnionType):
+        # only optional values are used by the core, e.g. "Path | None"
+        hint = next(h for h in typing.get_args(hint) if h is not type(None))
+        origin = typing.get_origin(hint)
+    if origin is list:
+        (item_hint,) = typing.get_args(hint)
+        return [decode(v, item_hint) for v in value]
+    if dataclasses.is_dataclass(hint) and isinstance(hint, type):
+        hints = typing.get_type_hints(hint)
+        return hint(
+            **{
+                f.name: decode(value[f.name], hints[f.name])
+                for f in dataclasses.fields(hint)
+                if f.name in value
+            }
+        )
+    if isinstance(hint, type) and issubclass(hint, (Enum, Path)):
+        return hint(value)
+    return value
+
+
+def decode_arguments(
+    command: str, args: list[Any], kwargs: dict[str, Any]
+) -> tuple[tuple[Any, ...], dict[str, Any]]:
+    """Restores the arguments of a command of the core, as sent by the client.
+
+    Args:
+        command (str): name of the command
+        args (list[Any]): the encoded positional arguments
+        kwargs (dict[str, Any]): the encoded keyword arguments
+
+    Raises:
+        TypeError: raised if the arguments do not fit the command
+
+    Returns:
+        tuple[tuple[Any, ...], dict[str, Any]]: the arguments the command can be called with, without self
+    """
+    method = getattr(BoostUnionTestEnvCore, command)
+    hints = typing.get_type_hints(method)
+    signature = inspect.signature(method)
+    bound = signature.bind(None, *args, **kwargs)
+    for name, value in bound.arguments.items():
+        if name == "self":
+            continue
+        if signature.parameters[name].kind == inspect.Parameter.VAR_POSITIONAL:
+            bound.arguments[name] = tuple(decode(v, hints.get(name)) for v in value)
+        else:
+            bound.arguments[name] = decode(value, hints.get(name))
+    return bound.args[1:], bound.kwargs
+
+
+def decode_result(command: str, value: Any) -> Any:
+    return decode(
+        value, typing.get_type_hints(getattr(BoostUnionTestEnvCore, command))["return"]
+    )
+
+
+def encode_error(error: BaseException) -> dict[str, Any]:
+    return {
+        "type": type(error).__name__,
+        "args": encode(list(error.args)),
+        "attributes": encode(
+            {k: v for k, v in vars(error).items() if not k.startswith("_")}
+        ),
+    }
+
+
+def decode_error(error: dict[str, Any]) -> Exception:
+    """Restores an exception raised inside the daemon, so the client can handle it just like an exception of a local core.
+
+    Args:
+        error (dict[str, Any]): the exception as encoded by encode_error()
+
+    Returns:
+        Exception: the restored exception; a DaemonRequestFailedError if it's type is unknown to the client
+    """
+    cls = getattr(exceptions, error["type"], None) or getattr(
+        builtins, error["type"], None
+    )
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        return exceptions.DaemonRequestFailedError(
+            f"{error['type']}: {', '.join(str(a) for a in error['args'])}"
+        )
+    # the constructors of our exceptions take different arguments, so they are restored without calling them
+    restored: Exception = cls.__new__(cls)
+    restored.args = tuple(error["args"])
+    restored.__dict__.update(error["attributes"])
+    return restored
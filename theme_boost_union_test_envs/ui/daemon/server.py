@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import contextlib
+import errno
+import json
+import os
+import secrets
+import socketserver
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from ...core import BoostUnionTestEnvCore
+from ...cross_cutting import config, log, tracer
+from ...domain import invalidate_inventory
+from .client import RemoteCore
+from .protocol import COMMANDS, decode_arguments, encode, encode_error
+
+if TYPE_CHECKING:
+    import loguru
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    # a slow command must not keep the daemon from shutting down
+    daemon_threads = True
+
+
+class Daemon:
+    """Keeps a single core running in the background and serves it's commands to the CLI via HTTP on a Unix socket, so a command does not pay for starting the interpreter, reading the configuration and wiring the application again.
+    The configuration, the state store and all caches stay in memory between commands. Commands changing the testbed are run one after another, while commands only reading it are answered right away.
+
+    The API answers the following requests:
+        GET /status: pid of the daemon and the commands it serves
+        POST /commands/<command>: runs a command of the core with the "args" and "kwargs" of the json body. The answer is streamed as one json object per line: every message logged while running the command as {"log": ...}, followed by either {"result": ...} or {"error": ...}.
+
+    Args:
+        core (BoostUnionTestEnvCore): the core running the commands
+        socket_path (Path): the Unix socket the daemon listens on
+    """
+
+    def __init__(self, core: BoostUnionTestEnvCore, socket_path: Path) -> None:
+        self.core = core
+        self.socket_path = socket_path
+        self._mutations = threading.Lock()
+
+    def run(self, stop_event: threading.Event | None = None) -> None:
+        """Serves the API until the stop event is set or the process is interrupted.
+
+        Args:
+            stop_event (threading.Event | None, optional): stops the daemon once set. Defaults to None.
+        """
+        server = self.serve()
+        stop_event = stop_event or threading.Event()
+        try:
+            stop_event.wait()
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+    def serve(self) -> socketserver.ThreadingUnixStreamServer:
+        """Serves the API in a background thread.
+
+        Raises:
+            OSError: raised if another daemon is already listening on the socket
+
+        Returns:
+            socketserver.ThreadingUnixStreamServer: the running server, which needs to be shut down by the caller
+        """
+        if self.socket_path.exists():
+            if RemoteCore(self.socket_path).is_available():
+                raise OSError(
+                    errno.EADDRINUSE,
+                    "a daemon is already running",
+                    str(self.socket_path),
+                )
+            # left behind by a daemon that has been killed
+            self.socket_path.unlink()
+        # as long as the daemon runs, commands are recorded the same way as if they were run by the CLI itself
+        tracer().enabled = config().trace_file is not None
+        server = _UnixHTTPServer(str(self.socket_path), self._request_handler())
+        # the daemon is able to do anything the user running it can do
+        self.socket_path.chmod(0o600)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log().info(f"daemon listening @ {self.socket_path} (pid {os.getpid()})")
+        return server
+
+    def run_command(self, command: str, *args: Any, **kwargs: Any) -> Any:
+        """Runs a command of the core, waiting for other commands changing the testbed to finish first.
+
+        Args:
+            command (str): name of the command, one of COMMANDS
+            *args (Any): positional arguments of the command
+            **kwargs (Any): keyword arguments of the command
+
+        Returns:
+            Any: the result of the command
+        """
+        mutates = COMMANDS[command]
+        if mutates and not self._mutations.acquire(blocking=False):
+            log().info("waiting for another command to finish")
+            self._mutations.acquire()
+        try:
+            # the 'supervise' command changes the testbed from another process, so the testbed is looked at again for each command
+            invalidate_inventory()
+            return getattr(self.core, command)(*args, **kwargs)
+        finally:
+            if mutates:
+                self._mutations.release()
+            trace_file = config().trace_file
+            if trace_file is not None:
+                tracer().export(trace_file, config().trace_format, clear=True)
+
+    def _request_handler(self) -> type[BaseHTTPRequestHandler]:
+        daemon = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/status":
+                    self._send_json(HTTPStatus.NOT_FOUND, {"error": "unknown path"})
+                    return
+                self._send_json(
+                    HTTPStatus.OK, {"pid": os.getpid(), "commands": list(COMMANDS)}
+                )
+
+            def do_POST(self) -> None:
+                prefix, _, command = self.path.rpartition("/")
+                if prefix != "/commands" or command not in COMMANDS:
+                    self._send_json(HTTPStatus.NOT_FOUND, {"error": "unknown command"})
+                    return
+                try:
+                    body = json.loads(
+                        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                        or "{}"
+                    )
+                    args, kwargs = decode_arguments(
+                        command, body.get("args", []), body.get("kwargs", {})
+                    )
+                except (ValueError, TypeError, AttributeError) as e:
+                    self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                    return
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                # the length of the answer is not known upfront, so it ends with the connection
+                self.close_connection = True
+                self._run(command, args, kwargs)
+
+            def _run(self, command: str, args: Any, kwargs: Any) -> None:
+                lock = threading.Lock()
+
+                def write(line: dict[str, Any]) -> None:
+                    with lock, contextlib.suppress(OSError):
+                        # the client might be gone already, the command keeps running regardless
+                        self.wfile.write(json.dumps(line, default=str).encode() + b"\n")
+                        self.wfile.flush()
+
+                def forward(message: loguru.Message) -> None:
+                    record = message.record
+                    write(
+                        {
+                            "log": {
+                                "level": record["level"].name,
+                                "message": record["message"],
+                                "env": record["extra"].get("env"),
+                            }
+                        }
+                    )
+
+                # the messages of worker threads are forwarded too, as they run in the context of the request
+                request = secrets.token_hex(8)
+                sink = log().add(
+                    forward,
+                    filter=lambda record: record["extra"].get("request") == request,
+                )
+                try:
+                    with log().contextualize(request=request):
+                        result = daemon.run_command(command, *args, **kwargs)
+                except Exception as e:
+                    log().remove(sink)
+                    log().opt(exception=e).debug(f"{command} failed")
+                    write({"error": encode_error(e)})
+                else:
+                    log().remove(sink)
+                    write({"result": encode(result)})
+
+            def _send_json(self, status: HTTPStatus, body: dict[str, Any]) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                log().debug(format % args)
+
+        return RequestHandler
@@ -1,6 +1,7 @@
 from ...core import BoostUnionTestEnvCore
 from ...exceptions import UserInterfaceNotYetImplemented
+from ..daemon import RemoteCore
 
 
-def gui_main(core: BoostUnionTestEnvCore) -> None:
+def gui_main(core: BoostUnionTestEnvCore | RemoteCore) -> None:
     raise UserInterfaceNotYetImplemented("GUI is not yet implemented")